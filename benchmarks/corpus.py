@@ -0,0 +1,142 @@
+import argparse
+import json
+import math
+import random
+from pathlib import Path
+
+EXTENSIONS = [".jpg", ".jpg", ".jpg", ".png", ".heic"]
+
+
+def generate_corpus(
+    root: Path,
+    files: int = 1000,
+    size_distribution: str = "lognormal",
+    mean_size: int = 256 * 1024,
+    size_sigma: float = 1.0,
+    duplicate_ratio: float = 0.2,
+    collision_rate: float = 0.1,
+    depth: int = 2,
+    fanout: int = 4,
+    target_overlap: float = 0.0,
+    seed: int = 0,
+) -> dict:
+    # deterministic source tree under root/source plus a target under
+    # root/target holding target_overlap of the unique photos; the same
+    # arguments always produce byte-identical corpora
+    rng = random.Random(seed)
+    source = root / "source"
+    target = root / "target"
+    target.mkdir(parents=True, exist_ok=True)
+
+    folders = [source / "/".join(f"d{rng.randrange(fanout)}" for _ in range(depth))]
+    folders += [
+        source
+        / "/".join(f"d{rng.randrange(fanout)}" for _ in range(rng.randint(0, depth)))
+        for _ in range(fanout**depth)
+    ]
+    for folder in folders:
+        folder.mkdir(parents=True, exist_ok=True)
+
+    names: list[str] = []
+    unique: list[tuple[str, bytes]] = []
+    summary = {"files": 0, "bytes": 0, "duplicates": 0, "collisions": 0, "target": 0}
+    for idx in range(files):
+        if unique and rng.random() < duplicate_ratio:
+            name, contents = rng.choice(unique)
+            summary["duplicates"] += 1
+        else:
+            contents = rng.randbytes(
+                _size(rng, size_distribution, mean_size, size_sigma)
+            )
+            if names and rng.random() < collision_rate:
+                name = rng.choice(names)
+                summary["collisions"] += 1
+            else:
+                name = f"IMG_{idx:07d}{rng.choice(EXTENSIONS)}"
+                names.append(name)
+            unique.append((name, contents))
+            if rng.random() < target_overlap:
+                (target / f"{len(unique):07d}_{name}").write_bytes(contents)
+                summary["target"] += 1
+
+        folder = rng.choice(folders)
+        path = folder / name
+        while path.exists():
+            folder = folder / "more"
+            folder.mkdir(exist_ok=True)
+            path = folder / name
+        path.write_bytes(contents)
+        summary["files"] += 1
+        summary["bytes"] += len(contents)
+
+    return summary
+
+
+def _size(rng: random.Random, distribution: str, mean: int, sigma: float) -> int:
+    if distribution == "fixed":
+        return mean
+    if distribution == "uniform":
+        return rng.randint(1, 2 * mean)
+    if distribution == "lognormal":
+        # mean of a lognormal is exp(mu + sigma^2 / 2)
+        mu = math.log(mean) - sigma**2 / 2
+        return max(1, int(rng.lognormvariate(mu, sigma)))
+    raise ValueError(f"Unknown size distribution: {distribution}")
+
+
+def add_corpus_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--files", type=int, default=1000, help="Source photos")
+    parser.add_argument(
+        "--size_distribution",
+        choices=["fixed", "uniform", "lognormal"],
+        default="lognormal",
+    )
+    parser.add_argument(
+        "--mean_size", type=int, default=256 * 1024, help="Mean file size in bytes"
+    )
+    parser.add_argument(
+        "--size_sigma", type=float, default=1.0, help="Spread of lognormal sizes"
+    )
+    parser.add_argument(
+        "--duplicate_ratio", type=float, default=0.2, help="Share of byte duplicates"
+    )
+    parser.add_argument(
+        "--collision_rate",
+        type=float,
+        default=0.1,
+        help="Share of new photos reusing an earlier name",
+    )
+    parser.add_argument("--depth", type=int, default=2, help="Directory depth")
+    parser.add_argument(
+        "--fanout", type=int, default=4, help="Subdirectories per level"
+    )
+    parser.add_argument(
+        "--target_overlap",
+        type=float,
+        default=0.0,
+        help="Share of unique photos already in the target",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def corpus_options(args: argparse.Namespace) -> dict:
+    return {
+        "files": args.files,
+        "size_distribution": args.size_distribution,
+        "mean_size": args.mean_size,
+        "size_sigma": args.size_sigma,
+        "duplicate_ratio": args.duplicate_ratio,
+        "collision_rate": args.collision_rate,
+        "depth": args.depth,
+        "fanout": args.fanout,
+        "target_overlap": args.target_overlap,
+        "seed": args.seed,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic photo corpus.")
+    parser.add_argument("root", type=Path, help="Directory to create the corpus in")
+    add_corpus_arguments(parser)
+    args = parser.parse_args()
+    print(json.dumps(generate_corpus(args.root, **corpus_options(args)), indent=2))
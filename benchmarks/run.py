@@ -0,0 +1,191 @@
+import argparse
+import json
+import multiprocessing
+import queue
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+from pathlib import Path
+
+from corpus import add_corpus_arguments, corpus_options, generate_corpus
+
+EXTENSIONS = {".jpg", ".png", ".heic"}
+STAGES = ["scan", "hash", "initialize", "process", "main"]
+DEFAULT_TOLERANCE = 0.1
+
+
+def run_stage(stage: str, root: str, results):
+    # runs in a fresh spawned process so peak RSS belongs to this stage alone;
+    # a failure goes back as its traceback instead of leaving measure waiting
+    try:
+        results.put(("ok", stage_result(stage, root)))
+    except BaseException:
+        results.put(("error", traceback.format_exc()))
+
+
+def stage_result(stage: str, root: str) -> tuple:
+    from photomerge import initialize_hashes, main, process_files
+    from photomerge.get_files import find_files_with_extensions
+    from photomerge.hash_files import calculate_hash
+
+    source, target = Path(root) / "source", Path(root) / "target"
+    out_dir = Path(root) / f"out-{stage}"
+    if stage in ("process", "main"):
+        shutil.rmtree(out_dir, ignore_errors=True)
+        shutil.copytree(target, out_dir)
+
+    records = list(find_files_with_extensions(source, EXTENSIONS))
+    size = sum(record.size for record in records)
+
+    start = time.perf_counter()
+    if stage == "scan":
+        records = list(find_files_with_extensions(source, EXTENSIONS))
+    elif stage == "hash":
+        for record in records:
+            calculate_hash(record.path)
+    elif stage == "initialize":
+        hashes, _ = initialize_hashes(EXTENSIONS, target)
+        # initialize only sizes the target, hashing it is what a merge costs
+        for entry in hashes:
+            hashes.full_hash(entry)
+        records = list(hashes)
+        size = sum(entry.size for entry in records)
+    elif stage == "process":
+        hashes, filenames = initialize_hashes(EXTENSIONS, out_dir)
+        process_files(source, out_dir, hashes, filenames, EXTENSIONS, set(), True)
+    elif stage == "main":
+        sys.argv = ["photomerge", "--source", str(source), "--target", str(out_dir)]
+        main()
+    elapsed = time.perf_counter() - start
+
+    shutil.rmtree(out_dir, ignore_errors=True)
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return elapsed, len(records), size, peak_kb
+
+
+def measure(stage: str, root: Path, repeat: int) -> dict:
+    # best of repeat runs; page cache is warm after the first one
+    context = multiprocessing.get_context("spawn")
+    runs = []
+    for _ in range(repeat):
+        results = context.Queue()
+        process = context.Process(target=run_stage, args=(stage, str(root), results))
+        process.start()
+        runs.append(wait_for_result(stage, process, results))
+
+    elapsed, files, size, peak_kb = min(runs)
+    return {
+        "seconds": round(elapsed, 4),
+        "files": files,
+        "files_per_second": round(files / elapsed, 1) if elapsed else None,
+        "mb_per_second": round(size / 2**20 / elapsed, 1) if elapsed else None,
+        "peak_rss_mb": round(max(run[3] for run in runs) / 1024, 1),
+    }
+
+
+def wait_for_result(stage: str, process, results) -> tuple:
+    # a child killed outright (OOM, a crash in C) never reports back
+    while True:
+        try:
+            status, result = results.get(timeout=1)
+            break
+        except queue.Empty:
+            if process.is_alive():
+                continue
+            try:
+                status, result = results.get_nowait()
+                break
+            except queue.Empty:
+                raise RuntimeError(
+                    f"{stage} exited with {process.exitcode} and no result"
+                ) from None
+    process.join()
+    if status == "error":
+        raise RuntimeError(f"{stage} failed:\n{result}")
+    return result
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    # a stage regresses when its throughput drops by more than tolerance or
+    # its peak RSS grows by more than tolerance
+    regressions = []
+    for stage, result in results.items():
+        base = baseline.get(stage)
+        if base is None:
+            continue
+        if result["files_per_second"] < base["files_per_second"] * (1 - tolerance):
+            regressions.append(
+                f"{stage}: {result['files_per_second']} files/s, "
+                f"baseline {base['files_per_second']}"
+            )
+        if result["peak_rss_mb"] > base["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(
+                f"{stage}: {result['peak_rss_mb']} MB peak RSS, "
+                f"baseline {base['peak_rss_mb']}"
+            )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark PhotoMerge stages.")
+    parser.add_argument(
+        "--corpus", type=Path, help="Existing corpus directory (default: generate one)"
+    )
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage")
+    parser.add_argument("--baseline", type=Path, help="Baseline JSON to compare with")
+    parser.add_argument(
+        "--save_baseline", action="store_true", help="Write results to --baseline"
+    )
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--output", type=Path, help="Write results as JSON")
+    add_corpus_arguments(parser)
+    args = parser.parse_args()
+
+    temp_dir = None
+    root = args.corpus
+    if root is None:
+        temp_dir = tempfile.TemporaryDirectory(prefix="photomerge-bench-")
+        root = Path(temp_dir.name)
+    if not (root / "source").exists():
+        summary = generate_corpus(root, **corpus_options(args))
+        print(f"Corpus: {json.dumps(summary)}")
+
+    try:
+        results = {}
+        for stage in args.stages:
+            results[stage] = measure(stage, root, args.repeat)
+            result = results[stage]
+            print(
+                f"{stage:<12}{result['seconds']:>10.3f} s"
+                f"{result['files_per_second']:>12} files/s"
+                f"{result['mb_per_second']:>10} MB/s"
+                f"{result['peak_rss_mb']:>10} MB peak RSS"
+            )
+    finally:
+        if temp_dir is not None:
+            temp_dir.cleanup()
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+
+    if args.baseline is None:
+        return 0
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2))
+        print(f"Saved baseline: {args.baseline}")
+        return 0
+
+    regressions = compare(
+        results, json.loads(args.baseline.read_text()), args.tolerance
+    )
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,19 +2,62 @@
 
 
 import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+import threading
+import time
 from pathlib import Path
 import tomllib
-from collections.abc import Iterable
+from collections.abc import Callable, Generator, Iterable
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
+from itertools import islice
 
-from .copy_files import copy_file
-from .get_files import find_files_with_extensions
-from .hash_files import calculate_hash
-from .logger import setup_logging, add_console_handler
+from .copy_files import COPY_STRATEGIES, copy_file, copy_with_hash
+from .device_files import device_readers, group_by_device
+from .get_files import (
+    DEFAULT_READ_BATCH,
+    READ_ORDERS,
+    FileRecord,
+    find_files_with_extensions,
+    order_records,
+)
+from .hash_files import DEFAULT_ALGORITHM, DEFAULT_BUFFER_SIZE, create_executor
+from .index_files import INDEX_FILENAME, TargetIndex
+from .journal_files import DEFAULT_SYNC_SECONDS, JOURNAL_FILENAME, Journal
+from .layout_files import FlatLayout, create_layout
+from .match_files import HashIndex, IndexEntry
+from .metrics import METRICS, TextfileExporter, counter_difference
+from .name_files import NameIndex
+from .pipeline import DEFAULT_QUEUE_SIZE, run_pipeline
+from .plan_files import PlanWriter, apply_plan, read_plan_header
+from .server import SOCKET_FILENAME, MergeServer, submit
+from .similar_files import DEFAULT_THRESHOLD, Image, SimilarIndex
+from .snapshot_files import SNAPSHOT_FILENAME, SourceSnapshot
+from .throttle_files import (
+    DEFAULT_ADAPTIVE_MAX,
+    DEFAULT_ADAPTIVE_SECONDS,
+    READ_LIMIT,
+    WRITE_LIMIT,
+    AdaptiveLimit,
+    apply_throttle,
+)
+from .watch_files import (
+    DEFAULT_POLL_SECONDS,
+    DEFAULT_SETTLE_SECONDS,
+    create_watcher,
+    watch,
+)
+from .logger import DEFAULT_LOG_FILE, add_console_handler, get_logger, setup_logging
 
 
 DEFAULT_CONFIG = Path(__file__).parent / "config" / "config.toml"
-LOG_FILE = Path(__file__).parent / "logs" / "app.log"
-LOGGER = setup_logging(LOG_FILE)
+LOGGER = get_logger()
+LOG_LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR"]
+DEFAULT_BATCH_SIZE = 1024
 
 
 def app_arg_parser() -> argparse.ArgumentParser:
@@ -22,22 +65,210 @@ def app_arg_parser() -> argparse.ArgumentParser:
         description="Process source, target, verbosity, recursive search and config arguments."
     )
 
+    parser.add_argument(
+        "--source",
+        "-s",
+        required=True,
+        nargs="+",
+        help="Source file or directory paths, merged in one run",
+    )
+    parser.add_argument("--target", "-t", required=True, help="Target directory path")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Verbose output")
+    parser.add_argument(
+        "--non_recursive", "-n", action="store_false", help="Disable recursive search"
+    )
+    parser.add_argument("--config", "-c", help="Configuration file path")
+    parser.add_argument(
+        "--workers", "-w", type=int, help="Number of parallel hashing workers"
+    )
+    parser.add_argument(
+        "--copy_strategy",
+        choices=["auto", *COPY_STRATEGIES],
+        help="How new photos are written to the target",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Overlap scanning, hashing and copying in separate stages",
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Pipeline whose hash and copy workers grow and shrink with throughput",
+    )
+    parser.add_argument(
+        "--read_order",
+        choices=READ_ORDERS,
+        help="Order source files are read in, inode or physical for spinning disks",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip source files an interrupted run already merged",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only look at source files added or changed since the last run",
+    )
+    add_run_arguments(parser)
+
+    return parser
+
+
+def plan_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="photomerge plan",
+        description="Scan and hash, then write the copies a merge would make to a plan.",
+    )
     parser.add_argument(
         "--source", "-s", required=True, help="Source file or directory path"
     )
     parser.add_argument("--target", "-t", required=True, help="Target directory path")
+    parser.add_argument("--plan", "-p", required=True, help="Plan file to write")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Verbose output")
+    parser.add_argument(
+        "--non_recursive", "-n", action="store_false", help="Disable recursive search"
+    )
+    parser.add_argument("--config", "-c", help="Configuration file path")
+    parser.add_argument(
+        "--workers", "-w", type=int, help="Number of parallel hashing workers"
+    )
+    add_run_arguments(parser)
+
+    return parser
+
+
+def apply_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="photomerge apply",
+        description="Copy the new photos listed in a plan without hashing them again.",
+    )
+    parser.add_argument("--plan", "-p", required=True, help="Plan file to apply")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Verbose output")
+    parser.add_argument("--config", "-c", help="Configuration file path")
+    parser.add_argument("--workers", "-w", type=int, help="Number of parallel copiers")
+    parser.add_argument(
+        "--start", type=int, default=0, help="Resume from this action number"
+    )
+    parser.add_argument(
+        "--copy_strategy",
+        choices=["auto", *COPY_STRATEGIES],
+        help="How new photos are written to the target",
+    )
+    add_run_arguments(parser)
+
+    return parser
+
+
+def watch_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="photomerge watch",
+        description="Keep the target indexed and merge photos as they arrive.",
+    )
+    parser.add_argument(
+        "--source",
+        "-s",
+        required=True,
+        nargs="+",
+        help="Source directories to watch",
+    )
+    parser.add_argument("--target", "-t", required=True, help="Target directory path")
     parser.add_argument("--verbose", "-v", action="store_true", help="Verbose output")
     parser.add_argument(
         "--non_recursive", "-n", action="store_false", help="Disable recursive search"
     )
     parser.add_argument("--config", "-c", help="Configuration file path")
+    parser.add_argument(
+        "--copy_strategy",
+        choices=["auto", *COPY_STRATEGIES],
+        help="How new photos are written to the target",
+    )
+    parser.add_argument(
+        "--settle",
+        type=float,
+        help="Seconds a file must stay unchanged before it's merged",
+    )
+    parser.add_argument(
+        "--poll", action="store_true", help="Poll the sources instead of inotify"
+    )
+    add_run_arguments(parser)
 
     return parser
 
 
+def serve_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="photomerge serve",
+        description="Keep the target indexed and run merge jobs sent to a socket.",
+    )
+    parser.add_argument("--target", "-t", required=True, help="Target directory path")
+    parser.add_argument(
+        "--socket", help="Unix socket to listen on (default: in the target)"
+    )
+    parser.add_argument("--verbose", "-v", action="store_true", help="Verbose output")
+    parser.add_argument("--config", "-c", help="Configuration file path")
+    parser.add_argument(
+        "--workers", "-w", type=int, help="Number of parallel hashing workers"
+    )
+    parser.add_argument(
+        "--copy_strategy",
+        choices=["auto", *COPY_STRATEGIES],
+        help="How new photos are written to the target",
+    )
+    add_run_arguments(parser)
+
+    return parser
+
+
+def submit_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="photomerge submit",
+        description="Send a merge job to a running photomerge serve.",
+    )
+    server = parser.add_mutually_exclusive_group(required=True)
+    server.add_argument("--target", "-t", help="Target directory of the server")
+    server.add_argument("--socket", help="Unix socket of the server")
+    parser.add_argument(
+        "--source", "-s", nargs="+", help="Source file or directory paths to merge"
+    )
+    parser.add_argument(
+        "--non_recursive", "-n", action="store_false", help="Disable recursive search"
+    )
+    parser.add_argument(
+        "--stats", action="store_true", help="Print the server's statistics"
+    )
+    parser.add_argument("--shutdown", action="store_true", help="Stop the server")
+
+    return parser
+
+
+def add_run_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--stats_json", help="Write counters and timings of the run to this file"
+    )
+    parser.add_argument("--log_file", help="Log file path")
+    parser.add_argument(
+        "--max_read_mbps", type=float, help="Cap on reads in MB/s, 0 for none"
+    )
+    parser.add_argument(
+        "--max_write_mbps", type=float, help="Cap on writes in MB/s, 0 for none"
+    )
+    parser.add_argument(
+        "--low_priority",
+        action="store_true",
+        help="Run at idle I/O and lowest CPU priority",
+    )
+    parser.add_argument(
+        "--log_level",
+        choices=LOG_LEVELS,
+        help="WARNING and above skip the per-file messages",
+    )
+
+
 def get_config(config_path: Path | None) -> dict:
     if config_path:
-        LOGGER.info(f"Using custom config file: {config_path}")
+        LOGGER.info("Using custom config file: %s", config_path)
     else:
         config_path = DEFAULT_CONFIG
         LOGGER.info("Using default config file")
@@ -47,31 +278,60 @@ def get_config(config_path: Path | None) -> dict:
             config = tomllib.load(f)
         return config
     except FileNotFoundError:
-        LOGGER.error(f"Config file not found: {config_path}")
+        LOGGER.error("Config file not found: %s", config_path)
         raise
 
 
 def initialize_paths(source: str, target: str) -> tuple[Path, Path]:
     source_dir = Path(source)
     if not source_dir.exists():
-        LOGGER.error(f"Source directory does not exist: {source_dir}")
+        LOGGER.error("Source directory does not exist: %s", source_dir)
         raise FileNotFoundError(f"Source directory does not exist: {source_dir}")
 
+    return source_dir, initialize_target(target)
+
+
+def initialize_target(target: str) -> Path:
     target_dir = Path(target)
     if not target_dir.exists():
-        LOGGER.error(f"Target directory does not exist: {target_dir}")
+        LOGGER.error("Target directory does not exist: %s", target_dir)
         raise FileNotFoundError(f"Target directory does not exist: {target_dir}")
 
-    return source_dir, target_dir
+    return target_dir
 
 
-def initialize_hashes(extensions: Iterable, out_dir: Path) -> tuple[set, set]:
-    hashes = set()
-    filenames = set()
+def initialize_hashes(
+    extensions: Iterable,
+    out_dir: Path,
+    hash_options: dict | None = None,
+    index_path: Path | None = None,
+    layout: FlatLayout | None = None,
+) -> tuple[HashIndex, NameIndex]:
+    # target files are only indexed by size here, they get hashed lazily when a
+    # source file of the same size turns up; with an index_path, digests from
+    # earlier runs are reused for files whose stat hasn't changed and
+    # unchanged shard folders aren't listed at all
+    layout = layout or FlatLayout()
+    store = TargetIndex(out_dir, index_path, hash_options) if index_path else None
+    hashes = HashIndex(hash_options, store=store)
+    filenames = NameIndex()
+
+    if store is not None:
+        entries = store.scan(extensions, is_recursive=layout.is_sharded)
+    else:
+        entries = (
+            IndexEntry(record.path, record.size)
+            for record in find_files_with_extensions(
+                out_dir, extensions, is_recursive=layout.is_sharded
+            )
+        )
+    for entry in entries:
+        hashes.add(entry)
+        filenames.add(entry.path.name)
+    layout.start(len(hashes))
 
-    for file in find_files_with_extensions(out_dir, extensions, is_recursive=False):
-        hashes.add(calculate_hash(file))
-        filenames.add(file.name)
+    if store is not None:
+        LOGGER.info("Loaded hash index: %s", store.index_path)
 
     return hashes, filenames
 
@@ -79,47 +339,938 @@ def initialize_hashes(extensions: Iterable, out_dir: Path) -> tuple[set, set]:
 def process_files(
     data_dir: Path,
     out_dir: Path,
-    hashes: set[str],
-    filenames: set[str],
+    hashes: HashIndex,
+    filenames: NameIndex,
     allowed_extensions: set[str],
     ignored_files: set,
     is_recursive: bool,
+    executor: Executor | None = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    pipeline: dict | None = None,
+    ignored_dirs: Iterable[str] = (),
+    scan_workers: int = 1,
+    copy_strategy: str = "copy",
+    layout: FlatLayout | None = None,
+    similar: SimilarIndex | None = None,
+    journal: Journal | None = None,
+    read_order: str = "directory",
+    read_batch: int = DEFAULT_READ_BATCH,
+    snapshot: SourceSnapshot | None = None,
+    progress: Callable[[Path, str], None] | None = None,
 ):
-    # process source files
-    for file in find_files_with_extensions(
-        data_dir, allowed_extensions, is_recursive=is_recursive
+    entries = source_entries(
+        data_dir,
+        allowed_extensions,
+        ignored_files,
+        is_recursive,
+        ignored_dirs=ignored_dirs,
+        scan_workers=scan_workers,
+        journal=journal,
+        read_order=read_order,
+        read_batch=read_batch,
+        snapshot=snapshot,
+    )
+
+    # a streamed copy hashes the file as it writes it, so don't read it first
+    defer_full_hash = copy_strategy == "stream"
+
+    if pipeline is not None:
+        # overlap scanning, hashing and copying; order of copies isn't kept
+        run_pipeline(
+            entries,
+            decide=partial(
+                claim_file,
+                hashes=hashes,
+                filenames=filenames,
+                defer_full_hash=defer_full_hash,
+                similar=similar,
+                journal=journal,
+                progress=progress,
+            ),
+            save=partial(
+                save_file,
+                out_dir=out_dir,
+                hashes=hashes,
+                filenames=filenames,
+                copy_strategy=copy_strategy,
+                layout=layout,
+                journal=journal,
+                progress=progress,
+            ),
+            **pipeline,
+        )
+        return
+
+    if executor is None and (similar is None or similar.executor is None):
+        for entry in entries:
+            merge_file(
+                entry,
+                out_dir,
+                hashes,
+                filenames,
+                copy_strategy,
+                layout,
+                similar,
+                journal,
+                progress,
+            )
+        return
+
+    # hash (and decode, for similarity) each batch in parallel, then merge it
+    # in the original order
+    while batch := list(islice(entries, batch_size)):
+        if executor is not None:
+            hashes.prefetch(batch, executor, defer_full_hash)
+        if similar is not None:
+            similar.prefetch(entry.path for entry in batch)
+        for entry in batch:
+            merge_file(
+                entry,
+                out_dir,
+                hashes,
+                filenames,
+                copy_strategy,
+                layout,
+                similar,
+                journal,
+                progress,
+            )
+
+
+def merge_sources(
+    data_dirs: list[Path],
+    workers_config: dict,
+    hash_workers: int,
+    use_pipeline: bool = False,
+    adaptive: bool = False,
+    **options,
+):
+    # sources are grouped by block device and the devices merged side by side
+    # into the shared indexes, each with as many readers as it can take;
+    # adaptive pipelines start there and move between 1 and adaptive_max
+    # workers per stage. options go to process_files
+    devices = group_by_device(data_dirs)
+    interval = workers_config.get("adaptive_seconds", DEFAULT_ADAPTIVE_SECONDS)
+    adaptive_max = max(
+        workers_config.get("adaptive_max", DEFAULT_ADAPTIVE_MAX), hash_workers
+    )
+
+    def merge_device(device: int, device_dirs: list[Path]):
+        readers = device_readers(
+            device, hash_workers, workers_config.get("rotational", 1)
+        )
+        LOGGER.info("Device %s: %s readers for %s", device, readers, device_dirs)
+        if use_pipeline or adaptive:
+            pipeline = {
+                "hash_workers": readers,
+                "copy_workers": workers_config.get("copy", 1),
+                "queue_size": workers_config.get("queue_size", DEFAULT_QUEUE_SIZE),
+            }
+            if adaptive:
+                # a spinning disk still never gets more than its readers
+                # stages are measured by what they read and write, not by
+                # file sizes, most of a duplicate is never read
+                pipeline["hash_limit"] = AdaptiveLimit(
+                    "hash",
+                    readers,
+                    device_readers(
+                        device, adaptive_max, workers_config.get("rotational", 1)
+                    ),
+                    interval=interval,
+                    meter=READ_LIMIT,
+                )
+                pipeline["copy_limit"] = AdaptiveLimit(
+                    "copy",
+                    pipeline["copy_workers"],
+                    adaptive_max,
+                    interval=interval,
+                    meter=WRITE_LIMIT,
+                )
+            executor = None
+        else:
+            pipeline = None
+            executor = create_executor(readers, workers_config.get("pool", "thread"))
+
+        try:
+            for data_dir in device_dirs:
+                process_files(
+                    data_dir=data_dir, executor=executor, pipeline=pipeline, **options
+                )
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    if len(devices) == 1:
+        merge_device(*next(iter(devices.items())))
+        return
+
+    with ThreadPoolExecutor(max_workers=len(devices)) as executor:
+        futures = [
+            executor.submit(merge_device, device, device_dirs)
+            for device, device_dirs in devices.items()
+        ]
+        for future in futures:
+            future.result()
+
+
+def plan_merge(
+    writer: PlanWriter,
+    entries: Iterable[IndexEntry],
+    hashes: HashIndex,
+    filenames: NameIndex,
+    layout: FlatLayout,
+    executor: Executor | None = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    similar: SimilarIndex | None = None,
+):
+    # the decisions process_files would make, written to a plan instead of
+    # acted on; new photos are hashed in full here so apply never has to
+    entries = iter(entries)
+    while batch := list(islice(entries, batch_size)):
+        if executor is not None:
+            hashes.prefetch(batch, executor)
+            hashes.prefetch_digests(batch, executor)
+        if similar is not None:
+            similar.prefetch(entry.path for entry in batch)
+        for entry in batch:
+            writer.write(plan_action(entry, hashes, filenames, layout, similar))
+
+
+def plan_action(
+    entry: IndexEntry,
+    hashes: HashIndex,
+    filenames: NameIndex,
+    layout: FlatLayout,
+    similar: SimilarIndex | None = None,
+) -> dict:
+    source = str(entry.path)
+    if hashes.claim(entry) is not None:
+        METRICS.count("duplicates")
+        return {"action": "skip", "source": source, "reason": "duplicate"}
+
+    if similar is not None and (original := similar.claim(entry.path)) is not None:
+        METRICS.count("similar_photos")
+        return {
+            "action": "skip",
+            "source": source,
+            "reason": "similar",
+            "like": str(original),
+        }
+
+    METRICS.count("new_photos")
+    LOGGER.info("New photo found: %s", entry.path.name)
+    new_name = filenames.claim(entry.path.name)
+    return {
+        "action": "copy" if new_name == entry.path.name else "rename",
+        "source": source,
+        "name": new_name,
+        "size": entry.size,
+        "mtime_ns": entry.path.stat().st_mtime_ns,
+        "partial": hashes.partial_hash(entry),
+        "digest": hashes.full_hash(entry),
+        "folder": layout.folder(entry),
+    }
+
+
+def source_entries(
+    data_dir: Path,
+    allowed_extensions: set[str],
+    ignored_files: set,
+    is_recursive: bool,
+    ignored_dirs: Iterable[str] = (),
+    scan_workers: int = 1,
+    journal: Journal | None = None,
+    read_order: str = "directory",
+    read_batch: int = DEFAULT_READ_BATCH,
+    snapshot: SourceSnapshot | None = None,
+) -> Generator[IndexEntry, None, None]:
+    # with a snapshot only files added or changed since the last run are seen
+    if snapshot is not None:
+        records = snapshot.scan(
+            data_dir, allowed_extensions, ignored_dirs, is_recursive
+        )
+    else:
+        records = find_files_with_extensions(
+            data_dir,
+            allowed_extensions,
+            is_recursive=is_recursive,
+            ignored_dirs=ignored_dirs,
+            workers=scan_workers,
+        )
+    for record in order_records(
+        wanted_records(records, ignored_files, journal, snapshot),
+        read_order,
+        read_batch,
     ):
-        if file.name in ignored_files:
-            LOGGER.info(f"Ignoring file: {file.name}")
+        yield IndexEntry(record.path, record.size)
+
+
+def wanted_records(
+    records: Iterable[FileRecord],
+    ignored_files: set,
+    journal: Journal | None = None,
+    snapshot: SourceSnapshot | None = None,
+) -> Generator[FileRecord, None, None]:
+    for record in records:
+        if record.name in ignored_files:
+            LOGGER.info("Ignoring file: %s", record.name)
+            if snapshot is not None:
+                snapshot.finish(record.path, "ignored")
             continue
 
-        file_hash = calculate_hash(file)
-        if file_hash not in hashes:
-            LOGGER.info(f"New photo found: {file.name}")
-            hashes.add(file_hash)
-
-            if file.name not in filenames:
-                filenames.add(file.name)
-                suceeded = copy_file(file, out_dir)
-                if not suceeded:
-                    LOGGER.error(f"Failed to copy file: {file.name}")
-                else:
-                    LOGGER.info(f"Saved: {file.name} in {out_dir}")
-                continue
-
-            idx = 1
-            while (out_dir / (new_name := f"{file.stem}_{idx}{file.suffix}")).exists():
-                idx += 1
-            filenames.add(new_name)
-            suceeded = copy_file(file, out_dir / new_name)
-            if not suceeded:
-                LOGGER.error(f"Failed to copy duplicate file: {file.name}")
-            else:
-                LOGGER.info(f"Saved: {file.name} in {out_dir} as {new_name}")
+        if journal is not None and journal.is_completed(record):
+            METRICS.count("resumed")
+            LOGGER.debug("Already merged: %s", record.path)
+            if snapshot is not None:
+                snapshot.finish(record.path, "resumed")
+            continue
+
+        yield record
+
+
+def merge_file(
+    entry: IndexEntry,
+    out_dir: Path,
+    hashes: HashIndex,
+    filenames: NameIndex,
+    copy_strategy: str = "copy",
+    layout: FlatLayout | None = None,
+    similar: SimilarIndex | None = None,
+    journal: Journal | None = None,
+    progress: Callable[[Path, str], None] | None = None,
+):
+    new_name = claim_file(
+        entry, hashes, filenames, copy_strategy == "stream", similar, journal, progress
+    )
+    if new_name is not None:
+        save_file(
+            entry,
+            new_name,
+            out_dir,
+            hashes,
+            filenames,
+            copy_strategy,
+            layout,
+            journal,
+            progress,
+        )
+
+
+def claim_file(
+    entry: IndexEntry,
+    hashes: HashIndex,
+    filenames: NameIndex,
+    defer_full_hash: bool = False,
+    similar: SimilarIndex | None = None,
+    journal: Journal | None = None,
+    progress: Callable[[Path, str], None] | None = None,
+) -> str | None:
+    # returns the target name for a new photo, or None for a duplicate
+    if hashes.claim(entry, defer_full_hash) is not None:
+        METRICS.count("duplicates")
+        report_outcome(entry, "duplicate", journal, progress)
+        return None
+
+    if similar is not None and (original := similar.claim(entry.path)) is not None:
+        hashes.release(entry)
+        METRICS.count("similar_photos")
+        LOGGER.info("Similar photo found: %s looks like %s", entry.path.name, original)
+        report_outcome(entry, "similar", journal, progress)
+        return None
+
+    METRICS.count("new_photos")
+    LOGGER.info("New photo found: %s", entry.path.name)
+    return filenames.claim(entry.path.name)
+
+
+def save_file(
+    entry: IndexEntry,
+    new_name: str,
+    out_dir: Path,
+    hashes: HashIndex,
+    filenames: NameIndex,
+    copy_strategy: str = "copy",
+    layout: FlatLayout | None = None,
+    journal: Journal | None = None,
+    progress: Callable[[Path, str], None] | None = None,
+):
+    file = entry.path
+    layout = layout or FlatLayout()
+    try:
+        if copy_strategy == "stream":
+            # the temp copy sits next to this path until it's settled
+            if journal is not None:
+                journal.start(entry, out_dir / new_name)
+            folder = stream_file(entry, new_name, out_dir, hashes, layout, journal)
+            if folder is None:
+                filenames.release(new_name)
+                METRICS.count("duplicates")
+                LOGGER.info("Discarded duplicate photo: %s", file.name)
+                report_outcome(entry, "duplicate", journal, progress)
+                return
+            suceeded = True
+        else:
+            folder = target_folder(entry, out_dir, hashes, layout)
+            if journal is not None:
+                journal.start(entry, folder / new_name)
+            suceeded = copy_file(file, folder / new_name, copy_strategy)
+    except Exception as err:
+        METRICS.count("errors", stage="copy")
+        LOGGER.error(
+            "Error attempting to copy file %s to %s - %s", file, out_dir / new_name, err
+        )
+        folder, suceeded = out_dir, False
+
+    report_outcome(
+        entry, "copied" if suceeded else "failed", journal, progress, folder / new_name
+    )
+
+    if new_name == file.name:
+        if not suceeded:
+            LOGGER.error("Failed to copy file: %s", file.name)
+        else:
+            hashes.record(entry, folder / new_name)
+            LOGGER.info("Saved: %s in %s", file.name, folder)
+        return
+
+    if not suceeded:
+        LOGGER.error("Failed to copy duplicate file: %s", file.name)
+    else:
+        hashes.record(entry, folder / new_name)
+        LOGGER.info("Saved: %s in %s as %s", file.name, folder, new_name)
+
+
+def report_outcome(
+    entry: IndexEntry,
+    outcome: str,
+    journal: Journal | None = None,
+    progress: Callable[[Path, str], None] | None = None,
+    destination: Path | None = None,
+):
+    # outcome is copied, duplicate, similar or failed; progress is called from
+    # whichever thread handled the file
+    if journal is not None:
+        journal.finish(entry, outcome, destination)
+    if progress is not None:
+        progress(entry.path, outcome)
+
+
+def target_folder(
+    entry: IndexEntry, out_dir: Path, hashes: HashIndex, layout: FlatLayout
+) -> Path:
+    if layout.needs_digest:
+        hashes.full_hash(entry)
+    folder = out_dir / layout.folder(entry)
+    if layout.is_sharded:
+        folder.mkdir(parents=True, exist_ok=True)
+    return folder
+
+
+def stream_file(
+    entry: IndexEntry,
+    new_name: str,
+    out_dir: Path,
+    hashes: HashIndex,
+    layout: FlatLayout,
+    journal: Journal | None = None,
+) -> Path | None:
+    # copy and hash in one pass into the target root; a deferred claim is
+    # settled with the digest and the copy is renamed into its folder, or
+    # dropped before it ever appears under its final name if the file turned
+    # out to be a duplicate (returns None). the folder is journaled before
+    # the rename, a crash after it must find the copy where it ended up
+    temp_path = None
+    try:
+        with METRICS.timer("copy"):
+            temp_path, digest = copy_with_hash(
+                entry.path,
+                out_dir / new_name,
+                algorithm=hashes.hash_options.get("algorithm", DEFAULT_ALGORITHM),
+                buffer_size=hashes.hash_options.get("buffer_size", DEFAULT_BUFFER_SIZE),
+            )
+        if entry.digest is not None and entry.digest != digest:
+            raise OSError(f"{entry.path} changed since it was hashed")
+
+        entry.digest = digest
+        if hashes.settle(entry) is not None:
+            temp_path.unlink()
+            return None
+
+        folder = target_folder(entry, out_dir, hashes, layout)
+        if journal is not None and folder != out_dir:
+            journal.start(entry, folder / new_name)
+        os.replace(temp_path, folder / new_name)
+        METRICS.count("files_copied")
+        METRICS.count("bytes_copied", entry.size)
+        return folder
+    except BaseException:
+        hashes.release(entry)
+        if temp_path is not None:
+            temp_path.unlink(missing_ok=True)
+        raise
+
+
+class PhotoMerger:
+    # a target with its config, indexes and worker pools loaded once, for
+    # embedding: every merge() after the first only pays for the new source
+    # files. merges run one at a time; progress(path, outcome) is called for
+    # each source file, from the thread that handled it
+    #
+    #     with PhotoMerger("/photos", progress=print) as merger:
+    #         merger.add_source("/mnt/card")
+    #         result = merger.merge()
+    def __init__(
+        self,
+        target: str | Path,
+        config: dict | None = None,
+        workers: int | None = None,
+        copy_strategy: str | None = None,
+        progress: Callable[[Path, str], None] | None = None,
+    ):
+        self.config = config if config is not None else get_config(None)
+        self.progress = progress
+        apply_throttle(self.config)
+        self.allowed_extensions = set(self.config["extensions"]["allowed"])
+        self.ignored_files = set(self.config["files"]["ignored"])
+        self.ignored_dirs = self.config.get("directories", {}).get("ignored", [])
+        self.copy_strategy = get_copy_strategy(copy_strategy, self.config)
+        self.out_dir = initialize_target(str(target))
+        self.layout = create_layout(self.config.get("layout", {}))
+
+        self.workers_config = self.config.get("workers", {})
+        hash_workers = workers or self.workers_config.get("hash", 1)
+        self.journal = open_journal(self.config, self.out_dir, False)
+        self.hashes, self.filenames = initialize_hashes(
+            self.allowed_extensions,
+            self.out_dir,
+            self.config.get("hashing", {}),
+            get_index_path(self.config, self.out_dir),
+            self.layout,
+        )
+        self.similar = initialize_similar(
+            self.config,
+            self.out_dir,
+            self.allowed_extensions,
+            self.layout,
+            hash_workers,
+            self.hashes.store,
+        )
+        self.executor = create_executor(
+            hash_workers, self.workers_config.get("pool", "thread")
+        )
+        self._sources: list[tuple[Path, bool]] = []
+        # _lock runs merges one at a time, _sources_lock only guards the queue
+        # so sources can be added during a merge
+        self._lock = threading.Lock()
+        self._sources_lock = threading.Lock()
+        self._closed = False
+
+    def __enter__(self) -> "PhotoMerger":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def add_source(self, source: str | Path, recursive: bool = True):
+        # queued for the next merge(), which may already be running
+        self._queue([source], recursive)
+
+    def merge(self, sources: Iterable[str | Path] = (), recursive: bool = True) -> dict:
+        # merges the added sources and sources; returns the counters that
+        # changed (new_photos, duplicates, errors, ...) and the time it took
+        self._queue(sources, recursive)
+
+        with self._lock:
+            with self._sources_lock:
+                data_dirs, self._sources = self._sources, []
+            before = METRICS.snapshot()["counters"]
+            start = time.perf_counter()
+            try:
+                for data_dir, is_recursive in data_dirs:
+                    process_files(
+                        data_dir,
+                        self.out_dir,
+                        self.hashes,
+                        self.filenames,
+                        self.allowed_extensions,
+                        self.ignored_files,
+                        is_recursive,
+                        executor=self.executor,
+                        batch_size=self.workers_config.get(
+                            "batch_size", DEFAULT_BATCH_SIZE
+                        ),
+                        ignored_dirs=self.ignored_dirs,
+                        scan_workers=self.workers_config.get("scan", 1),
+                        copy_strategy=self.copy_strategy,
+                        layout=self.layout,
+                        similar=self.similar,
+                        journal=self.journal,
+                        progress=self.progress,
+                    )
+            finally:
+                self.hashes.flush()
+
+            return {
+                "seconds": round(time.perf_counter() - start, 3),
+                "counters": counter_difference(METRICS.snapshot()["counters"], before),
+            }
+
+    async def amerge(
+        self, sources: Iterable[str | Path] = (), recursive: bool = True
+    ) -> dict:
+        # merge() on a worker thread, so the event loop keeps running
+        return await asyncio.to_thread(self.merge, list(sources), recursive)
+
+    def merge_path(self, path: Path):
+        # a single source file, e.g. one a watcher reported
+        if path.name in self.ignored_files:
+            return
+        record = FileRecord.from_path(path)
+        with self._lock:
+            if self.journal is not None:
+                self.journal.track(record)
+            merge_file(
+                IndexEntry(path, record.size),
+                self.out_dir,
+                self.hashes,
+                self.filenames,
+                self.copy_strategy,
+                self.layout,
+                self.similar,
+                self.journal,
+                self.progress,
+            )
+
+    def close(self):
+        # saves the target index and journal, once
+        if self._closed:
+            return
+        self._closed = True
+        if self.executor is not None:
+            self.executor.shutdown()
+        if self.similar is not None and self.similar.executor is not None:
+            self.similar.executor.shutdown()
+        if self.journal is not None:
+            self.journal.close()
+        self.hashes.close()
+
+    def _queue(self, sources: Iterable[str | Path], recursive: bool):
+        # every source is checked before any is queued, so a bad one doesn't
+        # leave the others behind for a later merge
+        data_dirs = [
+            (initialize_paths(str(source), str(self.out_dir))[0], recursive)
+            for source in sources
+        ]
+        with self._sources_lock:
+            self._sources.extend(data_dirs)
 
 
 def main():
+    commands = {
+        "plan": plan_main,
+        "apply": apply_main,
+        "watch": watch_main,
+        "serve": serve_main,
+        "submit": submit_main,
+    }
+    if len(sys.argv) > 1 and sys.argv[1] in commands:
+        return commands[sys.argv.pop(1)]()
+
     args = app_arg_parser().parse_args()
+    config = load_config(args)
+    apply_throttle(config)
+    is_recursive = args.non_recursive
+
+    allowed_extensions = set(config["extensions"]["allowed"])
+    LOGGER.info("Allowed extensions: %s", allowed_extensions)
+
+    ignored_files = set(config["files"]["ignored"])
+    LOGGER.info("Ignored files: %s", ignored_files)
+
+    ignored_dirs = config.get("directories", {}).get("ignored", [])
+    LOGGER.info("Ignored directories: %s", ignored_dirs)
+
+    copy_strategy = get_copy_strategy(args.copy_strategy, config)
+    read_order = get_read_order(args, config)
+
+    hash_options = config.get("hashing", {})
+    LOGGER.info("Hashing options: %s", hash_options)
+
+    data_dirs = [initialize_paths(source, args.target)[0] for source in args.source]
+    out_dir = Path(args.target)
+
+    workers_config = config.get("workers", {})
+    hash_workers = args.workers or workers_config.get("hash", 1)
+    LOGGER.info("Hashing workers: %s", hash_workers)
+
+    layout = create_layout(config.get("layout", {}))
+    LOGGER.info("Target layout: %s", type(layout).__name__)
+
+    snapshot = open_snapshot(
+        config,
+        out_dir,
+        args.incremental,
+        {
+            "extensions": sorted(allowed_extensions),
+            "ignored_files": sorted(ignored_files),
+            "ignored_dirs": ignored_dirs,
+            "recursive": is_recursive,
+        },
+    )
+    # before the target is scanned, so half-written files are gone by then
+    journal = open_journal(config, out_dir, args.resume, snapshot)
+
+    hashes, filenames = initialize_hashes(
+        allowed_extensions,
+        out_dir,
+        hash_options,
+        get_index_path(config, out_dir),
+        layout,
+    )
+    similar = initialize_similar(
+        config, out_dir, allowed_extensions, layout, hash_workers, hashes.store
+    )
+
+    exporter = start_exporter(config)
+
+    try:
+        merge_sources(
+            data_dirs,
+            workers_config,
+            hash_workers,
+            args.pipeline or workers_config.get("pipeline", False),
+            args.adaptive or workers_config.get("adaptive", False),
+            out_dir=out_dir,
+            hashes=hashes,
+            filenames=filenames,
+            allowed_extensions=allowed_extensions,
+            ignored_files=ignored_files,
+            is_recursive=is_recursive,
+            batch_size=workers_config.get("batch_size", DEFAULT_BATCH_SIZE),
+            ignored_dirs=ignored_dirs,
+            scan_workers=workers_config.get("scan", 1),
+            copy_strategy=copy_strategy,
+            layout=layout,
+            similar=similar,
+            journal=journal,
+            read_order=read_order,
+            read_batch=workers_config.get("read_batch", DEFAULT_READ_BATCH),
+            snapshot=snapshot,
+        )
+        if snapshot is not None:
+            snapshot.save()
+    finally:
+        if similar is not None and similar.executor is not None:
+            similar.executor.shutdown()
+        if journal is not None:
+            journal.close()
+        if snapshot is not None:
+            snapshot.close()
+        finish_run(args, exporter)
+        hashes.close()
+
+
+def plan_main():
+    args = plan_arg_parser().parse_args()
+    config = load_config(args)
+    apply_throttle(config)
+
+    allowed_extensions = set(config["extensions"]["allowed"])
+    ignored_files = set(config["files"]["ignored"])
+    ignored_dirs = config.get("directories", {}).get("ignored", [])
+    hash_options = config.get("hashing", {})
+    data_dir, out_dir = initialize_paths(args.source, args.target)
+
+    workers_config = config.get("workers", {})
+    hash_workers = args.workers or workers_config.get("hash", 1)
+    layout = create_layout(config.get("layout", {}))
+    LOGGER.info("Target layout: %s", type(layout).__name__)
+
+    hashes, filenames = initialize_hashes(
+        allowed_extensions,
+        out_dir,
+        hash_options,
+        get_index_path(config, out_dir),
+        layout,
+    )
+    similar = initialize_similar(
+        config, out_dir, allowed_extensions, layout, hash_workers, hashes.store
+    )
+    executor = create_executor(hash_workers, workers_config.get("pool", "thread"))
+    exporter = start_exporter(config)
+
+    try:
+        with PlanWriter(
+            Path(args.plan),
+            source=str(data_dir.resolve()),
+            target=str(out_dir.resolve()),
+            algorithm=hashes.hash_options.get("algorithm", DEFAULT_ALGORITHM),
+            sample_size=hashes.sample_size,
+        ) as writer:
+            plan_merge(
+                writer,
+                source_entries(
+                    data_dir,
+                    allowed_extensions,
+                    ignored_files,
+                    args.non_recursive,
+                    ignored_dirs=ignored_dirs,
+                    scan_workers=workers_config.get("scan", 1),
+                ),
+                hashes,
+                filenames,
+                layout,
+                executor=executor,
+                batch_size=workers_config.get("batch_size", DEFAULT_BATCH_SIZE),
+                similar=similar,
+            )
+        LOGGER.info("Wrote %s actions to plan: %s", writer.actions, args.plan)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if similar is not None and similar.executor is not None:
+            similar.executor.shutdown()
+        finish_run(args, exporter)
+        hashes.close()
+
+
+def apply_main():
+    args = apply_arg_parser().parse_args()
+    config = load_config(args)
+    apply_throttle(config)
+    copy_strategy = get_copy_strategy(args.copy_strategy, config)
+
+    header = read_plan_header(Path(args.plan))
+    _, out_dir = initialize_paths(header["source"], header["target"])
+    hash_options = {
+        **config.get("hashing", {}),
+        "algorithm": header["algorithm"],
+        "sample_size": header["sample_size"],
+    }
+    index_path = get_index_path(config, out_dir)
+    store = TargetIndex(out_dir, index_path, hash_options) if index_path else None
+
+    workers = args.workers or config.get("workers", {}).get("copy", 1)
+    LOGGER.info(
+        "Applying plan %s from action %s with %s copiers",
+        args.plan,
+        args.start,
+        workers,
+    )
+    exporter = start_exporter(config)
+    try:
+        done = apply_plan(Path(args.plan), copy_strategy, workers, args.start, store)
+        LOGGER.info("Plan applied: %s actions", done)
+    finally:
+        finish_run(args, exporter)
+        if store is not None:
+            store.close()
+
+
+def watch_main():
+    args = watch_arg_parser().parse_args()
+    config = load_config(args)
+    merger = PhotoMerger(args.target, config, copy_strategy=args.copy_strategy)
+
+    # watches go up before the initial merge, so nothing arriving during it
+    # is missed; a file seen by both is merged once and then a duplicate
+    watch_config = config.get("watch", {})
+    watchers = [
+        create_watcher(
+            initialize_paths(source, args.target)[0],
+            merger.allowed_extensions,
+            merger.ignored_dirs,
+            args.non_recursive,
+            args.poll or watch_config.get("poll", False),
+            watch_config.get("poll_seconds", DEFAULT_POLL_SECONDS),
+        )
+        for source in args.source
+    ]
+    settle_seconds = args.settle or watch_config.get(
+        "settle_seconds", DEFAULT_SETTLE_SECONDS
+    )
+
+    def merge_arrival(path: Path):
+        try:
+            merger.merge_path(path)
+        except Exception as err:
+            METRICS.count("errors", stage="watch")
+            LOGGER.error("Error merging %s - %s", path, err)
+
+    stop = threading.Event()
+    previous_handler = signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    exporter = start_exporter(config)
+    try:
+        merger.merge(args.source, args.non_recursive)
+        LOGGER.info("Watching %s, settling for %ss", args.source, settle_seconds)
+        watch(watchers, merge_arrival, settle_seconds, stop)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        LOGGER.info("Stopped watching")
+        signal.signal(signal.SIGTERM, previous_handler)
+        for watcher in watchers:
+            watcher.close()
+        finish_run(args, exporter)
+        merger.close()
+
+
+def serve_main():
+    args = serve_arg_parser().parse_args()
+    config = load_config(args)
+    merger = PhotoMerger(args.target, config, args.workers, args.copy_strategy)
+
+    def run_job(request: dict):
+        merger.merge(request["sources"], request.get("recursive", True))
+
+    socket_path = Path(
+        args.socket
+        or config.get("server", {}).get("socket")
+        or merger.out_dir / SOCKET_FILENAME
+    )
+    server = MergeServer(socket_path, run_job)
+    previous_handler = signal.signal(
+        signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start()
+    )
+    exporter = start_exporter(config)
+    LOGGER.info("Serving %s on %s", merger.out_dir, socket_path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        LOGGER.info("Server stopped after %s jobs", server.jobs)
+        signal.signal(signal.SIGTERM, previous_handler)
+        server.server_close()
+        finish_run(args, exporter)
+        merger.close()
+
+
+def submit_main():
+    # a thin client, no config or logging of its own
+    parser = submit_arg_parser()
+    args = parser.parse_args()
+    if args.stats:
+        request = {"op": "stats"}
+    elif args.shutdown:
+        request = {"op": "shutdown"}
+    elif args.source:
+        request = {
+            "op": "merge",
+            "sources": [str(Path(source).resolve()) for source in args.source],
+            "recursive": args.non_recursive,
+        }
+    else:
+        parser.error("one of --source, --stats or --shutdown is required")
+
+    socket_path = Path(args.socket or Path(args.target) / SOCKET_FILENAME)
+    response = submit(socket_path, request)
+    print(json.dumps(response, indent=2))
+    if not response.get("ok"):
+        sys.exit(1)
+
+
+def load_config(args: argparse.Namespace) -> dict:
     if args.verbose:
         add_console_handler(LOGGER)
 
@@ -131,27 +1282,142 @@ def main():
     try:
         config = get_config(config_path)
     except FileNotFoundError:
-        LOGGER.error(f"Config file not found: {args.config}")
+        LOGGER.error("Config file not found: %s", args.config)
         raise
 
-    is_recursive = args.non_recursive
+    logging_config = config.get("logging", {})
+    log_file = args.log_file or logging_config.get("file") or DEFAULT_LOG_FILE
+    setup_logging(Path(log_file), args.log_level or logging_config.get("level", "INFO"))
 
-    allowed_extensions = set(config["extensions"]["allowed"])
-    LOGGER.info(f"Allowed extensions: {allowed_extensions}")
+    # command line caps and priority win over [throttle]
+    throttle = config.setdefault("throttle", {})
+    if args.max_read_mbps is not None:
+        throttle["max_read_mbps"] = args.max_read_mbps
+    if args.max_write_mbps is not None:
+        throttle["max_write_mbps"] = args.max_write_mbps
+    if args.low_priority:
+        throttle["low_priority"] = True
 
-    ignored_files = set(config["files"]["ignored"])
-    LOGGER.info(f"Ignored files: {ignored_files}")
+    METRICS.reset()
+    return config
 
-    data_dir, out_dir = initialize_paths(args.source, args.target)
 
-    hashes, filenames = initialize_hashes(allowed_extensions, out_dir)
+def get_copy_strategy(copy_strategy: str | None, config: dict) -> str:
+    copy_strategy = copy_strategy or config.get("copy", {}).get("strategy", "copy")
+    if copy_strategy != "auto" and copy_strategy not in COPY_STRATEGIES:
+        LOGGER.error("Unknown copy strategy: %s", copy_strategy)
+        raise ValueError(f"Unknown copy strategy: {copy_strategy}")
+    LOGGER.info("Copy strategy: %s", copy_strategy)
+    return copy_strategy
+
 
-    process_files(
-        data_dir=data_dir,
-        out_dir=out_dir,
-        hashes=hashes,
-        filenames=filenames,
-        allowed_extensions=allowed_extensions,
-        ignored_files=ignored_files,
-        is_recursive=is_recursive,
+def get_read_order(args: argparse.Namespace, config: dict) -> str:
+    read_order = args.read_order or config.get("workers", {}).get(
+        "read_order", "directory"
     )
+    if read_order not in READ_ORDERS:
+        LOGGER.error("Unknown read order: %s", read_order)
+        raise ValueError(f"Unknown read order: {read_order}")
+    LOGGER.info("Read order: %s", read_order)
+    return read_order
+
+
+def get_index_path(config: dict, out_dir: Path) -> Path | None:
+    index_config = config.get("index", {})
+    if index_config.get("enabled", True):
+        return out_dir / index_config.get("filename", INDEX_FILENAME)
+    return None
+
+
+def open_journal(
+    config: dict,
+    out_dir: Path,
+    resume: bool,
+    snapshot: SourceSnapshot | None = None,
+) -> Journal | None:
+    journal_config = config.get("journal", {})
+    if not journal_config.get("enabled", True):
+        if resume or snapshot is not None:
+            LOGGER.error("Resuming and incremental runs need the [journal] enabled")
+            raise ValueError("--resume and --incremental need the journal enabled")
+        return None
+
+    journal = Journal(
+        out_dir / journal_config.get("filename", JOURNAL_FILENAME),
+        resume,
+        journal_config.get("sync_seconds", DEFAULT_SYNC_SECONDS),
+        snapshot,
+    )
+    if resume:
+        LOGGER.info("Resuming: %s source files already merged", len(journal))
+    return journal
+
+
+def open_snapshot(
+    config: dict, out_dir: Path, incremental: bool, settings: dict
+) -> SourceSnapshot | None:
+    snapshot_config = config.get("snapshot", {})
+    if not (incremental or snapshot_config.get("enabled", False)):
+        return None
+
+    snapshot_path = out_dir / snapshot_config.get("filename", SNAPSHOT_FILENAME)
+    LOGGER.info("Source snapshot: %s", snapshot_path)
+    return SourceSnapshot(snapshot_path, settings)
+
+
+def initialize_similar(
+    config: dict,
+    out_dir: Path,
+    allowed_extensions: set[str],
+    layout: FlatLayout,
+    hash_workers: int,
+    store: TargetIndex | None = None,
+) -> SimilarIndex | None:
+    # decoding is CPU bound, so the pool gets every core even when hashing
+    # runs on one thread; with a store, perceptual hashes of target photos
+    # whose stat hasn't changed come from it and only the others are decoded
+    if not config["extensions"].get("similarity", False):
+        return None
+    if Image is None:
+        LOGGER.error("Similarity matching needs pillow: pip install photomerge[images]")
+        raise ImportError("pillow is required for similarity matching")
+
+    similar = SimilarIndex(
+        config["extensions"].get("similarity_threshold", DEFAULT_THRESHOLD),
+        executor=create_executor(max(hash_workers, os.cpu_count() or 1), "process"),
+    )
+    if store is None:
+        similar.add_files(
+            record.path
+            for record in find_files_with_extensions(
+                out_dir, allowed_extensions, is_recursive=layout.is_sharded
+            )
+        )
+    else:
+        known, missing = store.dhashes()
+        similar.add_hashes(known)
+        store.save_dhashes(similar.add_files(missing))
+    LOGGER.info(
+        "Perceptual hashes: %s target photos, threshold %s",
+        len(similar),
+        similar.threshold,
+    )
+    return similar
+
+
+def start_exporter(config: dict) -> TextfileExporter | None:
+    metrics_config = config.get("metrics", {})
+    if textfile := metrics_config.get("prometheus_textfile"):
+        LOGGER.info("Prometheus textfile: %s", textfile)
+        return TextfileExporter(
+            METRICS, Path(textfile), metrics_config.get("refresh_seconds", 15)
+        ).start()
+    return None
+
+
+def finish_run(args: argparse.Namespace, exporter: TextfileExporter | None):
+    if exporter is not None:
+        exporter.stop()
+    if args.stats_json:
+        METRICS.write_json(Path(args.stats_json))
+    LOGGER.info("Run statistics: %s", METRICS.snapshot()["counters"])
@@ -1,17 +1,194 @@
+import errno
+import hashlib
+import os
 from pathlib import Path
-from shutil import copy2
-from .logger import setup_logging
+from shutil import copy2, copystat, move
+from .hash_files import DEFAULT_ALGORITHM, DEFAULT_BUFFER_SIZE
+from .logger import get_logger
+from .metrics import METRICS
+from .throttle_files import READ_LIMIT, WRITE_LIMIT
 
-LOG_FILE = Path(__file__).parent / "logs" / "app.log"
-LOGGER = setup_logging(LOG_FILE)
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
 
+LOGGER = get_logger()
 
-def copy_file(source_path: Path, destination_path: Path) -> bool:
+# ioctl request number for cloning a file on btrfs/XFS (linux/fs.h)
+FICLONE = 0x40049409
+
+# errors meaning "this filesystem can't do that", auto falls back on them
+UNSUPPORTED_ERRNOS = {
+    errno.EOPNOTSUPP,
+    errno.ENOTSUP,
+    errno.EXDEV,
+    errno.EINVAL,
+    errno.ENOTTY,
+    errno.ENOSYS,
+}
+
+# fastest working strategy per (source device, target device), found by auto
+_AUTO_STRATEGIES: dict[tuple[int, int], str] = {}
+
+
+def copy_file(
+    source_path: Path, destination_path: Path, strategy: str = "copy"
+) -> bool:
     try:
-        copy2(str(source_path.resolve()), str(destination_path.resolve()))
+        if destination_path.is_dir():
+            destination_path = destination_path / source_path.name
+
+        with METRICS.timer("copy"):
+            if strategy == "auto":
+                _copy_auto(source_path, destination_path)
+            else:
+                COPY_STRATEGIES[strategy](source_path, destination_path)
+        METRICS.count("files_copied")
+        METRICS.count("bytes_copied", destination_path.stat().st_size)
         return True
     except Exception as err:
+        METRICS.count("errors", stage="copy")
         LOGGER.error(
-            f"Error attempting to copy file {source_path} to {destination_path} - {err}"
+            "Error attempting to copy file %s to %s - %s",
+            source_path,
+            destination_path,
+            err,
         )
         return False
+
+
+def _copy(source_path: Path, destination_path: Path):
+    # shutil already uses sendfile for the data on Linux, in one call, so a
+    # bandwidth cap is paid per file up front
+    size = source_path.stat().st_size
+    READ_LIMIT.consume(size)
+    WRITE_LIMIT.consume(size)
+    copy2(source_path, destination_path)
+
+
+def _reflink(source_path: Path, destination_path: Path):
+    if fcntl is None:
+        raise OSError(errno.ENOTSUP, "reflink is not supported on this platform")
+
+    with open(source_path, "rb") as fsrc, open(destination_path, "wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    copystat(source_path, destination_path)
+
+
+def _copy_file_range(source_path: Path, destination_path: Path):
+    if not hasattr(os, "copy_file_range"):
+        raise OSError(errno.ENOSYS, "copy_file_range is not supported")
+
+    with open(source_path, "rb") as fsrc, open(destination_path, "wb") as fdst:
+        remaining = os.fstat(fsrc.fileno()).st_size
+        # in chunks when capped, so the cap is paid as the data moves
+        limited = READ_LIMIT.bytes_per_second or WRITE_LIMIT.bytes_per_second
+        chunk_size = DEFAULT_BUFFER_SIZE if limited else remaining
+        while remaining > 0:
+            copied = os.copy_file_range(
+                fsrc.fileno(), fdst.fileno(), min(remaining, chunk_size)
+            )
+            if copied == 0:
+                break
+            READ_LIMIT.consume(copied)
+            WRITE_LIMIT.consume(copied)
+            remaining -= copied
+    if remaining > 0:
+        # the source shrank while it was copied; don't leave the short copy
+        destination_path.unlink(missing_ok=True)
+        raise OSError(errno.EIO, f"Source ended {remaining} bytes early")
+    copystat(source_path, destination_path)
+
+
+def _hardlink(source_path: Path, destination_path: Path):
+    os.link(source_path, destination_path)
+
+
+def _move(source_path: Path, destination_path: Path):
+    # a rename on the same filesystem, copy and delete otherwise
+    move(source_path, destination_path)
+
+
+def copy_with_hash(
+    source_path: Path,
+    destination_path: Path,
+    algorithm: str = DEFAULT_ALGORITHM,
+    buffer_size: int = DEFAULT_BUFFER_SIZE,
+) -> tuple[Path, str]:
+    # one read pass: each chunk is hashed and written from the same buffer
+    # into a hidden file next to destination_path, which the caller renames
+    # into place or unlinks; returns the temporary path and the digest
+    temp_path = destination_path.with_name(f".{destination_path.name}.partial")
+    hasher = hashlib.new(algorithm)
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    try:
+        with open(source_path, "rb") as fsrc, open(temp_path, "wb") as fdst:
+            before = os.fstat(fsrc.fileno())
+            copied = 0
+            while size := fsrc.readinto(buffer):
+                READ_LIMIT.consume(size)
+                hasher.update(view[:size])
+                WRITE_LIMIT.consume(size)
+                fdst.write(view[:size])
+                copied += size
+            fdst.flush()
+            after = os.fstat(fsrc.fileno())
+            written = os.fstat(fdst.fileno()).st_size
+
+        if not (
+            before.st_size == after.st_size == copied == written
+            and before.st_mtime_ns == after.st_mtime_ns
+        ):
+            raise OSError(f"{source_path} changed while being copied")
+        copystat(source_path, temp_path)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+
+    METRICS.count("files_hashed")
+    METRICS.count("bytes_hashed", copied)
+    return temp_path, hasher.hexdigest()
+
+
+def _stream(source_path: Path, destination_path: Path):
+    temp_path, _ = copy_with_hash(source_path, destination_path)
+    os.replace(temp_path, destination_path)
+
+
+COPY_STRATEGIES = {
+    "copy": _copy,
+    "stream": _stream,
+    "reflink": _reflink,
+    "copy_file_range": _copy_file_range,
+    "hardlink": _hardlink,
+    "move": _move,
+}
+
+
+def _copy_auto(source_path: Path, destination_path: Path):
+    # only strategies that leave an independent copy of the data are tried,
+    # hardlink and move have to be asked for explicitly
+    devices = (source_path.stat().st_dev, destination_path.parent.stat().st_dev)
+    if devices in _AUTO_STRATEGIES:
+        COPY_STRATEGIES[_AUTO_STRATEGIES[devices]](source_path, destination_path)
+        return
+
+    candidates = ["copy_file_range", "copy"]
+    if devices[0] == devices[1]:
+        candidates.insert(0, "reflink")
+
+    for strategy in candidates[:-1]:
+        try:
+            COPY_STRATEGIES[strategy](source_path, destination_path)
+        except OSError as err:
+            if err.errno not in UNSUPPORTED_ERRNOS:
+                raise
+            destination_path.unlink(missing_ok=True)
+            continue
+        _AUTO_STRATEGIES[devices] = strategy
+        return
+
+    COPY_STRATEGIES[candidates[-1]](source_path, destination_path)
+    _AUTO_STRATEGIES[devices] = candidates[-1]
@@ -0,0 +1,37 @@
+import os
+from pathlib import Path
+
+from .logger import get_logger
+
+LOGGER = get_logger()
+
+SYS_BLOCK = Path("/sys/dev/block")
+
+
+def group_by_device(paths: list[Path]) -> dict[int, list[Path]]:
+    # sources on the same block device share its readers, in the order given
+    groups: dict[int, list[Path]] = {}
+    for path in paths:
+        groups.setdefault(path.stat().st_dev, []).append(path)
+    return groups
+
+
+def is_rotational(device: int) -> bool:
+    # a partition has no queue of its own, its disk is one directory up;
+    # devices sysfs doesn't know (network, fuse, other platforms) count as
+    # not rotational
+    block = SYS_BLOCK / f"{os.major(device)}:{os.minor(device)}"
+    for queue in (block / "queue", block / ".." / "queue"):
+        try:
+            return (queue / "rotational").read_text().strip() == "1"
+        except OSError:
+            continue
+    return False
+
+
+def device_readers(device: int, workers: int, rotational_workers: int = 1) -> int:
+    # parallel reads make a spinning disk seek between files, so it gets
+    # rotational_workers sequential readers, anything else all of them
+    if is_rotational(device):
+        return min(workers, rotational_workers)
+    return workers
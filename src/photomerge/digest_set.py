@@ -0,0 +1,62 @@
+import hashlib
+import math
+
+
+class BloomFilter:
+    # approximate set of byte keys in about 12 bits per key at a 1% error
+    # rate: a miss is certain, a hit may be false. scalable: once a slice is
+    # full a new one of twice the capacity and half the error rate is started,
+    # which keeps the overall false positive rate under error_rate
+    def __init__(self, capacity: int = 1 << 16, error_rate: float = 0.01):
+        self.error_rate = error_rate
+        self._capacity = capacity
+        self._count = 0
+        self._slices: list[tuple[bytearray, int, int]] = []
+        self._full_at = 0
+        self._add_slice()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, key: bytes) -> bool:
+        h1, h2 = self._hash(key)
+        return any(self._test(bloom_slice, h1, h2) for bloom_slice in self._slices)
+
+    def add(self, key: bytes):
+        h1, h2 = self._hash(key)
+        if any(self._test(bloom_slice, h1, h2) for bloom_slice in self._slices):
+            return
+        if self._count >= self._full_at:
+            self._add_slice()
+
+        bits, size, hashes = self._slices[-1]
+        for idx in range(hashes):
+            position = (h1 + idx * h2) % size
+            bits[position >> 3] |= 1 << (position & 7)
+        self._count += 1
+
+    def _add_slice(self):
+        level = len(self._slices)
+        capacity = self._capacity << level
+        error_rate = self.error_rate / 2 ** (level + 1)
+        size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        hashes = max(1, round(size / capacity * math.log(2)))
+        self._slices.append((bytearray((size + 7) >> 3), size, hashes))
+        self._full_at += capacity
+
+    @staticmethod
+    def _hash(key: bytes) -> tuple[int, int]:
+        # two independent 64-bit hashes, the k positions are h1 + i * h2
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return h1, h2
+
+    @staticmethod
+    def _test(bloom_slice: tuple[bytearray, int, int], h1: int, h2: int) -> bool:
+        bits, size, hashes = bloom_slice
+        for idx in range(hashes):
+            position = (h1 + idx * h2) % size
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
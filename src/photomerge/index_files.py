@@ -0,0 +1,292 @@
+import os
+import sqlite3
+from collections.abc import Generator, Iterable
+from pathlib import Path
+
+from .get_files import FileRecord, scan_directory
+from .hash_files import DEFAULT_ALGORITHM, DEFAULT_SAMPLE_SIZE
+from .match_files import IndexEntry
+
+INDEX_FILENAME = ".photomerge-index.sqlite3"
+FLUSH_INTERVAL = 1000
+# an index written with another schema is dropped and rebuilt, it only caches
+# what hashing the target again would give
+SCHEMA_VERSION = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    partial TEXT,
+    digest TEXT,
+    -- perceptual hash in hex, '' for files that can't be decoded
+    dhash TEXT
+);
+CREATE INDEX IF NOT EXISTS files_by_dir ON files (dir);
+CREATE INDEX IF NOT EXISTS files_by_size ON files (size);
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+FILE_COLUMNS = "path, dir, size, mtime_ns, inode, partial, digest"
+
+
+class TargetIndex:
+    # sqlite cache of target file digests keyed by path relative to the target,
+    # a cached row is only trusted while size, mtime_ns and inode are unchanged.
+    # rows are read one directory at a time while scanning and aren't kept,
+    # only the directory tree is held in memory; digests computed later are
+    # handed back through update()
+    def __init__(
+        self,
+        root: Path,
+        index_path: Path | None = None,
+        hash_options: dict | None = None,
+    ):
+        # not resolved, keys have to come out the same for paths made from a
+        # target given through a symlink
+        self.root = Path(os.path.abspath(root))
+        self.index_path = index_path or self.root / INDEX_FILENAME
+        # records arrive from copy workers, HashIndex serialises the calls
+        self.connection = sqlite3.connect(self.index_path, check_same_thread=False)
+        self._check_schema()
+        self._check_settings(hash_options or {})
+        self._pending: list[tuple] = []
+
+        self._dirs: dict[str, int] = dict(
+            self.connection.execute("SELECT path, mtime_ns FROM dirs")
+        )
+        self._seen_dirs: dict[str, int] = {}
+        self._subdirs: dict[str, list[str]] = {}
+        for key in self._dirs:
+            if key:
+                self._subdirs.setdefault(key.rpartition("/")[0], []).append(key)
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def lookup(self, record: FileRecord) -> IndexEntry:
+        key = self._key(record.path)
+        row = self.connection.execute(
+            "SELECT size, mtime_ns, inode, partial, digest FROM files WHERE path = ?",
+            (key,),
+        ).fetchone()
+        changed = []
+        entry = self._entry(key, record, row, changed)
+        with self.connection:
+            self._write_stats(changed)
+        return entry
+
+    def scan(
+        self, extensions: Iterable[str], is_recursive: bool = False
+    ) -> Generator[IndexEntry, None, None]:
+        # in a recursive scan only directories whose mtime changed since the
+        # last one are listed, adding, removing or renaming a file changes the
+        # mtime of its directory. the files of the others are known from the
+        # index but still statted, rewriting one in place doesn't touch the
+        # directory. rows of files that are gone are dropped as each directory
+        # is done, and those of directories the scan didn't reach at the end
+        extensions = set(ext.lower() for ext in extensions)
+        scanned = set()
+        stack = [""]
+        while stack:
+            key = stack.pop()
+            folder = self.root / key
+            try:
+                mtime_ns = folder.stat().st_mtime_ns
+            except OSError:
+                continue
+            rows = {
+                row[0]: row[1:]
+                for row in self.connection.execute(
+                    "SELECT path, size, mtime_ns, inode, partial, digest FROM files "
+                    "WHERE dir = ?",
+                    (key,),
+                )
+            }
+
+            if is_recursive and self._dirs.get(key) == mtime_ns:
+                records = []
+                for file_key in rows:
+                    if os.path.splitext(file_key)[1].lower() not in extensions:
+                        continue
+                    try:
+                        records.append(FileRecord.from_path(self.root / file_key))
+                    except OSError:
+                        continue
+                subdirs = self._subdirs.get(key, [])
+            else:
+                records, subdir_paths = scan_directory(
+                    str(folder), extensions, (), is_recursive
+                )
+                subdirs = [self._key(Path(path)) for path in subdir_paths]
+
+            changed = []
+            prefix = f"{key}/" if key else ""
+            for record in records:
+                file_key = prefix + record.path.name
+                yield self._entry(file_key, record, rows.pop(file_key, None), changed)
+            with self.connection:
+                self._write_stats(changed)
+                self.connection.executemany(
+                    "DELETE FROM files WHERE path = ?", ((k,) for k in rows)
+                )
+
+            scanned.add(key)
+            if is_recursive:
+                self._seen_dirs[key] = mtime_ns
+            stack.extend(reversed(subdirs))
+
+        self._prune(scanned)
+
+    def candidates(self, size: int) -> list[IndexEntry]:
+        # indexed files of this size; copies recorded since the last flush
+        # aren't in it yet, HashIndex still holds those
+        return [
+            IndexEntry(self.root / key, size, partial, digest)
+            for key, partial, digest in self.connection.execute(
+                "SELECT path, partial, digest FROM files WHERE size = ?", (size,)
+            )
+        ]
+
+    def dhashes(self) -> tuple[list[tuple[Path, int | None]], list[Path]]:
+        # perceptual hashes of the indexed files, and the files without one
+        known, missing = [], []
+        for key, dhash in self.connection.execute("SELECT path, dhash FROM files"):
+            if dhash is None:
+                missing.append(self.root / key)
+            else:
+                known.append((self.root / key, int(dhash, 16) if dhash else None))
+        return known, missing
+
+    def save_dhashes(self, hashes: Iterable[tuple[Path, int | None]]):
+        rows = [
+            ("" if value is None else format(value, "x"), self._key(path))
+            for path, value in hashes
+        ]
+        with self.connection:
+            self.connection.executemany(
+                "UPDATE files SET dhash = ? WHERE path = ?", rows
+            )
+
+    def record(self, entry: IndexEntry):
+        # called once a file has been written to the target
+        key = self._key(entry.path)
+        stat = entry.path.stat()
+        self._pending.append(
+            (
+                key,
+                key.rpartition("/")[0],
+                stat.st_size,
+                stat.st_mtime_ns,
+                stat.st_ino,
+                entry.partial,
+                entry.digest,
+            )
+        )
+        if len(self._pending) >= FLUSH_INTERVAL:
+            self.flush()
+
+    def update(self, entries: Iterable[IndexEntry]):
+        # hashes computed during the run for files that are already indexed;
+        # entries outside the target, sources that weren't copied, are skipped
+        rows = []
+        for entry in entries:
+            try:
+                rows.append((entry.partial, entry.digest, self._key(entry.path)))
+            except ValueError:
+                continue
+        with self.connection:
+            self._write_pending()
+            self.connection.executemany(
+                "UPDATE files SET partial = ?, digest = ? WHERE path = ?", rows
+            )
+
+    def flush(self):
+        with self.connection:
+            self._write_pending()
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def _entry(
+        self, key: str, record: FileRecord, row: tuple | None, changed: list
+    ) -> IndexEntry:
+        if row is not None and tuple(row[:3]) == record[1:]:
+            return IndexEntry(record.path, record.size, row[3], row[4])
+        changed.append(
+            (key, key.rpartition("/")[0], record.size, record.mtime_ns, record.inode)
+        )
+        return IndexEntry(record.path, record.size)
+
+    def _write_stats(self, rows: list[tuple]):
+        # new or changed files, their old digests no longer apply
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO files (path, dir, size, mtime_ns, inode) "
+            "VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+
+    def _write_pending(self):
+        self.connection.executemany(
+            f"INSERT OR REPLACE INTO files ({FILE_COLUMNS}) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            self._pending,
+        )
+        self._pending = []
+
+    def _prune(self, scanned: set[str]):
+        with self.connection:
+            self.connection.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS scanned (path TEXT PRIMARY KEY)"
+            )
+            self.connection.execute("DELETE FROM scanned")
+            self.connection.executemany(
+                "INSERT INTO scanned VALUES (?)", ((key,) for key in scanned)
+            )
+            self.connection.execute(
+                "DELETE FROM files WHERE dir NOT IN (SELECT path FROM scanned)"
+            )
+            self.connection.execute("DELETE FROM dirs")
+            self.connection.executemany(
+                "INSERT INTO dirs VALUES (?, ?)", self._seen_dirs.items()
+            )
+
+    def _key(self, file: Path) -> str:
+        return Path(os.path.abspath(file)).relative_to(self.root).as_posix()
+
+    def _check_schema(self):
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self.connection.executescript(
+                "DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS dirs; "
+                "DROP TABLE IF EXISTS settings; "
+                f"PRAGMA user_version = {SCHEMA_VERSION};"
+            )
+        self.connection.executescript(SCHEMA)
+
+    def _check_settings(self, hash_options: dict):
+        # digests made with another algorithm or sample size can't be reused
+        settings = {
+            "algorithm": hash_options.get("algorithm", DEFAULT_ALGORITHM),
+            "sample_size": str(hash_options.get("sample_size", DEFAULT_SAMPLE_SIZE)),
+        }
+        stored = dict(self.connection.execute("SELECT key, value FROM settings"))
+        if stored == settings:
+            return
+
+        with self.connection:
+            self.connection.execute("UPDATE files SET partial = NULL, digest = NULL")
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO settings VALUES (?, ?)", settings.items()
+            )
@@ -0,0 +1,156 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from .get_files import FileRecord
+from .logger import get_logger
+from .match_files import IndexEntry
+from .snapshot_files import SourceSnapshot
+
+LOGGER = get_logger()
+
+JOURNAL_FILENAME = ".photomerge-journal.jsonl"
+DEFAULT_SYNC_SECONDS = 5.0
+# outcomes a resumed run doesn't have to look at again; failed copies are
+# retried
+FINAL_OUTCOMES = {"copied", "duplicate", "similar"}
+
+
+class Journal:
+    # append-only JSON lines log of source files handled by the merge. a
+    # "start" line is written before a copy and a "done" line with the
+    # outcome after it, so after a crash a start without a done marks a
+    # target file that may be half written. start lines are flushed to the
+    # OS before the copy begins, so a killed process can't lose them, and
+    # both kinds are fsynced at most sync_seconds apart. outcomes are passed
+    # on to the optional snapshot
+    def __init__(
+        self,
+        path: Path,
+        resume: bool = False,
+        sync_seconds: float = DEFAULT_SYNC_SECONDS,
+        snapshot: SourceSnapshot | None = None,
+    ):
+        self.path = path
+        self.sync_seconds = sync_seconds
+        self.snapshot = snapshot
+        # source path -> (size, mtime_ns) of files finished by an earlier run
+        self.completed: dict[str, tuple[int, int]] = {}
+        self._stats: dict[str, tuple[int, int]] = {}
+        self._lock = threading.Lock()
+        self._synced = time.monotonic()
+
+        if path.exists():
+            self._recover(resume)
+        self._file = open(path, "a" if resume else "w")
+
+    def __len__(self) -> int:
+        return len(self.completed)
+
+    def is_completed(self, record: FileRecord) -> bool:
+        # true if an earlier run already handled this unchanged file,
+        # otherwise it's tracked
+        if self.completed.get(str(record.path)) == (record.size, record.mtime_ns):
+            return True
+        self.track(record)
+        return False
+
+    def track(self, record: FileRecord):
+        # the stat is kept for the done line
+        with self._lock:
+            self._stats[str(record.path)] = (record.size, record.mtime_ns)
+
+    def start(self, entry: IndexEntry, destination: Path):
+        # out of the process before the copy, or a crash during it would
+        # leave a target file nothing points at
+        self._append(
+            {"op": "start", "source": str(entry.path), "dest": str(destination)},
+            flush=True,
+        )
+
+    def finish(self, entry: IndexEntry, outcome: str, destination: Path | None = None):
+        source = str(entry.path)
+        with self._lock:
+            size, mtime_ns = self._stats.pop(source, (entry.size, None))
+        self._append(
+            {
+                "op": "done",
+                "source": source,
+                "size": size,
+                "mtime_ns": mtime_ns,
+                "digest": entry.digest,
+                "outcome": outcome,
+                "dest": str(destination) if destination is not None else None,
+            }
+        )
+        if self.snapshot is not None:
+            self.snapshot.finish(entry.path, outcome, entry.digest)
+
+    def close(self):
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    def _append(self, line: dict, flush: bool = False):
+        text = json.dumps(line, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._file.write(text)
+            if time.monotonic() - self._synced >= self.sync_seconds:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._synced = time.monotonic()
+            elif flush:
+                self._file.flush()
+
+    def _recover(self, resume: bool):
+        # remove target files a crashed run may have left half written, and
+        # with resume remember which sources it got through
+        # a streamed copy starts next to the target root and is journaled
+        # again once it has a folder, so a source can have two destinations
+        started: dict[str, list[str]] = {}
+        copied: dict[str, str] = {}
+        with open(self.path) as journal:
+            for text in journal:
+                try:
+                    line = json.loads(text)
+                except json.JSONDecodeError:
+                    break  # torn last line
+                source = line["source"]
+                if line["op"] == "start":
+                    started.setdefault(source, []).append(line["dest"])
+                    continue
+                started.pop(source, None)
+                if line["outcome"] in FINAL_OUTCOMES:
+                    self.completed[source] = (line["size"], line["mtime_ns"])
+                    if line["outcome"] == "copied":
+                        copied[source] = line["dest"]
+                else:
+                    self.completed.pop(source, None)
+
+        for source, destinations in started.items():
+            for destination in destinations:
+                self._remove_partial(Path(source), Path(destination))
+
+        # a copy that was journaled before its data reached the disk
+        for source, destination in copied.items():
+            size = self.completed[source][0]
+            try:
+                complete = os.stat(destination).st_size == size
+            except OSError:
+                complete = False
+            if not complete:
+                del self.completed[source]
+                self._remove_partial(Path(source), Path(destination))
+
+        if not resume:
+            self.completed.clear()
+
+    def _remove_partial(self, source: Path, destination: Path):
+        destination.with_name(f".{destination.name}.partial").unlink(missing_ok=True)
+        # a source that is gone was moved, then the target holds its only copy
+        if source.exists() and destination.exists():
+            LOGGER.warning("Removing half-written file: %s", destination)
+            destination.unlink()
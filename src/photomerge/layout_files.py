@@ -0,0 +1,111 @@
+import threading
+from datetime import datetime
+from pathlib import Path
+
+from .match_files import IndexEntry
+
+try:
+    from PIL import Image
+except ImportError:  # EXIF dates need the optional pillow dependency
+    Image = None
+
+EXIF_IFD = 0x8769
+EXIF_DATETIME_ORIGINAL = 36867
+EXIF_DATETIME = 306
+
+
+class FlatLayout:
+    # every photo directly in the target directory
+    is_sharded = False
+    needs_digest = False
+
+    def start(self, existing: int):
+        pass
+
+    def folder(self, entry: IndexEntry) -> str:
+        return ""
+
+
+class HashLayout(FlatLayout):
+    # ab/cd/... from the leading characters of the digest
+    is_sharded = True
+    needs_digest = True
+
+    def __init__(self, levels: int = 2, width: int = 2):
+        self.levels = levels
+        self.width = width
+
+    def folder(self, entry: IndexEntry) -> str:
+        digest = entry.digest or ""
+        return "/".join(
+            digest[level * self.width : (level + 1) * self.width]
+            for level in range(self.levels)
+        )
+
+
+class DateLayout(FlatLayout):
+    # folders from the EXIF capture date or the file's mtime
+    is_sharded = True
+
+    def __init__(self, date_format: str = "%Y/%m", source: str = "mtime"):
+        self.date_format = date_format
+        self.source = source
+
+    def folder(self, entry: IndexEntry) -> str:
+        taken = None
+        if self.source == "exif":
+            taken = read_exif_datetime(entry.path)
+        if taken is None:
+            taken = datetime.fromtimestamp(entry.path.stat().st_mtime)
+        return taken.strftime(self.date_format)
+
+
+class CountLayout(FlatLayout):
+    # numbered folders holding at most files_per_folder photos each
+    is_sharded = True
+
+    def __init__(self, files_per_folder: int = 1000):
+        self.files_per_folder = files_per_folder
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def start(self, existing: int):
+        self._count = existing
+
+    def folder(self, entry: IndexEntry) -> str:
+        with self._lock:
+            idx = self._count // self.files_per_folder
+            self._count += 1
+        return f"{idx:05d}"
+
+
+def create_layout(layout_config: dict) -> FlatLayout:
+    layout_type = layout_config.get("type", "flat")
+    if layout_type == "hash":
+        return HashLayout(
+            layout_config.get("hash_levels", 2), layout_config.get("hash_width", 2)
+        )
+    if layout_type == "date":
+        return DateLayout(
+            layout_config.get("date_format", "%Y/%m"),
+            layout_config.get("date_source", "mtime"),
+        )
+    if layout_type == "count":
+        return CountLayout(layout_config.get("files_per_folder", 1000))
+    if layout_type == "flat":
+        return FlatLayout()
+    raise ValueError(f"Unknown target layout: {layout_type}")
+
+
+def read_exif_datetime(file_path: Path) -> datetime | None:
+    if Image is None:
+        return None
+    try:
+        with Image.open(file_path) as image:
+            exif = image.getexif()
+            value = exif.get_ifd(EXIF_IFD).get(EXIF_DATETIME_ORIGINAL) or exif.get(
+                EXIF_DATETIME
+            )
+        return datetime.strptime(value, "%Y:%m:%d %H:%M:%S") if value else None
+    except Exception:
+        return None
@@ -1,28 +1,99 @@
+import atexit
 import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
 import sys
 
+DEFAULT_LOG_FILE = Path(__file__).parent / "logs" / "app.log"
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
 
-def setup_logging(log_file: Path):
-    logger = logging.getLogger(__name__)
-    logger.setLevel(logging.DEBUG)
+
+class _DeferredQueueHandler(QueueHandler):
+    # the stock prepare() formats the message in the calling thread; records
+    # only cross threads here, so the %-formatting is left to the listener
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class _BatchingListener(QueueListener):
+    # handlers are only flushed once the queue has been drained, so a burst
+    # of records goes out in a few large writes instead of one per record
+    def dequeue(self, block: bool) -> logging.LogRecord:
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            if not block:
+                raise
+        for handler in self.handlers:
+            handler.flush()
+        return self.queue.get()
+
+    def stop(self):
+        # may run twice, from the caller and at exit
+        if self._thread is not None:
+            super().stop()
+
+
+class _BufferedFileHandler(logging.FileHandler):
+    # FileHandler.emit flushes after every record, the listener does it
+    def emit(self, record: logging.LogRecord):
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+
+def get_logger() -> logging.Logger:
+    # the shared package logger, without opening anything; records propagate
+    # to the root logger until setup_logging() adds handlers
+    return logging.getLogger(__name__)
+
+
+def setup_logging(
+    log_file: Path = DEFAULT_LOG_FILE, level: int | str = logging.DEBUG
+) -> logging.Logger:
+    # callers only put records on a queue, a background thread formats and
+    # writes them
+    logger = get_logger()
+    logger.setLevel(level)
+    listener = _get_listener(logger)
 
     # add file handler unless already instantiated
-    if not any(h.__class__.__name__ == "FileHandler" for h in logger.handlers):
-        file_handler = logging.FileHandler(str(log_file.resolve()))
+    if not any(isinstance(h, logging.FileHandler) for h in listener.handlers):
+        log_file = log_file.expanduser().resolve()
+        log_file.parent.mkdir(parents=True, exist_ok=True)
+        file_handler = _BufferedFileHandler(str(log_file))
         file_handler.setLevel(logging.DEBUG)
-        file_formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
-        file_handler.setFormatter(file_formatter)
-        logger.addHandler(file_handler)
+        file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        listener.handlers = (*listener.handlers, file_handler)
 
     return logger
 
 
 def add_console_handler(logger: logging.Logger):
     # add stdio handler if not already instantiated
-    if not any(h.__class__.__name__ == "StreamHandler" for h in logger.handlers):
+    listener = _get_listener(logger)
+    if not any(type(h) is logging.StreamHandler for h in listener.handlers):
         console_handler = logging.StreamHandler(sys.stdout)
         console_handler.setLevel(logging.DEBUG)
         console_formatter = logging.Formatter("%(message)s")
         console_handler.setFormatter(console_formatter)
-        logger.addHandler(console_handler)
+        listener.handlers = (*listener.handlers, console_handler)
+
+
+def _get_listener(logger: logging.Logger) -> QueueListener:
+    for handler in logger.handlers:
+        if isinstance(handler, _DeferredQueueHandler):
+            return handler.listener  # type: ignore[return-value]
+
+    records = queue.SimpleQueue()
+    handler = _DeferredQueueHandler(records)
+    handler.listener = _BatchingListener(records, respect_handler_level=True)
+    handler.listener.start()
+    # runs before logging's own shutdown hook, which flushes the handlers
+    atexit.register(handler.listener.stop)
+    logger.addHandler(handler)
+    return handler.listener
@@ -0,0 +1,326 @@
+import threading
+from collections.abc import Callable, Iterable
+from concurrent.futures import Executor
+from functools import partial as bind
+from pathlib import Path
+
+from .hash_files import (
+    DEFAULT_ALGORITHM,
+    DEFAULT_SAMPLE_SIZE,
+    calculate_hash,
+    calculate_partial_hash,
+)
+from .digest_set import BloomFilter
+
+# hashed entries handed to the store at a time
+FLUSH_INTERVAL = 1000
+
+
+class IndexEntry:
+    __slots__ = ("path", "size", "partial", "digest")
+
+    def __init__(
+        self,
+        path: Path,
+        size: int,
+        partial: str | None = None,
+        digest: str | None = None,
+    ):
+        self.path = path
+        self.size = size
+        self.partial = partial
+        self.digest = digest
+
+    def __repr__(self) -> str:
+        return f"IndexEntry({self.path!r}, {self.size})"
+
+
+class HashIndex:
+    # files are grouped by size first; the head/tail partial hash is only
+    # computed when sizes collide and the full digest only when partials do,
+    # so a file with a unique size is never read for deduplication
+    def __init__(self, hash_options: dict | None = None, store=None):
+        self.hash_options = dict(hash_options or {})
+        self.sample_size = self.hash_options.pop("sample_size", DEFAULT_SAMPLE_SIZE)
+        # with compact and a store, entries passed to add() aren't kept: their
+        # sizes go into a Bloom filter and a claim of a size that may be in it
+        # reads the files of that size back from the store, hashed or not. a
+        # false positive only costs a query, never a hash or a wrong match.
+        # without a store there's nowhere to read them back from
+        self.compact = self.hash_options.pop("compact", False) and store is not None
+        error_rate = self.hash_options.pop("bloom_error_rate", 0.01)
+        # optional persistent TargetIndex, updated as files are copied and
+        # given the hashes computed for them on flush
+        self.store = store
+        self._by_size: dict[int, list[IndexEntry]] = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        # entries claimed with defer_full_hash that still need a digest
+        self._pending: set[IndexEntry] = set()
+        # entries hashed since the last flush
+        self._hashed: set[IndexEntry] = set()
+
+        self._compact_sizes = BloomFilter(error_rate=error_rate)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self):
+        for entries in self._by_size.values():
+            yield from entries
+
+    def add(self, entry: IndexEntry) -> IndexEntry:
+        # only meant for filling the index before claim() is used, compacted
+        # entries aren't seen by claims already in progress
+        with self._lock:
+            if self.compact:
+                self._compact_sizes.add(_size_key(entry.size))
+            else:
+                self._by_size.setdefault(entry.size, []).append(entry)
+            self._count += 1
+        return entry
+
+    def claim(
+        self, entry: IndexEntry, defer_full_hash: bool = False
+    ) -> IndexEntry | None:
+        # return a duplicate of entry, or add entry to the index; safe to call
+        # from several threads: hashing happens outside the lock and entry is
+        # only added once no unchecked candidate of the same size is left.
+        # with defer_full_hash, an entry that would need a full read is left
+        # pending instead, so its digest can be taken while it is copied and
+        # handed to settle()
+        if _size_key(entry.size) in self._compact_sizes:
+            stored = self._stored(entry.size)
+            if defer_full_hash and entry.digest is None and stored:
+                partial = self.partial_hash(entry)
+                if entry.digest is None and any(
+                    self.partial_hash(c) == partial for c in stored
+                ):
+                    self._save(stored)
+                    with self._lock:
+                        self._pending.add(entry)
+                    return None
+            duplicate = self._match(entry, stored)
+            self._save(stored)
+            if duplicate is not None:
+                return duplicate
+
+        checked = 0
+        while True:
+            with self._lock:
+                candidates = self._by_size.get(entry.size, [])[checked:]
+                if not candidates:
+                    self._by_size.setdefault(entry.size, []).append(entry)
+                    self._count += 1
+                    return None
+
+            if defer_full_hash and entry.digest is None:
+                partial = self.partial_hash(entry)
+                # small files get their digest from the partial read anyway
+                if entry.digest is None and any(
+                    self.partial_hash(c) == partial for c in candidates
+                ):
+                    with self._lock:
+                        self._pending.add(entry)
+                    return None
+
+            duplicate = self._match(entry, candidates)
+            if duplicate is not None:
+                return duplicate
+            checked += len(candidates)
+
+    def settle(self, entry: IndexEntry) -> IndexEntry | None:
+        # finish a deferred claim once entry.digest is known
+        with self._lock:
+            if entry not in self._pending:
+                return None
+            self._pending.discard(entry)
+        return self.claim(entry)
+
+    def release(self, entry: IndexEntry):
+        # a deferred entry that was never copied
+        with self._lock:
+            self._pending.discard(entry)
+
+    def record(self, entry: IndexEntry, path: Path):
+        # entry has been copied to path, later hashing can read the target copy
+        entry.path = path
+        if self.store is not None:
+            with self._lock:
+                self.store.record(entry)
+
+    def flush(self):
+        if self.store is not None:
+            with self._lock:
+                hashed, self._hashed = self._hashed, set()
+                self.store.update(hashed)
+
+    def close(self):
+        if self.store is not None:
+            self.flush()
+            self.store.close()
+
+    def find_duplicate(self, entry: IndexEntry) -> IndexEntry | None:
+        if _size_key(entry.size) in self._compact_sizes:
+            stored = self._stored(entry.size)
+            duplicate = self._match(entry, stored)
+            self._save(stored)
+            if duplicate is not None:
+                return duplicate
+        return self._match(entry, self._by_size.get(entry.size, []))
+
+    def _stored(self, size: int) -> list[IndexEntry]:
+        # compacted target files of this size, as fresh entries
+        with self._lock:
+            return self.store.candidates(size)  # type: ignore[union-attr]
+
+    def _save(self, stored: list[IndexEntry]):
+        # hashes of stored entries go back at once, the next query for their
+        # size builds new entries from the rows
+        hashed = [e for e in stored if e in self._hashed]
+        if hashed:
+            with self._lock:
+                self._hashed.difference_update(hashed)
+                self.store.update(hashed)  # type: ignore[union-attr]
+
+    def _match(
+        self, entry: IndexEntry, candidates: list[IndexEntry]
+    ) -> IndexEntry | None:
+        if not candidates:
+            return None
+
+        partial = self.partial_hash(entry)
+        matches = [c for c in candidates if self.partial_hash(c) == partial]
+        if not matches:
+            return None
+
+        digest = self.full_hash(entry)
+        for candidate in matches:
+            if self.full_hash(candidate) == digest:
+                return candidate
+        return None
+
+    def prefetch(
+        self,
+        entries: list[IndexEntry],
+        executor: Executor,
+        defer_full_hash: bool = False,
+    ):
+        # compute every hash that find_duplicate could ask for while walking
+        # entries in order, spread over executor; decisions are still made
+        # serially afterwards so the outcome matches a serial run. with
+        # defer_full_hash the entries' own digests are left for the copy
+        groups = {}
+        for entry in entries:
+            groups.setdefault(entry.size, []).append(entry)
+        colliding = []
+        stored = []
+        for size, group in groups.items():
+            group = self._by_size.get(size, []) + group
+            if _size_key(size) in self._compact_sizes:
+                stored_group = self._stored(size)
+                stored.extend(stored_group)
+                group = stored_group + group
+            if len(group) > 1:
+                colliding.extend(group)
+
+        self._prefetch(
+            executor, self._partial_func(), self._set_partial, colliding, "partial"
+        )
+
+        partials = {}
+        for entry in colliding:
+            if entry.partial is not None:
+                partials.setdefault((entry.size, entry.partial), []).append(entry)
+        matching = [
+            e for key, group in partials.items() if len(group) > 1 for e in group
+        ]
+        if defer_full_hash:
+            batch = set(entries)
+            matching = [e for e in matching if e not in batch]
+
+        self._prefetch(
+            executor,
+            bind(calculate_hash, **self.hash_options),
+            self._set_digest,
+            matching,
+            "digest",
+        )
+        self._save(stored)
+
+    def prefetch_digests(self, entries: list[IndexEntry], executor: Executor):
+        # full digests of every entry, small files only need the partial read
+        limit = 2 * self.sample_size
+        self._prefetch(
+            executor,
+            self._partial_func(),
+            self._set_partial,
+            [e for e in entries if e.size <= limit],
+            "partial",
+        )
+        self._prefetch(
+            executor,
+            bind(calculate_hash, **self.hash_options),
+            self._set_digest,
+            [e for e in entries if e.size > limit],
+            "digest",
+        )
+
+    def partial_hash(self, entry: IndexEntry) -> str:
+        if entry.partial is None and entry.size <= 2 * self.sample_size:
+            # the partial read of a small file covers all of it
+            entry.partial = entry.digest
+        if entry.partial is None:
+            self._set_partial(entry, self._partial_func()(entry.path))
+        return entry.partial  # type: ignore[return-value]
+
+    def full_hash(self, entry: IndexEntry) -> str:
+        if entry.digest is None:
+            if entry.size <= 2 * self.sample_size:
+                self.partial_hash(entry)
+            else:
+                self._set_digest(entry, calculate_hash(entry.path, **self.hash_options))
+        return entry.digest  # type: ignore[return-value]
+
+    def _partial_func(self) -> Callable[[Path], str]:
+        return bind(
+            calculate_partial_hash,
+            algorithm=self.hash_options.get("algorithm", DEFAULT_ALGORITHM),
+            sample_size=self.sample_size,
+        )
+
+    def _set_partial(self, entry: IndexEntry, partial: str):
+        entry.partial = partial
+        if entry.size <= 2 * self.sample_size:
+            entry.digest = partial
+        self._track(entry)
+
+    def _set_digest(self, entry: IndexEntry, digest: str):
+        entry.digest = digest
+        self._track(entry)
+
+    def _track(self, entry: IndexEntry):
+        if self.store is None:
+            return
+        self._hashed.add(entry)
+        if len(self._hashed) >= FLUSH_INTERVAL:
+            self.flush()
+
+    def _prefetch(
+        self,
+        executor: Executor,
+        func: Callable[[Path], str],
+        setter: Callable[[IndexEntry, str], None],
+        entries: Iterable[IndexEntry],
+        attr: str,
+    ):
+        pending = [e for e in entries if getattr(e, attr) is None]
+        futures = [executor.submit(func, e.path) for e in pending]
+        for entry, future in zip(pending, futures):
+            # failures are left for the serial pass to raise at the right file
+            if future.exception() is None:
+                setter(entry, future.result())
+
+
+def _size_key(size: int) -> bytes:
+    return size.to_bytes(8, "little")
@@ -0,0 +1,163 @@
+import json
+import os
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+
+PREFIX = "photomerge"
+# upper bounds in seconds, a final +Inf bucket is implied
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+
+
+class Metrics:
+    # process-wide counters and timing histograms, updated from any thread;
+    # counters are keyed by name plus optional labels, e.g.
+    # count("errors", stage="copy")
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: dict[tuple[str, tuple], float] = {}
+        self._histograms: dict[str, list] = {}
+        self.started = time.time()
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self.started = time.time()
+
+    def count(self, name: str, value: float = 1, **labels: str):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                # [bucket counts..., +Inf count, sum]
+                histogram = self._histograms[name] = [0] * (len(BUCKETS) + 1) + [0.0]
+            for idx, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram[idx] += 1
+            histogram[len(BUCKETS)] += 1
+            histogram[-1] += seconds
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def get(self, name: str, **labels: str) -> float:
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = {}
+            for (name, labels), value in sorted(self._counters.items()):
+                if labels:
+                    label = ",".join(f"{k}={v}" for k, v in labels)
+                    counters.setdefault(name, {})[label] = value
+                else:
+                    counters[name] = value
+            histograms = {
+                name: {
+                    "count": histogram[len(BUCKETS)],
+                    "sum": round(histogram[-1], 6),
+                    "buckets": dict(zip(map(str, BUCKETS), histogram[: len(BUCKETS)])),
+                }
+                for name, histogram in sorted(self._histograms.items())
+            }
+        return {
+            "started": self.started,
+            "elapsed_seconds": round(time.time() - self.started, 3),
+            "counters": counters,
+            "histograms": histograms,
+        }
+
+    def prometheus(self) -> str:
+        # text exposition format, as read by node_exporter's textfile collector
+        lines = []
+        with self._lock:
+            names = sorted({name for name, _ in self._counters})
+            for name in names:
+                lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+                for (other, labels), value in sorted(self._counters.items()):
+                    if other == name:
+                        lines.append(f"{PREFIX}_{name}_total{_labels(labels)} {value}")
+
+            for name, histogram in sorted(self._histograms.items()):
+                metric = f"{PREFIX}_{name}_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                for bound, count in zip(BUCKETS, histogram):
+                    lines.append(f'{metric}_bucket{{le="{bound}"}} {count}')
+                lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram[len(BUCKETS)]}')
+                lines.append(f"{metric}_sum {histogram[-1]}")
+                lines.append(f"{metric}_count {histogram[len(BUCKETS)]}")
+
+        lines.append(f"{PREFIX}_start_time_seconds {self.started}")
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path: Path):
+        _write_atomic(path, json.dumps(self.snapshot(), indent=2) + "\n")
+
+    def write_prometheus(self, path: Path):
+        _write_atomic(path, self.prometheus())
+
+
+class TextfileExporter:
+    # rewrites a Prometheus textfile every interval seconds until stopped,
+    # then once more with the final numbers
+    def __init__(self, metrics: Metrics, path: Path, interval: float = 15.0):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> "TextfileExporter":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.metrics.write_prometheus(self.path)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.metrics.write_prometheus(self.path)
+
+
+def counter_difference(after: dict, before: dict) -> dict:
+    # what changed between two snapshot()["counters"], e.g. during one job
+    difference = {}
+    for name, value in after.items():
+        if isinstance(value, dict):
+            value = counter_difference(value, before.get(name, {}))
+            if value:
+                difference[name] = value
+        elif value != before.get(name, 0):
+            difference[name] = value - before.get(name, 0)
+    return difference
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+def _write_atomic(path: Path, text: str):
+    # readers never see a half-written file
+    temp_path = path.with_name(f".{path.name}.tmp")
+    temp_path.write_text(text)
+    os.replace(temp_path, path)
+
+
+METRICS = Metrics()
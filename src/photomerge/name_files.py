@@ -0,0 +1,50 @@
+import os
+import threading
+from collections.abc import Iterable
+
+from .metrics import METRICS
+
+
+class NameIndex:
+    # names taken in the target plus, per (stem, suffix), the lowest number
+    # that may still be free, so a colliding name is resolved in memory
+    # without probing the filesystem or walking IMG_0001_1 .. IMG_0001_n again
+    def __init__(self, names: Iterable[str] = ()):
+        self._names: set[str] = set(names)
+        self._next: dict[tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._names
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def add(self, name: str):
+        with self._lock:
+            self._names.add(name)
+
+    def claim(self, name: str) -> str:
+        # reserve name, or the next free "{stem}_{n}{suffix}" if it's taken
+        with self._lock:
+            if name not in self._names:
+                self._names.add(name)
+                return name
+
+            stem, suffix = os.path.splitext(name)
+            first = idx = self._next.get((stem, suffix), 1)
+            while (new_name := f"{stem}_{idx}{suffix}") in self._names:
+                idx += 1
+            self._names.add(new_name)
+            self._next[(stem, suffix)] = idx + 1
+        METRICS.count("renames")
+        METRICS.count("rename_probes", idx - first + 1)
+        return new_name
+
+    def release(self, name: str):
+        # a claimed name that was never written
+        with self._lock:
+            self._names.discard(name)
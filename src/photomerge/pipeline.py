@@ -0,0 +1,91 @@
+import queue
+import threading
+from collections.abc import Callable, Iterable
+from contextlib import AbstractContextManager, nullcontext
+
+from .logger import get_logger
+from .metrics import METRICS
+from .throttle_files import AdaptiveLimit
+
+LOGGER = get_logger()
+
+DEFAULT_QUEUE_SIZE = 256
+
+_DONE = object()
+
+
+def run_pipeline(
+    items: Iterable,
+    decide: Callable,
+    save: Callable,
+    hash_workers: int = 1,
+    copy_workers: int = 1,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    hash_limit: AdaptiveLimit | None = None,
+    copy_limit: AdaptiveLimit | None = None,
+):
+    # scan -> hash -> copy, each stage on its own threads; the bounded queues
+    # cap memory and let slow target writes hold back the scanner. decide(item)
+    # returns what save(item, result) needs, or None to drop the item. with a
+    # limit, a stage starts limit.maximum threads and only limit.limit of them
+    # work at once
+    if hash_limit is not None:
+        hash_workers = hash_limit.maximum
+    if copy_limit is not None:
+        copy_workers = copy_limit.maximum
+    hash_queue = queue.Queue(maxsize=queue_size)
+    copy_queue = queue.Queue(maxsize=queue_size)
+
+    def scan_stage():
+        try:
+            for item in items:
+                hash_queue.put(item)
+        except Exception as err:
+            METRICS.count("errors", stage="scan")
+            LOGGER.error("Error scanning source files - %s", err)
+        finally:
+            for _ in range(hash_workers):
+                hash_queue.put(_DONE)
+
+    def hash_stage():
+        while (item := hash_queue.get()) is not _DONE:
+            try:
+                with _slot(hash_limit):
+                    result = decide(item)
+            except Exception as err:
+                METRICS.count("errors", stage="hash")
+                LOGGER.error("Error hashing %s - %s", item, err)
+                continue
+            if result is not None:
+                copy_queue.put((item, result))
+
+    def copy_stage():
+        while (job := copy_queue.get()) is not _DONE:
+            try:
+                with _slot(copy_limit):
+                    save(*job)
+            except Exception as err:
+                METRICS.count("errors", stage="save")
+                LOGGER.error("Error saving %s - %s", job[0], err)
+
+    scanner = _start(scan_stage)
+    hashers = [_start(hash_stage) for _ in range(hash_workers)]
+    copiers = [_start(copy_stage) for _ in range(copy_workers)]
+
+    scanner.join()
+    for thread in hashers:
+        thread.join()
+    for _ in copiers:
+        copy_queue.put(_DONE)
+    for thread in copiers:
+        thread.join()
+
+
+def _slot(limit: AdaptiveLimit | None) -> AbstractContextManager:
+    return nullcontext() if limit is None else limit.slot()
+
+
+def _start(target: Callable) -> threading.Thread:
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,152 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from collections.abc import Generator
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+
+from .copy_files import copy_file
+from .hash_files import DEFAULT_ALGORITHM, calculate_hash
+from .logger import get_logger
+from .match_files import IndexEntry
+from .metrics import METRICS
+
+LOGGER = get_logger()
+
+PLAN_VERSION = 1
+
+
+class PlanWriter:
+    # JSON lines: a header, then one action per line in the order the merge
+    # would have handled the files. written to a hidden file that only takes
+    # the plan's name once complete, so a half-written plan can't be applied
+    def __init__(self, plan_path: Path, **header):
+        self.plan_path = plan_path
+        self._temp_path = plan_path.with_name(f".{plan_path.name}.partial")
+        self._file = open(self._temp_path, "w")
+        self.actions = 0
+        self._write({"plan": PLAN_VERSION, "created": time.time(), **header})
+
+    def __enter__(self) -> "PlanWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._file.close()
+        if exc_type is None:
+            os.replace(self._temp_path, self.plan_path)
+        else:
+            self._temp_path.unlink(missing_ok=True)
+
+    def write(self, action: dict):
+        self._write(action)
+        self.actions += 1
+
+    def _write(self, line: dict):
+        self._file.write(json.dumps(line, separators=(",", ":")) + "\n")
+
+
+def read_plan_header(plan_path: Path) -> dict:
+    with open(plan_path) as plan:
+        return _read_header(plan, plan_path)
+
+
+def read_plan(plan_path: Path) -> tuple[dict, Generator[dict, None, None]]:
+    # the file stays open until the actions have been read to the end
+    plan = open(plan_path)
+    try:
+        header = _read_header(plan, plan_path)
+    except ValueError:
+        plan.close()
+        raise
+
+    def actions():
+        with plan:
+            for line in plan:
+                yield json.loads(line)
+
+    return header, actions()
+
+
+def _read_header(plan, plan_path: Path) -> dict:
+    header = json.loads(plan.readline())
+    if header.get("plan") != PLAN_VERSION:
+        raise ValueError(f"Not a photomerge plan: {plan_path}")
+    return header
+
+
+def apply_plan(
+    plan_path: Path,
+    copy_strategy: str = "copy",
+    workers: int = 1,
+    start: int = 0,
+    store=None,
+) -> int:
+    # copy the new photos listed in the plan, workers at a time, beginning
+    # with action number start; returns the number of actions handled so
+    # apply can be resumed from there. only destinations that already exist
+    # are hashed, the digests from the plan go straight into the optional
+    # TargetIndex
+    header, actions = read_plan(plan_path)
+    target = Path(header["target"])
+    algorithm = header.get("algorithm", DEFAULT_ALGORITHM)
+    lock = threading.Lock()
+
+    def apply_action(action: dict):
+        if action["action"] == "skip":
+            return
+
+        source = Path(action["source"])
+        destination = target / action["folder"] / action["name"]
+        try:
+            stat = source.stat()
+            if (stat.st_size, stat.st_mtime_ns) != (action["size"], action["mtime_ns"]):
+                raise OSError(f"{source} changed since the plan was made")
+            if destination.exists():
+                # left by an earlier apply, or another photo that only has
+                # the same name and size
+                if (
+                    destination.stat().st_size != action["size"]
+                    or calculate_hash(destination, algorithm) != action["digest"]
+                ):
+                    raise OSError(f"{destination} already exists")
+                LOGGER.info("Already applied: %s", destination)
+            else:
+                destination.parent.mkdir(parents=True, exist_ok=True)
+                if not copy_file(source, destination, copy_strategy):
+                    return
+                LOGGER.info("Saved: %s as %s", source.name, destination)
+        except OSError as err:
+            METRICS.count("errors", stage="apply")
+            LOGGER.error("Error applying %s - %s", source, err)
+            return
+
+        if store is not None:
+            entry = IndexEntry(
+                destination, action["size"], action["partial"], action["digest"]
+            )
+            with lock:
+                store.record(entry)
+
+    done = start
+    window = max(workers, 1) * 4
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        pending = deque()
+        try:
+            for action in islice(actions, start, None):
+                pending.append(executor.submit(apply_action, action))
+                if len(pending) >= window:
+                    pending.popleft().result()
+                    done += 1
+            while pending:
+                pending.popleft().result()
+                done += 1
+        finally:
+            # every action before done has finished, later ones may have too
+            for future in pending:
+                future.cancel()
+            LOGGER.info("Applied %s actions of %s", done, plan_path)
+
+    return done
@@ -0,0 +1,119 @@
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+from .logger import get_logger
+from .metrics import METRICS, counter_difference
+
+LOGGER = get_logger()
+
+SOCKET_FILENAME = ".photomerge.sock"
+
+
+class MergeServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    # one JSON request per connection and one JSON response back:
+    #   {"op": "merge", "sources": [...], "recursive": true}
+    #   {"op": "stats"} and {"op": "shutdown"}
+    # connections are served on threads but merges run one at a time, against
+    # the indexes run_job keeps loaded between them
+    daemon_threads = True
+
+    def __init__(self, socket_path: Path, run_job: Callable[[dict], None]):
+        self.socket_path = socket_path
+        self.run_job = run_job
+        self.jobs = 0
+        self._job_lock = threading.Lock()
+        _remove_stale_socket(socket_path)
+        # merges write to the target, only its owner may start them; the
+        # socket is created 0600 by bind, not chmodded after others could
+        # already connect
+        umask = os.umask(0o177)
+        try:
+            super().__init__(str(socket_path), _RequestHandler)
+        finally:
+            os.umask(umask)
+
+    def merge(self, request: dict) -> dict:
+        with self._job_lock:
+            self.jobs += 1
+            job = self.jobs
+            before = METRICS.snapshot()["counters"]
+            start = time.perf_counter()
+            try:
+                self.run_job(request)
+            except Exception as err:
+                LOGGER.error("Job %s failed - %s", job, err)
+                return {"ok": False, "job": job, "error": str(err)}
+            return {
+                "ok": True,
+                "job": job,
+                "seconds": round(time.perf_counter() - start, 3),
+                "counters": counter_difference(METRICS.snapshot()["counters"], before),
+            }
+
+    def server_close(self):
+        super().server_close()
+        self.socket_path.unlink(missing_ok=True)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    server: MergeServer
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line.strip():
+            # a client that connected and left, like the stale socket probe
+            return
+        try:
+            request = json.loads(line)
+            op = request.get("op")
+        except (json.JSONDecodeError, AttributeError) as err:
+            self._reply({"ok": False, "error": f"Bad request - {err}"})
+            return
+
+        if op == "merge":
+            self._reply(self.server.merge(request))
+        elif op == "stats":
+            self._reply({"ok": True, "jobs": self.server.jobs, **METRICS.snapshot()})
+        elif op == "shutdown":
+            self._reply({"ok": True})
+            # shutdown() waits for serve_forever, which is on another thread
+            threading.Thread(target=self.server.shutdown).start()
+        else:
+            self._reply({"ok": False, "error": f"Unknown op: {op}"})
+
+    def _reply(self, response: dict):
+        try:
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+        except ConnectionError as err:
+            # BrokenPipeError and the like, the client didn't wait
+            LOGGER.warning("Client went away before the reply - %s", err)
+
+
+def submit(socket_path: Path, request: dict, timeout: float | None = None) -> dict:
+    # client side: send one request and wait for its response
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(str(socket_path))
+        client.sendall(json.dumps(request).encode() + b"\n")
+        with client.makefile("rb") as response:
+            return json.loads(response.readline())
+
+
+def _remove_stale_socket(socket_path: Path):
+    # a socket left behind by a server that died can be reused, a live one
+    # belongs to a server already running for this target
+    if not socket_path.exists():
+        return
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            probe.connect(str(socket_path))
+    except ConnectionRefusedError:
+        socket_path.unlink()
+        return
+    raise OSError(f"A server is already listening on {socket_path}")
@@ -0,0 +1,153 @@
+import threading
+from collections.abc import Iterable
+from concurrent.futures import Executor
+from functools import partial as bind
+from pathlib import Path
+
+try:
+    from PIL import Image
+except ImportError:  # perceptual hashing needs the optional pillow dependency
+    Image = None
+
+DEFAULT_HASH_SIZE = 8
+DEFAULT_THRESHOLD = 6
+
+
+def calculate_dhash(file_path: Path, hash_size: int = DEFAULT_HASH_SIZE) -> int | None:
+    # difference hash: one bit per pixel of a (hash_size + 1) x hash_size
+    # grayscale thumbnail telling whether it is brighter than its right-hand
+    # neighbour; survives re-encoding, resizing and stripped metadata. None
+    # for files pillow can't decode
+    if Image is None:
+        return None
+    try:
+        with Image.open(file_path) as image:
+            # JPEGs are decoded at 1/2 to 1/8 scale straight from the DCT
+            image.draft("L", (hash_size * 4, hash_size * 4))
+            pixels = (
+                image.convert("L")
+                .resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+                .tobytes()
+            )
+    except Exception:
+        return None
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(offset, offset + hash_size):
+            value = value << 1 | (pixels[col] > pixels[col + 1])
+    return value
+
+
+class BKTree:
+    # metric tree over Hamming distance: children are keyed by their distance
+    # to the parent, so by the triangle inequality a search within
+    # max_distance only has to descend into children whose key is within
+    # max_distance of the query's distance to the parent
+    def __init__(self):
+        self._root: tuple[int, object, dict] | None = None
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def add(self, value: int, item: object):
+        self._count += 1
+        if self._root is None:
+            self._root = (value, item, {})
+            return
+
+        node = self._root
+        while True:
+            distance = (value ^ node[0]).bit_count()
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (value, item, {})
+                return
+            node = child
+
+    def search(self, value: int, max_distance: int) -> list[tuple[int, object]]:
+        # (distance, item) for every item within max_distance, nearest first
+        found = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node_value, item, children = stack.pop()
+            distance = (value ^ node_value).bit_count()
+            if distance <= max_distance:
+                found.append((distance, item))
+            stack.extend(
+                child
+                for key, child in children.items()
+                if distance - max_distance <= key <= distance + max_distance
+            )
+        found.sort(key=lambda match: match[0])
+        return found
+
+
+class SimilarIndex:
+    # perceptual hashes of photos kept so far; the target's photos and batches
+    # of source photos are decoded on executor (ideally a process pool, pillow
+    # holds the GIL for most of it)
+    def __init__(
+        self,
+        threshold: int = DEFAULT_THRESHOLD,
+        hash_size: int = DEFAULT_HASH_SIZE,
+        executor: Executor | None = None,
+    ):
+        self.threshold = threshold
+        self.executor = executor
+        self._dhash = bind(calculate_dhash, hash_size=hash_size)
+        self._tree = BKTree()
+        self._lock = threading.Lock()
+        # hashes of the last prefetched batch, by path
+        self._prefetched: dict[Path, int | None] = {}
+
+    def __len__(self) -> int:
+        return len(self._tree)
+
+    def add_files(self, paths: Iterable[Path]) -> list[tuple[Path, int | None]]:
+        # returns each path with its hash, None if it can't be decoded
+        paths = list(paths)
+        if self.executor is None:
+            values = map(self._dhash, paths)
+        else:
+            values = self.executor.map(self._dhash, paths, chunksize=64)
+        hashes = list(zip(paths, values))
+        self.add_hashes(hashes)
+        return hashes
+
+    def add_hashes(self, hashes: Iterable[tuple[Path, int | None]]):
+        with self._lock:
+            for path, value in hashes:
+                if value is not None:
+                    self._tree.add(value, path)
+
+    def prefetch(self, paths: Iterable[Path]):
+        # decode a batch of photos on executor ahead of their claims; the
+        # batch before it is dropped, whatever is left of it turned out to be
+        # byte duplicates that never got to claim()
+        if self.executor is None:
+            return
+        paths = list(paths)
+        values = self.executor.map(self._dhash, paths, chunksize=8)
+        self._prefetched = dict(zip(paths, values))
+
+    def claim(self, path: Path) -> Path | None:
+        # the path of a similar photo already in the index, or None after
+        # adding path; photos that can't be decoded are never similar. photos
+        # that weren't prefetched are decoded on the calling thread, claims
+        # already run on the merge's workers then
+        try:
+            value = self._prefetched.pop(path)
+        except KeyError:
+            value = self._dhash(path)
+        if value is None:
+            return None
+
+        with self._lock:
+            matches = self._tree.search(value, self.threshold)
+            if matches:
+                return matches[0][1]  # type: ignore[return-value]
+            self._tree.add(value, path)
+        return None
@@ -0,0 +1,186 @@
+import json
+import sqlite3
+import threading
+from collections.abc import Generator, Iterable
+from pathlib import Path
+
+from .get_files import FileRecord, scan_directory
+from .metrics import METRICS
+
+SNAPSHOT_FILENAME = ".photomerge-sources.sqlite3"
+# outcomes after which a source file doesn't have to be looked at again
+FINAL_OUTCOMES = {"copied", "duplicate", "similar", "ignored", "resumed"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    root TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    digest TEXT,
+    PRIMARY KEY (root, path)
+);
+CREATE TABLE IF NOT EXISTS dirs (
+    root TEXT NOT NULL,
+    path TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    PRIMARY KEY (root, path)
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class SourceSnapshot:
+    # sqlite snapshot of the source trees merged by earlier runs, keyed by
+    # source root and path relative to it: directory mtimes and the stat and
+    # digest of every file that was fully handled. a rescan doesn't list
+    # directories whose mtime is unchanged and doesn't yield files whose stat
+    # is; adding, removing or renaming a file changes the mtime of its
+    # directory, rewriting one in place doesn't
+    def __init__(self, snapshot_path: Path, settings: dict | None = None):
+        self.snapshot_path = snapshot_path
+        # roots are scanned from one thread per device
+        self.connection = sqlite3.connect(snapshot_path, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        self._check_settings(settings or {})
+        self._lock = threading.Lock()
+
+        self._roots: list[str] = []
+        # what the next snapshot will hold, per (root, path)
+        self._files: dict[tuple[str, str], tuple] = {}
+        self._dirs: dict[tuple[str, str], int] = {}
+        # records yielded but not handled yet, by absolute path
+        self._pending: dict[str, tuple[str, str, FileRecord]] = {}
+
+    def scan(
+        self,
+        root: Path,
+        extensions: Iterable[str],
+        ignored_dirs: Iterable[str] = (),
+        is_recursive: bool = True,
+    ) -> Generator[FileRecord, None, None]:
+        # new and changed files under root, in find_files_with_extensions order
+        root = root.resolve()
+        root_key = str(root)
+        with self._lock:
+            self._roots.append(root_key)
+            rows = {
+                row[0]: row[1:]
+                for row in self.connection.execute(
+                    "SELECT path, size, mtime_ns, inode, digest FROM files "
+                    "WHERE root = ?",
+                    (root_key,),
+                )
+            }
+            dirs = dict(
+                self.connection.execute(
+                    "SELECT path, mtime_ns FROM dirs WHERE root = ?", (root_key,)
+                )
+            )
+        subdirs_by_dir: dict[str, list[str]] = {}
+        for key in dirs:
+            if key:
+                subdirs_by_dir.setdefault(key.rpartition("/")[0], []).append(key)
+        files_by_dir: dict[str, list[str]] = {}
+        for key in rows:
+            files_by_dir.setdefault(key.rpartition("/")[0], []).append(key)
+
+        extensions = set(ext.lower() for ext in extensions)
+        ignored_dirs = tuple(ignored_dirs)
+        stack = [""]
+        while stack:
+            key = stack.pop()
+            folder = root / key
+            try:
+                mtime_ns = folder.stat().st_mtime_ns
+            except OSError:
+                continue
+
+            if dirs.get(key) == mtime_ns:
+                unchanged = files_by_dir.get(key, [])
+                with self._lock:
+                    for file_key in unchanged:
+                        self._files[(root_key, file_key)] = rows[file_key]
+                METRICS.count("dirs_unchanged")
+                METRICS.count("files_unchanged", len(unchanged))
+                subdirs = subdirs_by_dir.get(key, [])
+            else:
+                records, subdir_paths = scan_directory(
+                    str(folder), extensions, ignored_dirs, is_recursive
+                )
+                for record in records:
+                    file_key = record.path.relative_to(root).as_posix()
+                    row = rows.get(file_key)
+                    with self._lock:
+                        if row is not None and row[:3] == record[1:]:
+                            self._files[(root_key, file_key)] = row
+                            METRICS.count("files_unchanged")
+                            continue
+                        self._pending[str(record.path)] = (root_key, file_key, record)
+                    yield record
+                subdirs = [
+                    Path(path).relative_to(root).as_posix() for path in subdir_paths
+                ]
+
+            with self._lock:
+                self._dirs[(root_key, key)] = mtime_ns
+            stack.extend(reversed(subdirs))
+
+    def finish(self, path: Path, outcome: str, digest: str | None = None):
+        # a file that failed stays pending, so it and its directory are looked
+        # at again next time
+        if outcome not in FINAL_OUTCOMES:
+            return
+        with self._lock:
+            pending = self._pending.pop(str(path), None)
+            if pending is not None:
+                root_key, file_key, record = pending
+                self._files[(root_key, file_key)] = (*record[1:], digest)
+
+    def save(self):
+        # replaces the snapshot of every root scanned in this run; only called
+        # after a complete run, an interrupted one leaves the last snapshot.
+        # directories with pending files are kept with an mtime that never
+        # matches, so they're listed again but their subdirectories are known
+        untrusted = {
+            (root_key, file_key.rpartition("/")[0])
+            for root_key, file_key, _ in self._pending.values()
+        }
+        with self._lock, self.connection:
+            for root_key in self._roots:
+                self.connection.execute("DELETE FROM files WHERE root = ?", (root_key,))
+                self.connection.execute("DELETE FROM dirs WHERE root = ?", (root_key,))
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                ((*key, *row) for key, row in self._files.items()),
+            )
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)",
+                (
+                    (*key, -1 if key in untrusted else mtime_ns)
+                    for key, mtime_ns in self._dirs.items()
+                ),
+            )
+
+    def close(self):
+        self.connection.close()
+
+    def _check_settings(self, settings: dict):
+        # a snapshot taken with other extensions, ignore rules or recursion
+        # didn't see everything this run would, so it starts over
+        settings = {key: json.dumps(value) for key, value in settings.items()}
+        stored = dict(self.connection.execute("SELECT key, value FROM settings"))
+        if stored == settings:
+            return
+
+        with self.connection:
+            self.connection.execute("DELETE FROM files")
+            self.connection.execute("DELETE FROM dirs")
+            self.connection.execute("DELETE FROM settings")
+            self.connection.executemany(
+                "INSERT INTO settings VALUES (?, ?)", settings.items()
+            )
@@ -0,0 +1,200 @@
+import ctypes
+import ctypes.util
+import os
+import platform
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from .logger import get_logger
+from .metrics import METRICS
+
+LOGGER = get_logger()
+
+MEGABYTE = 1000 * 1000
+DEFAULT_ADAPTIVE_MAX = 8
+DEFAULT_ADAPTIVE_SECONDS = 2.0
+# throughput changes smaller than this are noise, not a reason to move
+ADAPTIVE_TOLERANCE = 0.05
+
+# ioprio_set(2): idle class, only gets the disk when nobody else wants it
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_SET_SYSCALLS = {"x86_64": 251, "aarch64": 30, "i686": 289, "armv7l": 314}
+LOW_PRIORITY_NICE = 19
+
+
+class RateLimiter:
+    # caps the bytes per second passed through consume() across all threads;
+    # each call books its bytes after the ones already booked and sleeps until
+    # they're due, so the rate holds on average over a file or a chunk. capped
+    # or not, the bytes are added up per thread for thread_bytes()
+    def __init__(self, bytes_per_second: float | None = None):
+        self.bytes_per_second = bytes_per_second
+        self._next = 0.0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def thread_bytes(self) -> int:
+        return getattr(self._local, "bytes", 0)
+
+    def consume(self, nbytes: int):
+        if nbytes <= 0:
+            return
+        self._local.bytes = self.thread_bytes() + nbytes
+        if not self.bytes_per_second:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(self._next, now)
+            self._next = start + nbytes / self.bytes_per_second
+            wait = start - now
+        if wait > 0:
+            METRICS.count("throttled_seconds", wait)
+            time.sleep(wait)
+
+
+# shared by every reader and writer in the process, set by apply_throttle
+READ_LIMIT = RateLimiter()
+WRITE_LIMIT = RateLimiter()
+
+
+def apply_throttle(config: dict):
+    # [throttle] caps source reads and target writes in MB/s (0 for none) and
+    # low_priority runs the merge as an idle-class, nice 19 process
+    throttle = config.get("throttle", {})
+    read_mbps = throttle.get("max_read_mbps") or 0
+    write_mbps = throttle.get("max_write_mbps") or 0
+    if read_mbps < 0 or write_mbps < 0:
+        LOGGER.error("Bandwidth caps can't be negative: %s, %s", read_mbps, write_mbps)
+        raise ValueError(f"Bandwidth caps can't be negative: {read_mbps}, {write_mbps}")
+    if (read_mbps or write_mbps) and config.get("workers", {}).get("pool") == "process":
+        # worker processes would each get a limiter and the whole cap
+        LOGGER.error("Bandwidth caps don't work with the process pool")
+        raise ValueError("Bandwidth caps don't work with the process pool")
+
+    READ_LIMIT.bytes_per_second = read_mbps * MEGABYTE or None
+    WRITE_LIMIT.bytes_per_second = write_mbps * MEGABYTE or None
+    if read_mbps or write_mbps:
+        LOGGER.info("Reads capped at %s MB/s, writes at %s MB/s", read_mbps, write_mbps)
+    if throttle.get("low_priority", False):
+        lower_priority()
+
+
+def lower_priority():
+    # for this process and the threads it starts later; either half failing
+    # (other platforms, seccomp) only costs the neighbours some bandwidth
+    try:
+        os.setpriority(os.PRIO_PROCESS, 0, LOW_PRIORITY_NICE)
+    except (AttributeError, OSError) as err:
+        LOGGER.warning("Can't lower the CPU priority - %s", err)
+
+    syscall = IOPRIO_SET_SYSCALLS.get(platform.machine())
+    if syscall is None:
+        LOGGER.warning("Can't lower the I/O priority on %s", platform.machine())
+        return
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        priority = IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT
+        if libc.syscall(syscall, IOPRIO_WHO_PROCESS, 0, priority) < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+    except (OSError, AttributeError) as err:
+        LOGGER.warning("Can't lower the I/O priority - %s", err)
+        return
+    LOGGER.info("Running at low CPU and idle I/O priority")
+
+
+class AdaptiveLimit:
+    # how many of a stage's workers may run at once, between minimum and
+    # maximum; every interval seconds the bytes per second the stage moved
+    # through meter (or passed to slot) and the seconds it took per byte are
+    # compared with the interval before. a gain keeps the limit moving the same
+    # way, a loss turns it around, flat throughput with slower bytes (a
+    # saturated disk) brings it down and otherwise it stays, so it settles
+    # where more workers stop paying off
+    def __init__(
+        self,
+        name: str,
+        initial: int,
+        maximum: int,
+        minimum: int = 1,
+        interval: float = DEFAULT_ADAPTIVE_SECONDS,
+        meter: RateLimiter | None = None,
+    ):
+        self.name = name
+        self.meter = meter
+        self.minimum = minimum
+        self.maximum = max(maximum, minimum)
+        self.limit = min(max(initial, minimum), self.maximum)
+        self.interval = interval
+        self._active = 0
+        self._direction = 1
+        self._last: tuple[float, float] | None = None
+        self._bytes = 0
+        self._tasks = 0
+        self._busy = 0.0
+        self._started = time.monotonic()
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def slot(self, nbytes: int | None = None) -> Iterator[None]:
+        # nbytes defaults to what this thread moved through meter in the slot
+        with self._condition:
+            while self._active >= self.limit:
+                self._condition.wait()
+            self._active += 1
+        start = time.monotonic()
+        metered = self.meter.thread_bytes() if self.meter is not None else 0
+        try:
+            yield
+        finally:
+            if nbytes is None:
+                nbytes = (
+                    self.meter.thread_bytes() - metered if self.meter is not None else 1
+                )
+            with self._condition:
+                self._active -= 1
+                self._bytes += nbytes
+                self._tasks += 1
+                self._busy += time.monotonic() - start
+                self._maybe_adjust()
+                self._condition.notify_all()
+
+    def _maybe_adjust(self):
+        now = time.monotonic()
+        elapsed = now - self._started
+        if elapsed < self.interval or self._tasks < self.limit:
+            return
+        throughput = self._bytes / elapsed
+        # per byte, files of different sizes take different times
+        latency = self._busy / max(self._bytes, 1)
+        self._bytes, self._tasks, self._busy = 0, 0, 0.0
+        self._started = now
+
+        if self._last is not None:
+            last_throughput, last_latency = self._last
+            if throughput < last_throughput * (1 - ADAPTIVE_TOLERANCE):
+                self._direction = -self._direction
+            elif throughput <= last_throughput * (1 + ADAPTIVE_TOLERANCE):
+                # nothing gained or lost: back off if bytes take longer, else
+                # stay put
+                if latency <= last_latency * (1 + ADAPTIVE_TOLERANCE):
+                    self._last = (throughput, latency)
+                    return
+                self._direction = -1
+        self._last = (throughput, latency)
+
+        limit = min(max(self.limit + self._direction, self.minimum), self.maximum)
+        if limit != self.limit:
+            LOGGER.debug(
+                "%s workers %s -> %s at %.1f MB/s, %.3fs per MB",
+                self.name,
+                self.limit,
+                limit,
+                throughput / MEGABYTE,
+                latency * MEGABYTE,
+            )
+            self.limit = limit
+            METRICS.count("adaptive_adjustments", stage=self.name)
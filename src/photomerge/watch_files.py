@@ -0,0 +1,245 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections.abc import Callable, Iterable
+from fnmatch import fnmatch
+from pathlib import Path
+
+from .get_files import find_files_with_extensions
+from .logger import get_logger
+from .metrics import METRICS
+
+LOGGER = get_logger()
+
+DEFAULT_SETTLE_SECONDS = 2.0
+DEFAULT_POLL_SECONDS = 5.0
+
+# inotify event bits (sys/inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100  # only for directories, a file is done when closed
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def _load_inotify():
+    # None where there's no inotify (other platforms, odd libcs)
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [
+            ctypes.c_int,
+            ctypes.c_char_p,
+            ctypes.c_uint32,
+        ]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+_libc = _load_inotify()
+
+
+class _Watcher(ABC):
+    # changes(timeout) blocks up to timeout seconds and returns the photos
+    # that were added or written to under root since the last call
+    def __init__(
+        self,
+        root: Path,
+        extensions: Iterable[str],
+        ignored_dirs: Iterable[str] = (),
+        is_recursive: bool = True,
+    ):
+        self.root = root
+        self.extensions = set(ext.lower() for ext in extensions)
+        self.ignored_dirs = tuple(ignored_dirs)
+        self.is_recursive = is_recursive
+
+    @abstractmethod
+    def changes(self, timeout: float) -> list[Path]: ...
+
+    def close(self):
+        pass
+
+    def _wanted(self, path: Path) -> bool:
+        return path.suffix.lower() in self.extensions
+
+    def _scan(self, folder: Path) -> list[Path]:
+        return [
+            record.path
+            for record in find_files_with_extensions(
+                folder, self.extensions, self.is_recursive, self.ignored_dirs
+            )
+        ]
+
+
+class InotifyWatcher(_Watcher):
+    # a watch per directory; new directories get one as they appear and the
+    # files already in them are reported, since they may have been written
+    # before the watch existed
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if _libc is None:
+            raise OSError("inotify is not available")
+        self._fd = _libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._dirs: dict[int, Path] = {}
+        self._add_tree(self.root)
+
+    def changes(self, timeout: float) -> list[Path]:
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return []
+
+        changed = []
+        data = os.read(self._fd, 1 << 16)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            METRICS.count("watch_events")
+
+            if mask & IN_Q_OVERFLOW:
+                LOGGER.warning("Watch queue overflowed, rescanning %s", self.root)
+                changed.extend(self._scan(self.root))
+                continue
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+
+            folder = self._dirs.get(wd)
+            if folder is None or not name:
+                continue
+            path = folder / os.fsdecode(name)
+            if mask & IN_ISDIR:
+                if self.is_recursive and not self._ignored(path.name):
+                    changed.extend(self._add_tree(path))
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and self._wanted(path):
+                changed.append(path)
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+    def _add_tree(self, folder: Path) -> list[Path]:
+        folders = [folder]
+        if self.is_recursive:
+            for dirpath, dirnames, _ in os.walk(folder):
+                dirnames[:] = [name for name in dirnames if not self._ignored(name)]
+                folders += [Path(dirpath) / name for name in dirnames]
+        for path in folders:
+            wd = _libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                LOGGER.error(
+                    "Can't watch %s - %s", path, os.strerror(ctypes.get_errno())
+                )
+                continue
+            self._dirs[wd] = path
+        return self._scan(folder) if folder != self.root else []
+
+    def _ignored(self, name: str) -> bool:
+        return any(fnmatch(name, pattern) for pattern in self.ignored_dirs)
+
+
+class PollingWatcher(_Watcher):
+    # lists the tree every interval seconds and reports files whose size or
+    # mtime changed; for platforms and filesystems (NFS, SMB) without inotify
+    def __init__(self, *args, interval: float = DEFAULT_POLL_SECONDS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.interval = interval
+        self._stats = self._stat_tree()
+        self._next = time.monotonic() + interval
+
+    def changes(self, timeout: float) -> list[Path]:
+        wait = self._next - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(wait, 0))
+        self._next = time.monotonic() + self.interval
+
+        stats = self._stat_tree()
+        changed = [
+            path for path, stat in stats.items() if self._stats.get(path) != stat
+        ]
+        self._stats = stats
+        return changed
+
+    def _stat_tree(self) -> dict[Path, tuple[int, int]]:
+        return {
+            record.path: (record.size, record.mtime_ns)
+            for record in find_files_with_extensions(
+                self.root, self.extensions, self.is_recursive, self.ignored_dirs
+            )
+        }
+
+
+def create_watcher(
+    root: Path,
+    extensions: Iterable[str],
+    ignored_dirs: Iterable[str] = (),
+    is_recursive: bool = True,
+    poll: bool = False,
+    poll_seconds: float = DEFAULT_POLL_SECONDS,
+) -> _Watcher:
+    if not poll:
+        try:
+            return InotifyWatcher(root, extensions, ignored_dirs, is_recursive)
+        except OSError as err:
+            LOGGER.warning("Falling back to polling %s - %s", root, err)
+    return PollingWatcher(
+        root, extensions, ignored_dirs, is_recursive, interval=poll_seconds
+    )
+
+
+def watch(
+    watchers: list[_Watcher],
+    handle: Callable[[Path], None],
+    settle_seconds: float = DEFAULT_SETTLE_SECONDS,
+    stop: threading.Event | None = None,
+):
+    # passes each changed file to handle once its size and mtime have stayed
+    # the same for settle_seconds, so files still being uploaded aren't merged
+    # half written; runs until stop is set
+    stop = stop or threading.Event()
+    pending: dict[Path, tuple[tuple[int, int], float]] = {}
+    timeout = min(settle_seconds, 1.0) / max(len(watchers), 1)
+
+    while not stop.is_set():
+        for watcher in watchers:
+            for path in watcher.changes(timeout):
+                stat = _stat(path)
+                if stat is not None:
+                    pending[path] = (stat, time.monotonic() + settle_seconds)
+
+        now = time.monotonic()
+        for path, (stat, deadline) in list(pending.items()):
+            if deadline > now:
+                continue
+            current = _stat(path)
+            if current is None:
+                del pending[path]
+            elif current != stat:
+                pending[path] = (current, now + settle_seconds)
+            else:
+                del pending[path]
+                handle(path)
+
+
+def _stat(path: Path) -> tuple[int, int] | None:
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
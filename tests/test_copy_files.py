@@ -1,9 +1,13 @@
 # pyright: basic
 
 
+import errno
+import hashlib
 from pathlib import Path
+import pytest
 
-from photomerge.copy_files import copy_file
+from photomerge import copy_files
+from photomerge.copy_files import copy_file, copy_with_hash
 
 
 def test_copy_file_success(tmp_path):
@@ -26,3 +30,106 @@ def test_copy_file_failure(caplog):
     result = copy_file(Path("source.txt"), Path("destination.txt"))
     assert result is False
     assert "Error attempting to copy file" in caplog.text
+
+
+@pytest.fixture
+def source_file(tmp_path):
+    source_file = tmp_path / "src_file.jpg"
+    source_file.write_bytes(b"source file contents")
+    return source_file
+
+
+@pytest.mark.parametrize("strategy", ["copy", "copy_file_range", "auto"])
+def test_copy_file_strategies_copy_data(source_file, tmp_path, strategy):
+    destination = tmp_path / "copied.jpg"
+
+    assert copy_file(source_file, destination, strategy) is True
+    assert destination.read_bytes() == b"source file contents"
+    assert destination.stat().st_ino != source_file.stat().st_ino
+    assert destination.stat().st_mtime_ns == source_file.stat().st_mtime_ns
+
+
+def test_copy_file_hardlink(source_file, tmp_path):
+    destination = tmp_path / "linked.jpg"
+
+    assert copy_file(source_file, destination, "hardlink") is True
+    assert destination.stat().st_ino == source_file.stat().st_ino
+
+
+def test_copy_file_move(source_file, tmp_path):
+    destination = tmp_path / "moved.jpg"
+
+    assert copy_file(source_file, destination, "move") is True
+    assert destination.read_bytes() == b"source file contents"
+    assert not source_file.exists()
+
+
+def test_copy_file_auto_falls_back_and_remembers(source_file, tmp_path, mocker):
+    mocker.patch.dict(copy_files._AUTO_STRATEGIES, clear=True)
+    unsupported = OSError(errno.EOPNOTSUPP, "not supported")
+    mocker.patch.dict(
+        copy_files.COPY_STRATEGIES,
+        {
+            "reflink": mocker.Mock(side_effect=unsupported),
+            "copy_file_range": mocker.Mock(side_effect=unsupported),
+        },
+    )
+
+    assert copy_file(source_file, tmp_path / "a.jpg", "auto") is True
+    assert (tmp_path / "a.jpg").read_bytes() == b"source file contents"
+    assert list(copy_files._AUTO_STRATEGIES.values()) == ["copy"]
+
+    assert copy_file(source_file, tmp_path / "b.jpg", "auto") is True
+    assert copy_files.COPY_STRATEGIES["reflink"].call_count == 1
+
+
+def test_copy_file_auto_reports_real_errors(source_file, tmp_path, mocker, caplog):
+    mocker.patch.dict(copy_files._AUTO_STRATEGIES, clear=True)
+    mocker.patch.dict(
+        copy_files.COPY_STRATEGIES,
+        {"reflink": mocker.Mock(side_effect=OSError(errno.ENOSPC, "disk full"))},
+    )
+
+    assert copy_file(source_file, tmp_path / "a.jpg", "auto") is False
+    assert "disk full" in caplog.text
+
+
+def test_copy_file_unknown_strategy(source_file, tmp_path, caplog):
+    assert copy_file(source_file, tmp_path / "a.jpg", "teleport") is False
+    assert "Error attempting to copy file" in caplog.text
+
+
+def test_copy_with_hash(source_file, tmp_path):
+    destination = tmp_path / "copied.jpg"
+
+    temp_path, digest = copy_with_hash(source_file, destination, buffer_size=4)
+
+    assert digest == hashlib.md5(b"source file contents").hexdigest()
+    assert temp_path.read_bytes() == b"source file contents"
+    assert temp_path.name.startswith(".")
+    assert not destination.exists()
+
+
+def test_copy_with_hash_failure_leaves_no_partial_file(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        copy_with_hash(tmp_path / "missing.jpg", tmp_path / "copied.jpg")
+
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_copy_file_stream(source_file, tmp_path):
+    destination = tmp_path / "copied.jpg"
+
+    assert copy_file(source_file, destination, "stream") is True
+    assert destination.read_bytes() == b"source file contents"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["copied.jpg", "src_file.jpg"]
+
+
+def test_copy_file_range_fails_when_the_source_ends_early(
+    source_file, tmp_path, mocker
+):
+    mocker.patch("os.copy_file_range", return_value=0)
+    destination = tmp_path / "copied.jpg"
+
+    assert copy_file(source_file, destination, "copy_file_range") is False
+    assert not destination.exists()
@@ -0,0 +1,85 @@
+# pyright: basic
+
+
+import os
+from unittest.mock import patch
+
+import pytest
+
+from photomerge import initialize_hashes, merge_sources
+from photomerge import device_files
+from photomerge.device_files import device_readers, group_by_device, is_rotational
+
+
+@pytest.fixture()
+def sysfs(tmp_path, monkeypatch):
+    # 8:0 a spinning disk with partition 8:1, 259:0 an NVMe drive
+    block = tmp_path / "block"
+    disk = tmp_path / "devices" / "sda"
+    (disk / "queue").mkdir(parents=True)
+    (disk / "queue" / "rotational").write_text("1\n")
+    (disk / "sda1").mkdir()
+    nvme = tmp_path / "devices" / "nvme0n1" / "queue"
+    nvme.mkdir(parents=True)
+    (nvme / "rotational").write_text("0\n")
+    block.mkdir()
+    (block / "8:0").symlink_to(disk)
+    (block / "8:1").symlink_to(disk / "sda1")
+    (block / "259:0").symlink_to(nvme.parent)
+    monkeypatch.setattr(device_files, "SYS_BLOCK", block)
+
+
+def test_group_by_device_keeps_order(tmp_path):
+    paths = [tmp_path / name for name in ("b", "a", "c")]
+    for path in paths:
+        path.mkdir()
+
+    assert group_by_device(paths) == {tmp_path.stat().st_dev: paths}
+
+
+def test_is_rotational(sysfs):
+    assert is_rotational(os.makedev(8, 0))
+    assert is_rotational(os.makedev(8, 1))
+    assert not is_rotational(os.makedev(259, 0))
+    assert not is_rotational(os.makedev(0, 42))
+
+
+def test_device_readers(sysfs):
+    assert device_readers(os.makedev(8, 1), 8) == 1
+    assert device_readers(os.makedev(8, 1), 8, rotational_workers=2) == 2
+    assert device_readers(os.makedev(259, 0), 8) == 8
+
+
+@pytest.mark.parametrize("use_pipeline", [False, True])
+def test_merge_sources_shares_indexes_across_devices(tmp_path, use_pipeline):
+    card, disk, target = tmp_path / "card", tmp_path / "disk", tmp_path / "target"
+    for folder in (card, disk, target):
+        folder.mkdir()
+    (card / "a.jpg").write_bytes(b"from the card")
+    (card / "b.jpg").write_bytes(b"on both")
+    (disk / "a.jpg").write_bytes(b"from the disk")
+    (disk / "c.jpg").write_bytes(b"on both")
+    hashes, filenames = initialize_hashes({".jpg"}, target)
+
+    devices = {1: [card], 2: [disk]}
+    with (
+        patch("photomerge.group_by_device", return_value=devices),
+        patch("photomerge.device_readers", side_effect=[1, 4]) as readers,
+    ):
+        merge_sources(
+            [card, disk],
+            {},
+            4,
+            use_pipeline,
+            out_dir=target,
+            hashes=hashes,
+            filenames=filenames,
+            allowed_extensions={".jpg"},
+            ignored_files=set(),
+            is_recursive=True,
+        )
+
+    assert readers.call_count == 2
+    contents = sorted(path.read_bytes() for path in target.iterdir())
+    assert contents == [b"from the card", b"from the disk", b"on both"]
+    assert {path.name for path in target.iterdir()} >= {"a.jpg", "a_1.jpg"}
@@ -0,0 +1,26 @@
+# pyright: basic
+
+
+from photomerge.digest_set import BloomFilter
+
+
+def test_bloom_filter_has_no_false_negatives_and_few_positives():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    for idx in range(10_000):
+        bloom.add(idx.to_bytes(8, "little"))
+
+    assert len(bloom) <= 10_000
+    assert all(idx.to_bytes(8, "little") in bloom for idx in range(10_000))
+    false_positives = sum(
+        idx.to_bytes(8, "little") in bloom for idx in range(10_000, 30_000)
+    )
+    assert false_positives < 20_000 * 0.02
+
+
+def test_bloom_filter_stays_small():
+    bloom = BloomFilter(capacity=1 << 16, error_rate=0.01)
+    for idx in range(1 << 16):
+        bloom.add(idx.to_bytes(8, "little"))
+
+    bits = sum(size for _, size, _ in bloom._slices)
+    assert bits < 12 * (1 << 16)
@@ -2,77 +2,151 @@
 
 
 from pathlib import Path
-from photomerge.get_files import find_files_with_extensions
+from unittest.mock import patch
 
+import pytest
 
-def test_find_files_with_extensions_recursive(mocker):
-    # Mock rglob to simulate recursive search in the directory
-    mock_rglob = mocker.patch("photomerge.get_files.Path.rglob")
-    mock_rglob.return_value = [
-        Path("folder/file1.txt"),
-        Path("folder/subfolder/file2.txt"),
-        Path("folder/subfolder/file3.md"),
-    ]
+from photomerge import get_files
+from photomerge.get_files import (
+    FileRecord,
+    find_files_with_extensions,
+    order_records,
+    physical_offset,
+)
 
-    # Test with recursive search
-    result = list(
-        find_files_with_extensions(Path("folder"), [".txt"], is_recursive=True)
-    )
-    expected = [
-        Path("folder/file1.txt").resolve(),
-        Path("folder/subfolder/file2.txt").resolve(),
-    ]
-    assert result == expected
-    mock_rglob.assert_called_once_with("*")
-
-
-def test_find_files_with_extensions_non_recursive(mocker):
-    # Mock iterdir to simulate non-recursive search in the directory
-    mock_iterdir = mocker.patch("photomerge.get_files.Path.iterdir")
-    mock_iterdir.return_value = [
-        Path("folder/file1.txt"),
-        Path("folder/file2.md"),
-        Path("folder/file3.txt"),
-        Path("folder/subfolder"),  # This is a directory, not a file
-    ]
 
-    # Test with non-recursive search
-    result = list(
-        find_files_with_extensions(Path("folder"), [".txt"], is_recursive=False)
-    )
-    expected = [Path("folder/file1.txt").resolve(), Path("folder/file3.txt").resolve()]
-    assert result == expected
-    mock_iterdir.assert_called_once_with()
-
-
-def test_find_files_with_extensions_non_recursive_no_match(mocker):
-    # Mock iterdir to simulate non-recursive search with no matching files
-    mock_iterdir = mocker.patch("photomerge.get_files.Path.iterdir")
-    mock_iterdir.return_value = [
-        Path("folder/file1.md"),
-        Path("folder/file2.pdf"),
-        Path("folder/subfolder"),  # This is a directory, not a file
+@pytest.fixture
+def folder(tmp_path):
+    for name in [
+        "file1.txt",
+        "file2.md",
+        "subfolder/file2.txt",
+        "subfolder/file3.md",
+        "subfolder/deeper/file4.TXT",
+        "@eaDir/thumb.txt",
+        ".txt",
+    ]:
+        file = tmp_path / name
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_bytes(name.encode())
+    (tmp_path / "folder.txt").mkdir()  # a directory, not a file
+
+    return tmp_path
+
+
+def test_find_files_with_extensions_recursive(folder):
+    result = list(find_files_with_extensions(folder, [".txt"], is_recursive=True))
+
+    assert sorted(r.path for r in result) == [
+        folder / "@eaDir/thumb.txt",
+        folder / "file1.txt",
+        folder / "subfolder/deeper/file4.TXT",
+        folder / "subfolder/file2.txt",
     ]
 
-    # Test with non-recursive search where no files match the extensions
-    result = list(
-        find_files_with_extensions(Path("folder"), [".txt"], is_recursive=False)
-    )
+
+def test_find_files_with_extensions_non_recursive(folder):
+    result = list(find_files_with_extensions(folder, [".txt"], is_recursive=False))
+
+    assert [r.path for r in result] == [folder / "file1.txt"]
+
+
+def test_find_files_with_extensions_non_recursive_no_match(folder):
+    result = list(find_files_with_extensions(folder, [".pdf"], is_recursive=False))
     assert result == []
-    mock_iterdir.assert_called_once_with()
 
 
-def test_find_files_with_extensions_recursive_no_match(mocker):
-    # Mock rglob to simulate recursive search with no matching files
-    mock_rglob = mocker.patch("photomerge.get_files.Path.rglob")
-    mock_rglob.return_value = [
-        Path("folder/file1.md"),
-        Path("folder/subfolder/file2.pdf"),
-    ]
+def test_find_files_with_extensions_recursive_no_match(folder):
+    result = list(find_files_with_extensions(folder, [".pdf"], is_recursive=True))
+    assert result == []
+
+
+def test_find_files_with_extensions_yields_records(folder):
+    (record,) = find_files_with_extensions(folder, [".txt"], is_recursive=False)
+    stat = (folder / "file1.txt").stat()
 
-    # Test with recursive search where no files match the extensions
-    result = list(
-        find_files_with_extensions(Path("folder"), [".txt"], is_recursive=True)
+    assert record == FileRecord(
+        folder / "file1.txt", stat.st_size, stat.st_mtime_ns, stat.st_ino
     )
+    assert record.name == "file1.txt"
+    assert record.path.is_absolute()
+
+
+def test_find_files_with_extensions_prunes_ignored_dirs(folder):
+    result = find_files_with_extensions(folder, [".txt"], ignored_dirs=["@*", "deep*"])
+
+    assert sorted(r.name for r in result) == ["file1.txt", "file2.txt"]
+
+
+def test_find_files_with_extensions_yields_files_before_subdirectories(folder):
+    result = [r.name for r in find_files_with_extensions(folder, [".txt", ".md"])]
+
+    assert set(result[:2]) == {"file1.txt", "file2.md"}
+    assert result.index("file2.txt") < result.index("file4.TXT")
+
+
+def test_find_files_with_extensions_parallel_keeps_order(folder):
+    for idx in range(20):
+        (folder / f"dir{idx}").mkdir()
+        (folder / f"dir{idx}" / f"photo{idx}.txt").write_bytes(b"x")
+
+    serial = list(find_files_with_extensions(folder, [".txt"]))
+    parallel = list(find_files_with_extensions(folder, [".txt"], workers=4))
+
+    assert parallel == serial
+
+
+def test_find_files_with_extensions_unreadable_dir(caplog):
+    result = list(find_files_with_extensions(Path("missing/folder"), [".txt"]))
+
     assert result == []
-    mock_rglob.assert_called_once_with("*")
+    assert "Error reading directory" in caplog.text
+
+
+def make_records(inodes):
+    return [FileRecord(Path(f"{inode}.jpg"), 1, 0, inode) for inode in inodes]
+
+
+def test_order_records_directory_keeps_order():
+    records = make_records([3, 1, 2])
+    assert list(order_records(records)) == records
+
+
+def test_order_records_by_inode_in_batches():
+    records = make_records([5, 3, 4, 2, 1])
+    ordered = order_records(iter(records), "inode", batch_size=3)
+    assert [record.inode for record in ordered] == [3, 4, 5, 1, 2]
+
+
+def test_order_records_by_physical_offset():
+    offsets = {"1.jpg": 4096, "2.jpg": None, "3.jpg": 512}
+    records = make_records([1, 2, 3])
+    with patch.object(
+        get_files, "physical_offset", side_effect=lambda path: offsets[path.name]
+    ):
+        ordered = list(order_records(records, "physical"))
+    assert [record.inode for record in ordered] == [2, 3, 1]
+
+
+def test_order_records_unknown_order():
+    with pytest.raises(ValueError, match="Unknown read order: random"):
+        list(order_records(make_records([1]), "random"))
+
+
+def test_physical_offset(tmp_path):
+    empty = tmp_path / "empty.jpg"
+    empty.touch()
+    photo = tmp_path / "photo.jpg"
+    photo.write_bytes(b"x" * 8192)
+
+    assert physical_offset(empty) is None
+    assert physical_offset(tmp_path / "missing.jpg") is None
+    offset = physical_offset(photo)
+    # None where the filesystem has no extent map (tmpfs, overlayfs)
+    assert offset is None or offset >= 0
+
+
+def test_physical_offset_without_fcntl(tmp_path):
+    (tmp_path / "photo.jpg").write_bytes(b"photo")
+    with patch.object(get_files, "fcntl", None):
+        assert physical_offset(tmp_path / "photo.jpg") is None
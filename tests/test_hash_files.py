@@ -2,26 +2,28 @@
 
 
 import hashlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 import pytest
-from unittest.mock import mock_open, patch
 
-from photomerge.hash_files import calculate_hash
+from photomerge.hash_files import (
+    calculate_hash,
+    calculate_partial_hash,
+    create_executor,
+)
 
 
-def test_calculate_hash_success(mocker):
-    # Mock data to simulate file content
-    mock_data = b"sample data for hashing"
-    expected_hash = hashlib.md5(mock_data).hexdigest()
+def test_calculate_hash_success(tmp_path):
+    # Write sample data to a real file, since the hasher streams via readinto
+    data = b"sample data for hashing"
+    expected_hash = hashlib.md5(data).hexdigest()
+    file = tmp_path / "dummy_file.txt"
+    file.write_bytes(data)
 
-    # Patch 'open' and simulate reading from a file
-    mock_open_file = mock_open(read_data=mock_data)
-    with patch("photomerge.hash_files.open", mock_open_file):
-        result = calculate_hash(Path("dummy_file.txt"))
+    result = calculate_hash(file)
 
     # Verify that the result is the expected hash
     assert result == expected_hash
-    mock_open_file.assert_called_once_with(Path("dummy_file.txt"), "rb")
 
 
 def test_calculate_hash_file_not_found(mocker):
@@ -48,15 +50,91 @@ def test_calculate_hash_other_error(mocker):
     mock_open_file.assert_called_once_with(Path("nonexistent_file.txt"), "rb")
 
 
-def test_calculate_hash_empty_file(mocker):
-    # Simulate an empty file by returning an empty byte string
-    mock_data = b""
-    expected_hash = hashlib.md5(mock_data).hexdigest()
+def test_calculate_hash_empty_file(tmp_path):
+    file = tmp_path / "empty_file.txt"
+    file.write_bytes(b"")
+    expected_hash = hashlib.md5(b"").hexdigest()
 
-    mock_open_file = mock_open(read_data=mock_data)
-    with patch("photomerge.hash_files.open", mock_open_file):
-        result = calculate_hash(Path("empty_file.txt"))
+    result = calculate_hash(file)
 
     # Verify that the result is the hash for an empty string
     assert result == expected_hash
-    mock_open_file.assert_called_once_with(Path("empty_file.txt"), "rb")
+
+
+def test_calculate_hash_reads_in_chunks(tmp_path):
+    # Buffer smaller than the file, with a partial final chunk
+    data = b"0123456789" * 10 + b"xyz"
+    file = tmp_path / "chunked.bin"
+    file.write_bytes(data)
+
+    result = calculate_hash(file, buffer_size=7)
+
+    assert result == hashlib.md5(data).hexdigest()
+
+
+@pytest.mark.parametrize("algorithm", ["md5", "sha256", "blake2b"])
+def test_calculate_hash_algorithm(tmp_path, algorithm):
+    data = b"sample data for hashing"
+    file = tmp_path / "file.bin"
+    file.write_bytes(data)
+
+    result = calculate_hash(file, algorithm=algorithm)
+
+    assert result == hashlib.new(algorithm, data).hexdigest()
+
+
+def test_calculate_hash_unknown_algorithm(tmp_path):
+    file = tmp_path / "file.bin"
+    file.write_bytes(b"data")
+
+    with pytest.raises(ValueError):
+        calculate_hash(file, algorithm="not-a-hash")
+
+
+@pytest.mark.parametrize("data", [b"", b"a", b"mapped file contents" * 100])
+def test_calculate_hash_mmap(tmp_path, data):
+    # Files at or above the threshold are hashed via mmap; empty files can't
+    # be mapped and fall back to buffered reads
+    file = tmp_path / "mapped.bin"
+    file.write_bytes(data)
+
+    result = calculate_hash(file, buffer_size=64, mmap_threshold=1)
+
+    assert result == hashlib.md5(data).hexdigest()
+
+
+def test_calculate_partial_hash_head_and_tail(tmp_path):
+    file = tmp_path / "large.bin"
+    file.write_bytes(b"head" + b"middle" * 10 + b"tail")
+
+    result = calculate_partial_hash(file, sample_size=4)
+
+    assert result == hashlib.md5(b"headtail").hexdigest()
+
+
+def test_calculate_partial_hash_small_file_matches_full_hash(tmp_path):
+    file = tmp_path / "small.bin"
+    file.write_bytes(b"0123456")
+
+    assert calculate_partial_hash(file, sample_size=4) == calculate_hash(file)
+
+
+def test_calculate_partial_hash_file_not_found():
+    with pytest.raises(FileNotFoundError):
+        calculate_partial_hash(Path("nonexistent_file.txt"))
+
+
+def test_create_executor():
+    assert create_executor(1) is None
+    assert create_executor(0, "process") is None
+
+    executor = create_executor(2)
+    assert isinstance(executor, ThreadPoolExecutor)
+    executor.shutdown()
+
+    executor = create_executor(2, "process")
+    assert isinstance(executor, ProcessPoolExecutor)
+    executor.shutdown()
+
+    with pytest.raises(ValueError, match="Unknown worker pool: fibers"):
+        create_executor(2, "fibers")
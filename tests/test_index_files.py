@@ -0,0 +1,246 @@
+# pyright: basic
+
+
+import os
+import sqlite3
+from unittest.mock import patch
+
+from photomerge import index_files, initialize_hashes, main
+from photomerge.get_files import FileRecord
+from photomerge.index_files import INDEX_FILENAME, TargetIndex
+from photomerge.match_files import IndexEntry
+
+
+def test_target_index_reuses_unchanged_digests(tmp_path):
+    file = tmp_path / "a.jpg"
+    file.write_bytes(b"contents")
+
+    index = TargetIndex(tmp_path)
+    entry = index.lookup(FileRecord.from_path(file))
+    assert entry.digest is None
+    entry.partial, entry.digest = "partial", "digest"
+    index.update([entry])
+    index.close()
+
+    index = TargetIndex(tmp_path)
+    entry = index.lookup(FileRecord.from_path(file))
+    assert (entry.partial, entry.digest) == ("partial", "digest")
+    assert (tmp_path / INDEX_FILENAME).exists()
+    index.close()
+
+
+def test_target_index_ignores_modified_files(tmp_path):
+    file = tmp_path / "a.jpg"
+    file.write_bytes(b"contents")
+
+    index = TargetIndex(tmp_path)
+    entry = index.lookup(FileRecord.from_path(file))
+    entry.digest = "digest"
+    index.update([entry])
+    index.close()
+
+    stat = file.stat()
+    os.utime(file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+    index = TargetIndex(tmp_path)
+    assert index.lookup(FileRecord.from_path(file)).digest is None
+    index.close()
+
+
+def test_target_index_discards_digests_when_algorithm_changes(tmp_path):
+    file = tmp_path / "a.jpg"
+    file.write_bytes(b"contents")
+
+    index = TargetIndex(tmp_path, hash_options={"algorithm": "md5"})
+    entry = index.lookup(FileRecord.from_path(file))
+    entry.digest = "digest"
+    index.update([entry])
+    index.close()
+
+    index = TargetIndex(tmp_path, hash_options={"algorithm": "sha256"})
+    assert index.lookup(FileRecord.from_path(file)).digest is None
+    index.close()
+
+
+def test_target_index_records_copies_and_prunes_missing(tmp_path):
+    kept = tmp_path / "kept.jpg"
+    removed = tmp_path / "removed.jpg"
+    kept.write_bytes(b"kept")
+    removed.write_bytes(b"removed")
+
+    index = TargetIndex(tmp_path)
+    index.record(IndexEntry(kept, 4, digest="kept-digest"))
+    index.record(IndexEntry(removed, 7, digest="removed-digest"))
+    index.flush()
+
+    rows = sqlite3.connect(tmp_path / INDEX_FILENAME).execute(
+        "SELECT path, digest FROM files ORDER BY path"
+    )
+    assert rows.fetchall() == [
+        ("kept.jpg", "kept-digest"),
+        ("removed.jpg", "removed-digest"),
+    ]
+    index.close()
+
+    # a later scan that only sees kept.jpg forgets removed.jpg
+    removed.unlink()
+    index = TargetIndex(tmp_path)
+    assert [entry.digest for entry in index.scan({".jpg"})] == ["kept-digest"]
+    index.close()
+
+    index = TargetIndex(tmp_path)
+    assert len(index) == 1
+    index.close()
+
+
+def test_target_index_scan_drops_removed_folders(tmp_path):
+    (tmp_path / "ab").mkdir()
+    (tmp_path / "cd").mkdir()
+    (tmp_path / "ab" / "a.jpg").write_bytes(b"a")
+    (tmp_path / "cd" / "c.jpg").write_bytes(b"cc")
+    index = TargetIndex(tmp_path)
+    list(index.scan({".jpg"}, is_recursive=True))
+    index.close()
+
+    (tmp_path / "cd" / "c.jpg").unlink()
+    (tmp_path / "cd").rmdir()
+    index = TargetIndex(tmp_path)
+    assert [entry.path.name for entry in index.scan({".jpg"}, True)] == ["a.jpg"]
+    assert len(index) == 1
+    index.close()
+
+
+def test_target_index_rebuilds_an_older_schema(tmp_path):
+    (tmp_path / "a.jpg").write_bytes(b"contents")
+    connection = sqlite3.connect(tmp_path / INDEX_FILENAME)
+    connection.execute("CREATE TABLE files (path TEXT PRIMARY KEY, digest TEXT)")
+    connection.execute("INSERT INTO files VALUES ('a.jpg', 'digest')")
+    connection.commit()
+    connection.close()
+
+    index = TargetIndex(tmp_path)
+    (entry,) = index.scan({".jpg"})
+    assert entry.digest is None
+    index.close()
+
+
+def test_initialize_hashes_with_index_skips_rehashing(tmp_path, mocker):
+    target = tmp_path / "target"
+    target.mkdir()
+    (target / "a.jpg").write_bytes(b"same size")
+    index_path = target / INDEX_FILENAME
+
+    hashes, _ = initialize_hashes({".jpg"}, target, index_path=index_path)
+    (entry,) = list(hashes)
+    digest = hashes.full_hash(entry)
+    hashes.close()
+
+    mock_partial_hash = mocker.patch("photomerge.match_files.calculate_partial_hash")
+    hashes, _ = initialize_hashes({".jpg"}, target, index_path=index_path)
+    (entry,) = list(hashes)
+    assert hashes.full_hash(entry) == digest
+    mock_partial_hash.assert_not_called()
+    hashes.close()
+
+
+def test_target_index_scan_trusts_unchanged_folders(tmp_path, mocker):
+    (tmp_path / "ab").mkdir()
+    (tmp_path / "cd").mkdir()
+    (tmp_path / "ab" / "a.jpg").write_bytes(b"a")
+    (tmp_path / "cd" / "c.jpg").write_bytes(b"cc")
+
+    index = TargetIndex(tmp_path)
+    entries = list(index.scan({".jpg"}, is_recursive=True))
+    assert sorted(entry.size for entry in entries) == [1, 2]
+    entries[0].digest = "digest"
+    index.update(entries)
+    index.close()
+
+    spy = mocker.spy(index_files, "scan_directory")
+    (tmp_path / "cd" / "d.jpg").write_bytes(b"ddd")
+    index = TargetIndex(tmp_path)
+    entries = {entry.path.name: entry for entry in index.scan({".jpg"}, True)}
+    assert sorted(entries) == ["a.jpg", "c.jpg", "d.jpg"]
+    assert entries["a.jpg"].digest == "digest"
+    # ab is unchanged and isn't listed again, cd gained a file
+    scanned = {call.args[0] for call in spy.call_args_list}
+    assert str(tmp_path / "ab") not in scanned
+    assert str(tmp_path / "cd") in scanned
+    index.close()
+
+
+def test_target_index_scan_notices_rewrites_in_unchanged_folders(tmp_path):
+    (tmp_path / "ab").mkdir()
+    file = tmp_path / "ab" / "a.jpg"
+    file.write_bytes(b"aaaa")
+
+    index = TargetIndex(tmp_path)
+    (entry,) = index.scan({".jpg"}, is_recursive=True)
+    entry.digest = "digest"
+    index.update([entry])
+    index.close()
+
+    folder_mtime = (tmp_path / "ab").stat().st_mtime_ns
+    file.write_bytes(b"bbbb")
+    stat = file.stat()
+    os.utime(file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert (tmp_path / "ab").stat().st_mtime_ns == folder_mtime
+
+    index = TargetIndex(tmp_path)
+    (entry,) = index.scan({".jpg"}, is_recursive=True)
+    assert entry.digest is None
+    index.close()
+
+
+def test_compact_hashes_keep_index_rows(tmp_path):
+    (tmp_path / "a.jpg").write_bytes(b"contents")
+    index_path = tmp_path / INDEX_FILENAME
+
+    hashes, _ = initialize_hashes({".jpg"}, tmp_path, index_path=index_path)
+    (entry,) = list(hashes)
+    hashes.full_hash(entry)
+    hashes.close()
+
+    options = {"compact": True}
+    hashes, _ = initialize_hashes({".jpg"}, tmp_path, options, index_path)
+    assert len(hashes) == 1 and list(hashes) == []
+    hashes.close()
+
+    index = TargetIndex(tmp_path)
+    assert len(index) == 1
+    index.close()
+
+
+def test_target_index_through_a_symlinked_target(tmp_path):
+    real = tmp_path / "real"
+    real.mkdir()
+    (real / "a.jpg").write_bytes(b"contents")
+    link = tmp_path / "link"
+    link.symlink_to(real)
+
+    index = TargetIndex(link)
+    assert [entry.path for entry in index.scan({".jpg"})] == [link / "a.jpg"]
+    (link / "b.jpg").write_bytes(b"copied")
+    index.record(IndexEntry(link / "b.jpg", 6, "partial", "digest"))
+    index.close()
+
+    index = TargetIndex(real)
+    entry = index.lookup(FileRecord.from_path(real / "b.jpg"))
+    assert entry.digest == "digest"
+    index.close()
+
+
+def test_merge_into_a_symlinked_target(tmp_path):
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "a.jpg").write_bytes(b"one")
+    (source / "b.jpg").write_bytes(b"two")
+    real = tmp_path / "real"
+    real.mkdir()
+    link = tmp_path / "link"
+    link.symlink_to(real)
+
+    with patch("sys.argv", f"prog -s {source} -t {link}".split()):
+        main()
+
+    assert sorted(path.name for path in real.glob("*.jpg")) == ["a.jpg", "b.jpg"]
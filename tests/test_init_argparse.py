@@ -13,10 +13,11 @@ def test_parse_args_required_arguments():
 
     with patch("sys.argv", test_args):
         args = app_arg_parser().parse_args()
-        assert args.source == "source_path"
+        assert args.source == ["source_path"]
         assert args.target == "target_path"
         assert args.verbose is False  # Default when not specified
         assert args.non_recursive is True  # Default when not specified
+        assert args.workers is None  # Falls back to the config value
 
 
 def test_parse_args_short_flag_names():
@@ -24,7 +25,7 @@ def test_parse_args_short_flag_names():
 
     with patch("sys.argv", test_args):
         args = app_arg_parser().parse_args()
-        assert args.source == "source_path"
+        assert args.source == ["source_path"]
         assert args.target == "target_path"
         assert args.verbose is True  # Set by -v flag
         assert args.non_recursive is False  # Set by -n flag
@@ -39,7 +40,7 @@ def test_parse_args_all_arguments():
 
     with patch("sys.argv", test_args):
         args = app_arg_parser().parse_args()
-        assert args.source == "source_path"
+        assert args.source == ["source_path"]
         assert args.target == "target_path"
         assert args.verbose is True  # Set by --verbose flag
         assert args.non_recursive is False  # Set by --non_recursive flag
@@ -51,3 +52,97 @@ def test_parse_args_missing_required_arguments():
 
     with patch("sys.argv", test_args), pytest.raises(SystemExit):
         app_arg_parser().parse_args()  # Should exit due to missing --target
+
+
+def test_parse_args_workers():
+    test_args = "prog -s source_path -t target_path --workers 4".split()
+
+    with patch("sys.argv", test_args):
+        args = app_arg_parser().parse_args()
+        assert args.workers == 4
+
+
+def test_parse_args_pipeline():
+    test_args = "prog -s source_path -t target_path --pipeline".split()
+
+    with patch("sys.argv", test_args):
+        args = app_arg_parser().parse_args()
+        assert args.pipeline is True
+
+
+def test_parse_args_copy_strategy():
+    test_args = "prog -s source_path -t target_path --copy_strategy hardlink".split()
+
+    with patch("sys.argv", test_args):
+        args = app_arg_parser().parse_args()
+        assert args.copy_strategy == "hardlink"
+
+
+def test_parse_args_unknown_copy_strategy():
+    test_args = "prog -s source_path -t target_path --copy_strategy teleport".split()
+
+    with patch("sys.argv", test_args), pytest.raises(SystemExit):
+        app_arg_parser().parse_args()
+
+
+def test_parse_args_stats_json():
+    test_args = "prog -s source_path -t target_path --stats_json stats.json".split()
+
+    with patch("sys.argv", test_args):
+        args = app_arg_parser().parse_args()
+        assert args.stats_json == "stats.json"
+
+
+def test_parse_args_logging():
+    test_args = "prog -s src -t tgt --log_file run.log --log_level WARNING".split()
+
+    with patch("sys.argv", test_args):
+        args = app_arg_parser().parse_args()
+        assert args.log_file == "run.log"
+        assert args.log_level == "WARNING"
+
+
+def test_parse_args_resume():
+    test_args = "prog -s source_path -t target_path --resume".split()
+
+    with patch("sys.argv", test_args):
+        args = app_arg_parser().parse_args()
+        assert args.resume is True
+
+
+def test_parse_args_many_sources():
+    test_args = "prog -s card1 card2 /mnt/usb -t target_path".split()
+
+    with patch("sys.argv", test_args):
+        args = app_arg_parser().parse_args()
+        assert args.source == ["card1", "card2", "/mnt/usb"]
+
+
+def test_parse_args_read_order():
+    test_args = "prog -s source_path -t target_path --read_order physical".split()
+
+    with patch("sys.argv", test_args):
+        args = app_arg_parser().parse_args()
+        assert args.read_order == "physical"
+
+
+def test_parse_args_incremental():
+    test_args = "prog -s source_path -t target_path --incremental".split()
+
+    with patch("sys.argv", test_args):
+        args = app_arg_parser().parse_args()
+        assert args.incremental is True
+
+
+def test_parse_args_throttle():
+    test_args = (
+        "prog -s source_path -t target_path --adaptive --max_read_mbps 50 "
+        "--max_write_mbps 20.5 --low_priority"
+    ).split()
+
+    with patch("sys.argv", test_args):
+        args = app_arg_parser().parse_args()
+        assert args.adaptive is True
+        assert args.max_read_mbps == 50
+        assert args.max_write_mbps == 20.5
+        assert args.low_priority is True
@@ -3,34 +3,38 @@
 
 from pathlib import Path
 from photomerge import initialize_hashes
+from photomerge.get_files import FileRecord
 
 
-def test_initialize_hashes_success(mocker):
+def test_initialize_hashes_success(tmp_path, mocker):
+    files = []
+    for name, contents in [
+        ("file1.jpg", b"one"),
+        ("file2.jpg", b"two!"),
+        ("file3.png", b"three"),
+    ]:
+        file = tmp_path / name
+        file.write_bytes(contents)
+        files.append(FileRecord.from_path(file))
+
     # Mock find_files_with_extensions to simulate files in the directory
     mock_find_files = mocker.patch(
-        "photomerge.find_files_with_extensions",
-        return_value=[
-            Path("file1.jpg"),
-            Path("file2.jpg"),
-            Path("file3.png"),
-        ],
-    )
-
-    # Mock calculate_hash to return a unique hash for each file
-    mock_calculate_hash = mocker.patch(
-        "photomerge.calculate_hash", side_effect=["hash1", "hash2", "hash3"]
+        "photomerge.find_files_with_extensions", return_value=files
     )
+    mock_calculate_hash = mocker.patch("photomerge.match_files.calculate_hash")
+    mock_partial_hash = mocker.patch("photomerge.match_files.calculate_partial_hash")
 
     # Call the function
-    hashes, filenames = initialize_hashes({".png", ".jpg"}, Path("out_dir"))
+    hashes, filenames = initialize_hashes({".png", ".jpg"}, tmp_path)
 
-    # Assertions
-    assert hashes == {"hash1", "hash2", "hash3"}
-    assert filenames == {"file1.jpg", "file2.jpg", "file3.png"}
+    # Assertions: files are indexed by size without being read
+    assert len(hashes) == 3
+    assert set(filenames) == {"file1.jpg", "file2.jpg", "file3.png"}
     mock_find_files.assert_called_once_with(
-        Path("out_dir"), {".png", ".jpg"}, is_recursive=False
+        tmp_path, {".png", ".jpg"}, is_recursive=False
     )
-    assert mock_calculate_hash.call_count == 3
+    mock_calculate_hash.assert_not_called()
+    mock_partial_hash.assert_not_called()
 
 
 def test_initialize_hashes_empty_directory(mocker):
@@ -43,8 +47,19 @@ def test_initialize_hashes_empty_directory(mocker):
     hashes, filenames = initialize_hashes({".png", ".jpg"}, Path("out_dir"))
 
     # Assertions
-    assert hashes == set()
-    assert filenames == set()
+    assert len(hashes) == 0
+    assert len(filenames) == 0
     mock_find_files.assert_called_once_with(
         Path("out_dir"), {".png", ".jpg"}, is_recursive=False
     )
+
+
+def test_initialize_hashes_passes_hash_options(mocker):
+    mocker.patch("photomerge.find_files_with_extensions", return_value=[])
+
+    hashes, _ = initialize_hashes(
+        {".jpg"}, Path("out_dir"), {"algorithm": "sha256", "sample_size": 16}
+    )
+
+    assert hashes.hash_options == {"algorithm": "sha256"}
+    assert hashes.sample_size == 16
@@ -3,7 +3,7 @@
 from pathlib import Path
 import pytest
 
-from photomerge import initialize_paths
+from photomerge import initialize_paths, initialize_target
 
 
 def test_initialize_paths_success(tmp_path):
@@ -43,3 +43,8 @@ def test_initialize_paths_target_missing(tmp_path):
         match=f"Target directory does not exist: {target_dir}",
     ):
         initialize_paths(str(source_dir), str(target_dir))
+
+
+def test_initialize_target_missing(tmp_path):
+    with pytest.raises(FileNotFoundError, match="Target directory does not exist"):
+        initialize_target(str(tmp_path / "Missing"))
@@ -1,9 +1,11 @@
+import json
 from pathlib import Path
 import pytest
 import tempfile
 from unittest.mock import patch
 
 from photomerge import main as photomerge_main
+from photomerge.throttle_files import READ_LIMIT, WRITE_LIMIT
 
 
 @pytest.fixture
@@ -88,3 +90,63 @@ def test_main_config_failure(source_dir, target_dir, caplog):
 
         assert "Config file not found: path/that/doesnt/exist" in caplog.text
         assert not (Path(str(target_dir)) / "file1.jpg").exists()
+
+
+def test_main_writes_stats_json(source_dir, target_dir, tmp_path):
+    stats_path = tmp_path / "stats.json"
+    test_args = f"prog --source {source_dir} --target {target_dir} --stats_json {stats_path}".split()
+
+    with patch("sys.argv", test_args):
+        photomerge_main()
+
+    counters = json.loads(stats_path.read_text())["counters"]
+    assert counters["files_seen"] == 4
+    assert counters["new_photos"] == 4
+    assert counters["renames"] == 2
+    assert counters["files_copied"] == 4
+
+
+def test_main_many_sources(source_dir, target_dir, tmp_path):
+    other = tmp_path / "card"
+    other.mkdir()
+    (other / "file1.jpg").write_bytes(b"from another card")
+    (other / "file3.jpg").write_bytes(b"folder1/file2.png")
+    test_args = f"prog -s {source_dir} {other} -t {target_dir}".split()
+
+    with patch("sys.argv", test_args):
+        photomerge_main()
+
+    names = sorted(p.name for p in target_dir.iterdir() if not p.name.startswith("."))
+    assert names == [
+        "file1.jpg",
+        "file1_1.jpg",
+        "file1_2.jpg",
+        "file1_3.jpg",
+        "file2.png",
+    ]
+
+
+@pytest.fixture
+def reset_throttle():
+    yield
+    # the caps are process-wide, later tests run without them
+    READ_LIMIT.bytes_per_second = WRITE_LIMIT.bytes_per_second = None
+
+
+def test_main_adaptive_and_throttled(source_dir, target_dir, tmp_path, reset_throttle):
+    stats_path = tmp_path / "stats.json"
+    test_args = (
+        f"prog -s {source_dir} -t {target_dir} --adaptive --max_read_mbps 100 "
+        f"--max_write_mbps 100 --low_priority --stats_json {stats_path}"
+    ).split()
+
+    with (
+        patch("sys.argv", test_args),
+        patch("photomerge.throttle_files.lower_priority") as lower_priority,
+    ):
+        photomerge_main()
+
+    lower_priority.assert_called_once()
+    counters = json.loads(stats_path.read_text())["counters"]
+    assert counters["new_photos"] == 4
+    assert counters["files_copied"] == 4
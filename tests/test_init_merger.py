@@ -0,0 +1,142 @@
+import asyncio
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+import photomerge
+from photomerge import PhotoMerger
+
+
+@pytest.fixture
+def source_dir(tmp_path):
+    source = tmp_path / "source"
+    (source / "folder").mkdir(parents=True)
+    for name in ["a.jpg", "folder/b.jpg", "folder/a.jpg"]:
+        (source / name).write_bytes(b"photo " + name.encode())
+    return source
+
+
+@pytest.fixture
+def target_dir(tmp_path):
+    target = tmp_path / "target"
+    target.mkdir()
+    return target
+
+
+def test_merge_copies_and_reports_counters(source_dir, target_dir):
+    with PhotoMerger(target_dir) as merger:
+        result = merger.merge([source_dir])
+
+    assert result["counters"]["new_photos"] == 3
+    assert result["seconds"] >= 0
+    assert len(list(target_dir.glob("*.jpg"))) == 3
+
+
+def test_merge_reuses_the_index(source_dir, target_dir, tmp_path):
+    second = tmp_path / "second"
+    second.mkdir()
+    (second / "c.jpg").write_bytes(b"photo a.jpg")
+    (second / "d.jpg").write_bytes(b"a new photo")
+
+    with PhotoMerger(target_dir) as merger:
+        merger.merge([source_dir])
+        with patch(
+            "photomerge.initialize_hashes", wraps=photomerge.initialize_hashes
+        ) as initialize_hashes:
+            result = merger.merge([second])
+
+    initialize_hashes.assert_not_called()
+    assert result["counters"]["duplicates"] == 1
+    assert result["counters"]["new_photos"] == 1
+
+
+def test_add_source_is_merged_once(source_dir, target_dir):
+    with PhotoMerger(target_dir) as merger:
+        merger.add_source(source_dir)
+        first = merger.merge()
+        second = merger.merge()
+
+    assert first["counters"]["new_photos"] == 3
+    assert "new_photos" not in second["counters"]
+
+
+def test_add_source_rejects_missing_source(target_dir, tmp_path):
+    with PhotoMerger(target_dir) as merger:
+        with pytest.raises(FileNotFoundError):
+            merger.add_source(tmp_path / "missing")
+
+
+def test_progress_reports_each_file(source_dir, target_dir):
+    seen = []
+    with PhotoMerger(
+        target_dir, progress=lambda path, outcome: seen.append((path.name, outcome))
+    ) as merger:
+        merger.merge([source_dir])
+        merger.merge([source_dir])
+
+    assert sorted(seen[:3]) == [("a.jpg", "copied")] * 2 + [("b.jpg", "copied")]
+    assert sorted(outcome for _, outcome in seen[3:]) == ["duplicate"] * 3
+
+
+def test_merge_path(source_dir, target_dir):
+    seen = []
+    with PhotoMerger(target_dir, progress=lambda *args: seen.append(args)) as merger:
+        merger.merge_path(source_dir / "a.jpg")
+
+    assert seen == [(source_dir / "a.jpg", "copied")]
+    assert [path.name for path in target_dir.glob("*.jpg")] == ["a.jpg"]
+
+
+def test_amerge(source_dir, target_dir):
+    async def run(merger):
+        return await merger.amerge([source_dir])
+
+    with PhotoMerger(target_dir) as merger:
+        result = asyncio.run(run(merger))
+
+    assert result["counters"]["new_photos"] == 3
+
+
+def test_close_saves_the_index(source_dir, target_dir):
+    with PhotoMerger(target_dir) as merger:
+        merger.merge([source_dir])
+
+    assert (target_dir / photomerge.INDEX_FILENAME).exists()
+    assert Path(merger.out_dir) == target_dir
+
+
+def test_merge_with_a_bad_source_queues_none(source_dir, target_dir, tmp_path):
+    with PhotoMerger(target_dir) as merger:
+        with pytest.raises(FileNotFoundError):
+            merger.merge([source_dir, tmp_path / "missing"])
+        result = merger.merge()
+
+    assert "new_photos" not in result["counters"]
+    assert list(target_dir.glob("*.jpg")) == []
+
+
+def test_source_added_during_a_merge_is_kept(source_dir, target_dir, tmp_path):
+    late = tmp_path / "late"
+    late.mkdir()
+    (late / "c.jpg").write_bytes(b"arrived late")
+    added = []
+
+    def progress(path, outcome):
+        if not added:
+            added.append(path)
+            merger.add_source(late)
+
+    with PhotoMerger(target_dir, progress=progress) as merger:
+        merger.merge([source_dir])
+        result = merger.merge()
+
+    assert result["counters"]["new_photos"] == 1
+    assert (target_dir / "c.jpg").exists()
+
+
+def test_close_twice(source_dir, target_dir):
+    with PhotoMerger(target_dir) as merger:
+        merger.merge([source_dir])
+        merger.close()
+    merger.close()
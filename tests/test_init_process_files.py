@@ -1,11 +1,17 @@
 # pyright: basic
 
 
+import hashlib
 from pathlib import Path
 import pytest
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 from photomerge import process_files
+from photomerge import match_files
+from photomerge.layout_files import HashLayout
+from photomerge.match_files import HashIndex, IndexEntry
+from photomerge.name_files import NameIndex
 
 
 @pytest.fixture()
@@ -61,8 +67,8 @@ def test_process_files_ignores_file_in_ignored_files(source_dir, target_dir, cap
     process_files(
         data_dir=source_dir,
         out_dir=target_dir,
-        hashes=set(),
-        filenames=set(),
+        hashes=HashIndex(),
+        filenames=NameIndex(),
         allowed_extensions={".jpg", ".png"},
         ignored_files=ignored_files,
         is_recursive=True,
@@ -82,8 +88,8 @@ def test_process_files_new_file_copied_successfully(source_dir, target_dir, capl
     process_files(
         data_dir=source_dir,
         out_dir=target_dir,
-        hashes=set(),
-        filenames=set(),
+        hashes=HashIndex(),
+        filenames=NameIndex(),
         allowed_extensions=allowed_extensions,
         ignored_files=set(),
         is_recursive=True,
@@ -118,8 +124,8 @@ def test_process_files_copy_failure(bad_source_dir, target_dir, mocker, caplog):
     process_files(
         data_dir=bad_source_dir,
         out_dir=target_dir,
-        hashes=set(),
-        filenames=set(),
+        hashes=HashIndex(),
+        filenames=NameIndex(),
         allowed_extensions={".jpg", ".png"},
         ignored_files=set(),
         is_recursive=True,
@@ -140,8 +146,8 @@ def test_process_files_respects_is_not_recursive(source_dir, target_dir, caplog)
     process_files(
         data_dir=source_dir,
         out_dir=target_dir,
-        hashes=set(),
-        filenames=set(),
+        hashes=HashIndex(),
+        filenames=NameIndex(),
         allowed_extensions=allowed_extensions,
         ignored_files=set(),
         is_recursive=False,
@@ -165,8 +171,8 @@ def test_process_files_respects_allowed_extensions(source_dir, target_dir, caplo
     process_files(
         data_dir=source_dir,
         out_dir=target_dir,
-        hashes=set(),
-        filenames=set(),
+        hashes=HashIndex(),
+        filenames=NameIndex(),
         allowed_extensions=allowed_extensions,
         ignored_files=set(),
         is_recursive=True,
@@ -182,3 +188,178 @@ def test_process_files_respects_allowed_extensions(source_dir, target_dir, caplo
     assert f"Saved: file3.jpg in {target_dir}" in caplog.text
     assert f"Saved: file4.txt in {target_dir}" not in caplog.text
     assert f"Saved: file1.jpg in {target_dir} as file1_1.jpg" in caplog.text
+
+
+def test_process_files_skips_duplicate_content(tmp_path, target_dir, caplog):
+    caplog.set_level(10)  # Set log level to INFO
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "a.jpg").write_bytes(b"same contents")
+    (source / "b.jpg").write_bytes(b"same contents")
+    (source / "c.jpg").write_bytes(b"diff contents")
+
+    process_files(
+        data_dir=source,
+        out_dir=target_dir,
+        hashes=HashIndex(),
+        filenames=NameIndex(),
+        allowed_extensions={".jpg"},
+        ignored_files=set(),
+        is_recursive=True,
+    )
+
+    # only one of the identical files is copied, the same-sized one still is
+    copied = sorted(p.name for p in target_dir.iterdir())
+    assert len(copied) == 2
+    assert "c.jpg" in copied
+
+
+def test_process_files_parallel_matches_serial(tmp_path):
+    source = tmp_path / "source"
+    (source / "sub").mkdir(parents=True)
+    for name, contents in [
+        ("a.jpg", b"same contents"),
+        ("sub/a.jpg", b"diff contents"),
+        ("b.jpg", b"same contents"),
+        ("sub/c.jpg", b"diff contents"),
+        ("d.jpg", b"unique"),
+    ]:
+        (source / name).write_bytes(contents)
+
+    results = []
+    for executor in [None, ThreadPoolExecutor(max_workers=4)]:
+        target = tmp_path / f"target_{len(results)}"
+        target.mkdir()
+        process_files(
+            data_dir=source,
+            out_dir=target,
+            hashes=HashIndex(),
+            filenames=NameIndex(),
+            allowed_extensions={".jpg"},
+            ignored_files=set(),
+            is_recursive=True,
+            executor=executor,
+            batch_size=2,
+        )
+        results.append({p.name: p.read_bytes() for p in target.iterdir()})
+
+    assert results[0] == results[1]
+    assert len(results[0]) == 3
+
+
+def test_process_files_pipeline_never_copies_duplicates_twice(tmp_path):
+    source = tmp_path / "source"
+    target = tmp_path / "target"
+    target.mkdir()
+    for folder in range(10):
+        (source / f"folder{folder}").mkdir(parents=True)
+        for idx in range(5):
+            # five distinct same-sized photos, each present in every folder
+            file = source / f"folder{folder}" / f"IMG_{idx}.jpg"
+            file.write_bytes(f"photo {idx}".encode())
+
+    process_files(
+        data_dir=source,
+        out_dir=target,
+        hashes=HashIndex(),
+        filenames=NameIndex(),
+        allowed_extensions={".jpg"},
+        ignored_files=set(),
+        is_recursive=True,
+        pipeline={"hash_workers": 8, "copy_workers": 4, "queue_size": 4},
+    )
+
+    contents = sorted(p.read_bytes() for p in target.iterdir())
+    assert contents == [f"photo {idx}".encode() for idx in range(5)]
+
+
+def test_process_files_stream_reads_new_files_once(tmp_path, target_dir, mocker):
+    source = tmp_path / "source"
+    source.mkdir()
+    (target_dir / "existing.jpg").write_bytes(b"head-middle1-tail")
+    (source / "dup.jpg").write_bytes(b"head-middle1-tail")
+    (source / "new.jpg").write_bytes(b"head-middle2-tail")
+    (source / "unique.jpg").write_bytes(b"a different size")
+
+    hashes = HashIndex({"sample_size": 4})
+    hashes.add(IndexEntry(target_dir / "existing.jpg", 17))
+    spy = mocker.spy(match_files, "calculate_hash")
+
+    process_files(
+        data_dir=source,
+        out_dir=target_dir,
+        hashes=hashes,
+        filenames=NameIndex({"existing.jpg"}),
+        allowed_extensions={".jpg"},
+        ignored_files=set(),
+        is_recursive=True,
+        copy_strategy="stream",
+    )
+
+    # only the target file is read in full, the sources are hashed as copied
+    assert [call.args[0].name for call in spy.call_args_list] == ["existing.jpg"]
+    assert sorted(p.name for p in target_dir.iterdir()) == [
+        "existing.jpg",
+        "new.jpg",
+        "unique.jpg",
+    ]
+    assert all(entry.digest is not None for entry in hashes)
+
+
+def test_process_files_hash_layout_shards_by_digest(tmp_path, target_dir):
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "a.jpg").write_bytes(b"photo a")
+    (source / "b.jpg").write_bytes(b"photo b")
+    (source / "c.jpg").write_bytes(b"photo a")
+
+    for strategy in ["copy", "stream"]:
+        target = target_dir / strategy
+        target.mkdir()
+        process_files(
+            data_dir=source,
+            out_dir=target,
+            hashes=HashIndex(),
+            filenames=NameIndex(),
+            allowed_extensions={".jpg"},
+            ignored_files=set(),
+            is_recursive=True,
+            copy_strategy=strategy,
+            layout=HashLayout(levels=1),
+        )
+
+        saved = sorted(p.relative_to(target).as_posix() for p in target.rglob("*.jpg"))
+        digests = [
+            hashlib.md5(b"photo a").hexdigest(),
+            hashlib.md5(b"photo b").hexdigest(),
+        ]
+        assert saved == sorted([f"{digests[0][:2]}/a.jpg", f"{digests[1][:2]}/b.jpg"])
+
+
+@pytest.mark.parametrize("read_order", ["inode", "physical"])
+def test_process_files_read_order_copies_in_sorted_order(tmp_path, mocker, read_order):
+    source, target = tmp_path / "source", tmp_path / "target"
+    (source / "sub").mkdir(parents=True)
+    target.mkdir()
+    for size, name in enumerate(["b.jpg", "sub/a.jpg", "c.jpg"], 1):
+        (source / name).write_bytes(b"x" * size)
+    copy_file = mocker.patch("photomerge.copy_file", return_value=True)
+
+    process_files(
+        data_dir=source,
+        out_dir=target,
+        hashes=HashIndex(),
+        filenames=NameIndex(),
+        allowed_extensions={".jpg"},
+        ignored_files=set(),
+        is_recursive=True,
+        read_order=read_order,
+        read_batch=2,
+    )
+
+    copied = [call.args[0] for call in copy_file.call_args_list]
+    assert sorted(copied) == sorted(source.rglob("*.jpg"))
+    if read_order == "inode":
+        # the first batch of two is sorted, the last file comes after it
+        first = copied[:2]
+        assert first == sorted(first, key=lambda path: path.stat().st_ino)
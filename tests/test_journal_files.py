@@ -0,0 +1,233 @@
+# pyright: basic
+
+
+import json
+import os
+import signal
+import subprocess
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+import photomerge
+from photomerge import initialize_hashes, main, process_files
+from photomerge.journal_files import Journal
+from photomerge.layout_files import HashLayout
+from photomerge.match_files import IndexEntry
+from photomerge.metrics import METRICS
+
+
+@pytest.fixture()
+def dirs(tmp_path):
+    source = tmp_path / "source"
+    target = tmp_path / "target"
+    source.mkdir()
+    target.mkdir()
+    (target / "a.jpg").write_bytes(b"already merged")
+    (source / "a.jpg").write_bytes(b"a new photo")
+    (source / "b.jpg").write_bytes(b"already merged")
+    (source / "c.jpg").write_bytes(b"another photo")
+    return source, target
+
+
+def merge(source, target, journal, copy_strategy="copy", layout=None):
+    hashes, filenames = initialize_hashes({".jpg"}, target, layout=layout)
+    process_files(
+        source,
+        target,
+        hashes,
+        filenames,
+        {".jpg"},
+        set(),
+        True,
+        copy_strategy=copy_strategy,
+        layout=layout,
+        journal=journal,
+    )
+    journal.close()
+
+
+def read_lines(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+@pytest.mark.parametrize("copy_strategy", ["copy", "stream"])
+def test_journal_records_outcomes(dirs, tmp_path, copy_strategy):
+    source, target = dirs
+    merge(source, target, Journal(tmp_path / "journal.jsonl"), copy_strategy)
+
+    done = {
+        line["source"]: line
+        for line in read_lines(tmp_path / "journal.jsonl")
+        if line["op"] == "done"
+    }
+    assert done[str(source / "b.jpg")]["outcome"] == "duplicate"
+    assert done[str(source / "a.jpg")]["outcome"] == "copied"
+    assert done[str(source / "a.jpg")]["dest"] == str(target / "a_1.jpg")
+    assert done[str(source / "c.jpg")]["mtime_ns"] == (
+        (source / "c.jpg").stat().st_mtime_ns
+    )
+
+
+def test_stream_journals_the_sharded_folder(dirs, tmp_path):
+    source, target = dirs
+    merge(source, target, Journal(tmp_path / "journal.jsonl"), "stream", HashLayout())
+
+    started = [
+        line["dest"]
+        for line in read_lines(tmp_path / "journal.jsonl")
+        if line["op"] == "start" and line["source"] == str(source / "c.jpg")
+    ]
+    copied = next(target.glob("*/*/c.jpg"))
+    assert started == [str(target / "c.jpg"), str(copied)]
+
+
+def test_start_is_flushed_and_synced_with_done_lines(dirs, tmp_path):
+    source, target = dirs
+    journal = Journal(tmp_path / "journal.jsonl", sync_seconds=3600)
+    with patch("os.fsync") as fsync:
+        journal.start(IndexEntry(source / "c.jpg", 13), target / "c.jpg")
+
+    fsync.assert_not_called()
+    assert read_lines(tmp_path / "journal.jsonl")[0]["op"] == "start"
+    journal.close()
+
+
+def test_resume_skips_completed_files(dirs, tmp_path):
+    source, target = dirs
+    merge(source, target, Journal(tmp_path / "journal.jsonl"))
+    (source / "d.jpg").write_bytes(b"added after the crash")
+    (source / "c.jpg").write_bytes(b"changed after the crash")
+
+    METRICS.reset()
+    journal = Journal(tmp_path / "journal.jsonl", resume=True)
+    assert len(journal) == 3
+    merge(source, target, journal)
+
+    assert METRICS.get("resumed") == 2
+    assert (target / "d.jpg").exists()
+    assert (target / "c_1.jpg").read_bytes() == b"changed after the crash"
+
+
+def test_started_copy_is_removed(dirs, tmp_path):
+    source, target = dirs
+    (target / "a_1.jpg").write_bytes(b"a new")
+    (target / ".c.jpg.partial").write_bytes(b"anoth")
+    lines = [
+        {
+            "op": "start",
+            "source": str(source / "a.jpg"),
+            "dest": str(target / "a_1.jpg"),
+        },
+        {"op": "start", "source": str(source / "c.jpg"), "dest": str(target / "c.jpg")},
+        {
+            "op": "start",
+            "source": str(source / "c.jpg"),
+            "dest": str(target / "ab" / "c.jpg"),
+        },
+    ]
+    (target / "ab").mkdir()
+    (target / "ab" / "c.jpg").write_bytes(b"another photo")
+    (tmp_path / "journal.jsonl").write_text(
+        "".join(json.dumps(line) + "\n" for line in lines) + '{"op": "do'
+    )
+
+    journal = Journal(tmp_path / "journal.jsonl", resume=True)
+    journal.close()
+
+    assert len(journal) == 0
+    assert sorted(p.name for p in target.iterdir()) == ["a.jpg", "ab"]
+    assert list((target / "ab").iterdir()) == []
+
+
+KILLED_DURING_COPY = """
+import os, signal, sys
+from pathlib import Path
+from photomerge.journal_files import Journal
+from photomerge.layout_files import HashLayout
+from photomerge.match_files import IndexEntry
+from photomerge.match_files import IndexEntry
+
+source, destination, journal_path = map(Path, sys.argv[1:])
+journal = Journal(journal_path, sync_seconds=3600)
+journal.start(IndexEntry(source, source.stat().st_size), destination)
+destination.write_bytes(source.read_bytes()[:3])
+os.kill(os.getpid(), signal.SIGKILL)
+"""
+
+
+def test_copy_killed_after_start_is_removed(dirs, tmp_path):
+    source, target = dirs
+    journal_path = tmp_path / "journal.jsonl"
+    env = dict(os.environ, PYTHONPATH=str(Path(photomerge.__file__).parents[1]))
+    child = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            KILLED_DURING_COPY,
+            str(source / "c.jpg"),
+            str(target / "c.jpg"),
+            str(journal_path),
+        ],
+        env=env,
+    )
+    assert child.returncode == -signal.SIGKILL
+    assert (target / "c.jpg").exists()
+
+    Journal(journal_path).close()
+
+    assert not (target / "c.jpg").exists()
+
+
+def test_started_move_is_kept(dirs, tmp_path):
+    source, target = dirs
+    (source / "a.jpg").rename(target / "a_1.jpg")
+    line = {
+        "op": "start",
+        "source": str(source / "a.jpg"),
+        "dest": str(target / "a_1.jpg"),
+    }
+    (tmp_path / "journal.jsonl").write_text(json.dumps(line) + "\n")
+
+    Journal(tmp_path / "journal.jsonl").close()
+
+    assert (target / "a_1.jpg").read_bytes() == b"a new photo"
+
+
+def test_truncated_copy_is_not_completed(dirs, tmp_path):
+    source, target = dirs
+    merge(source, target, Journal(tmp_path / "journal.jsonl"))
+    (target / "c.jpg").write_bytes(b"anoth")
+
+    journal = Journal(tmp_path / "journal.jsonl", resume=True)
+    journal.close()
+
+    assert str(source / "c.jpg") not in journal.completed
+    assert str(source / "a.jpg") in journal.completed
+    assert not (target / "c.jpg").exists()
+
+
+def test_without_resume_journal_starts_over(dirs, tmp_path):
+    source, target = dirs
+    merge(source, target, Journal(tmp_path / "journal.jsonl"))
+
+    journal = Journal(tmp_path / "journal.jsonl")
+    journal.close()
+
+    assert len(journal) == 0
+    assert (tmp_path / "journal.jsonl").read_text() == ""
+
+
+def test_main_resume(dirs, tmp_path):
+    source, target = dirs
+    args = f"prog -s {source} -t {target} --stats_json {tmp_path / 'stats.json'}"
+    with patch("sys.argv", args.split()):
+        main()
+    with patch("sys.argv", [*args.split(), "--resume"]):
+        main()
+
+    stats = json.loads((tmp_path / "stats.json").read_text())
+    assert stats["counters"]["resumed"] == 3
+    assert (target / ".photomerge-journal.jsonl").exists()
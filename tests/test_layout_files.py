@@ -0,0 +1,53 @@
+# pyright: basic
+
+
+import os
+from datetime import datetime
+
+import pytest
+
+from photomerge.layout_files import (
+    CountLayout,
+    DateLayout,
+    FlatLayout,
+    HashLayout,
+    create_layout,
+)
+from photomerge.match_files import IndexEntry
+
+
+def test_flat_layout_keeps_target_root():
+    assert FlatLayout().folder(IndexEntry("a.jpg", 1)) == ""
+
+
+def test_hash_layout_uses_digest_prefix():
+    entry = IndexEntry("a.jpg", 1, digest="abcdef0123")
+
+    assert HashLayout().folder(entry) == "ab/cd"
+    assert HashLayout(levels=3, width=1).folder(entry) == "a/b/c"
+
+
+def test_date_layout_falls_back_to_mtime(tmp_path):
+    file = tmp_path / "a.jpg"
+    file.write_bytes(b"not an image")
+    taken = datetime(2021, 7, 4, 12, 0).timestamp()
+    os.utime(file, (taken, taken))
+
+    assert DateLayout().folder(IndexEntry(file, 12)) == "2021/07"
+    assert DateLayout("%Y-%m-%d", "exif").folder(IndexEntry(file, 12)) == "2021-07-04"
+
+
+def test_count_layout_fills_folders_in_order():
+    layout = CountLayout(files_per_folder=2)
+    layout.start(3)
+
+    folders = [layout.folder(IndexEntry("a.jpg", 1)) for _ in range(3)]
+    assert folders == ["00001", "00002", "00002"]
+
+
+def test_create_layout():
+    assert type(create_layout({})) is FlatLayout
+    assert create_layout({"type": "hash", "hash_levels": 1}).levels == 1
+    assert create_layout({"type": "count"}).files_per_folder == 1000
+    with pytest.raises(ValueError):
+        create_layout({"type": "bogus"})
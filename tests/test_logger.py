@@ -7,6 +7,12 @@ import logging
 from photomerge.logger import setup_logging, add_console_handler
 
 
+def listener_handlers(logger):
+    # handlers are run by the queue listener, the logger only has the queue
+    (queue_handler,) = logger.handlers
+    return queue_handler.listener.handlers
+
+
 @pytest.fixture
 def temp_log_file(tmp_path):
     # Ensure the directory exists and create a temporary log file path
@@ -24,6 +30,7 @@ def isolated_logger():
     yield logger
 
     logger.handlers = []
+    logger.setLevel(logging.NOTSET)
 
 
 def test_setup_logging_adds_file_handler(temp_log_file, isolated_logger):
@@ -31,9 +38,10 @@ def test_setup_logging_adds_file_handler(temp_log_file, isolated_logger):
     logger = setup_logging(temp_log_file)
 
     # Verify there is one handler and it's a FileHandler
-    assert len(logger.handlers) == 1
-    assert logger.handlers[0].__class__.__name__ == "FileHandler"
-    assert logger.handlers[0].level == logging.DEBUG
+    handlers = listener_handlers(logger)
+    assert len(handlers) == 1
+    assert isinstance(handlers[0], logging.FileHandler)
+    assert handlers[0].level == logging.DEBUG
 
 
 def test_setup_logging_does_not_add_duplicate_file_handler(temp_log_file):
@@ -43,7 +51,7 @@ def test_setup_logging_does_not_add_duplicate_file_handler(temp_log_file):
 
     # Ensure only one FileHandler is present
     file_handlers = [
-        h for h in logger.handlers if h.__class__.__name__ == "FileHandler"
+        h for h in listener_handlers(logger) if isinstance(h, logging.FileHandler)
     ]
     assert len(file_handlers) == 1
 
@@ -56,9 +64,10 @@ def test_add_console_handler_adds_stream_handler(temp_log_file):
     add_console_handler(logger)
 
     # Ensure there are two handlers: FileHandler and StreamHandler
-    assert len(logger.handlers) == 2
-    assert any(h.__class__.__name__ == "FileHandler" for h in logger.handlers)
-    assert any(h.__class__.__name__ == "StreamHandler" for h in logger.handlers)
+    handlers = listener_handlers(logger)
+    assert len(handlers) == 2
+    assert any(isinstance(h, logging.FileHandler) for h in handlers)
+    assert any(h.__class__.__name__ == "StreamHandler" for h in handlers)
 
 
 def test_add_console_handler_does_not_add_duplicate_stream_handler(temp_log_file):
@@ -69,11 +78,34 @@ def test_add_console_handler_does_not_add_duplicate_stream_handler(temp_log_file
 
     # Ensure only one StreamHandler is present
     stream_handlers = [
-        h for h in logger.handlers if h.__class__.__name__ == "StreamHandler"
+        h for h in listener_handlers(logger) if h.__class__.__name__ == "StreamHandler"
     ]
     assert len(stream_handlers) == 1
 
 
+def test_records_are_written_by_listener(temp_log_file, isolated_logger):
+    logger = setup_logging(temp_log_file)
+    logger.info("Saved: %s in %s", "a.jpg", "target")
+
+    (queue_handler,) = logger.handlers
+    queue_handler.listener.stop()
+    for handler in listener_handlers(logger):
+        handler.close()
+
+    assert "INFO - Saved: a.jpg in target" in temp_log_file.read_text()
+
+
+def test_disabled_level_skips_formatting(temp_log_file, isolated_logger):
+    class Exploding:
+        def __str__(self):
+            raise AssertionError("formatted")
+
+    logger = setup_logging(temp_log_file, level="WARNING")
+    logger.info("New photo found: %s", Exploding())
+
+    assert not logger.isEnabledFor(logging.INFO)
+
+
 # def test_add_console_handler_logs_to_stdout(temp_log_file, capsys):
 #     # Initialize logger with file handler
 #     logger = setup_logging(temp_log_file)
@@ -0,0 +1,205 @@
+# pyright: basic
+
+
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+
+from photomerge import match_files
+from photomerge.index_files import TargetIndex
+from photomerge.match_files import HashIndex, IndexEntry
+
+
+def make_entry(tmp_path, name, contents):
+    file = tmp_path / name
+    file.write_bytes(contents)
+    return IndexEntry(file, len(contents))
+
+
+def test_find_duplicate_unique_size_reads_nothing(tmp_path, mocker):
+    mock_calculate_hash = mocker.patch("photomerge.match_files.calculate_hash")
+    mock_partial_hash = mocker.patch("photomerge.match_files.calculate_partial_hash")
+
+    index = HashIndex()
+    index.add(make_entry(tmp_path, "a.jpg", b"aaaa"))
+
+    assert index.find_duplicate(make_entry(tmp_path, "b.jpg", b"bbbbbb")) is None
+    mock_calculate_hash.assert_not_called()
+    mock_partial_hash.assert_not_called()
+
+
+def test_find_duplicate_partial_mismatch_skips_full_hash(tmp_path, mocker):
+    mock_calculate_hash = mocker.patch("photomerge.match_files.calculate_hash")
+
+    index = HashIndex({"sample_size": 2})
+    index.add(make_entry(tmp_path, "a.jpg", b"aa--aa"))
+
+    assert index.find_duplicate(make_entry(tmp_path, "b.jpg", b"bb--bb")) is None
+    mock_calculate_hash.assert_not_called()
+
+
+def test_find_duplicate_partial_collision_compares_full_hash(tmp_path):
+    index = HashIndex({"sample_size": 2})
+    existing = index.add(make_entry(tmp_path, "a.jpg", b"aa12aa"))
+
+    different = make_entry(tmp_path, "b.jpg", b"aa34aa")
+    identical = make_entry(tmp_path, "c.jpg", b"aa12aa")
+
+    assert index.find_duplicate(different) is None
+    assert different.digest == hashlib.md5(b"aa34aa").hexdigest()
+    assert index.find_duplicate(identical) is existing
+
+
+def test_partial_hash_of_small_file_is_full_digest(tmp_path, mocker):
+    mock_calculate_hash = mocker.patch("photomerge.match_files.calculate_hash")
+
+    index = HashIndex({"sample_size": 4})
+    entry = make_entry(tmp_path, "a.jpg", b"12345678")
+
+    assert index.full_hash(entry) == hashlib.md5(b"12345678").hexdigest()
+    assert entry.partial == entry.digest
+    mock_calculate_hash.assert_not_called()
+
+
+def test_hash_index_uses_configured_algorithm(tmp_path):
+    index = HashIndex({"algorithm": "sha256", "sample_size": 2})
+    entry = make_entry(tmp_path, "a.jpg", b"abcdefgh")
+
+    assert index.full_hash(entry) == hashlib.sha256(b"abcdefgh").hexdigest()
+    assert index.partial_hash(entry) == hashlib.sha256(b"abgh").hexdigest()
+
+
+def test_prefetch_hashes_only_colliding_entries(tmp_path):
+    index = HashIndex({"sample_size": 2})
+    target = index.add(make_entry(tmp_path, "t.jpg", b"aa12aa"))
+    same_partial = make_entry(tmp_path, "a.jpg", b"aa34aa")
+    other_partial = make_entry(tmp_path, "b.jpg", b"bb34bb")
+    unique = make_entry(tmp_path, "c.jpg", b"unique size")
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        index.prefetch([same_partial, other_partial, unique], executor)
+
+    assert target.digest == hashlib.md5(b"aa12aa").hexdigest()
+    assert same_partial.digest == hashlib.md5(b"aa34aa").hexdigest()
+    assert other_partial.partial is not None
+    assert other_partial.digest is None
+    assert unique.partial is None and unique.digest is None
+
+
+def test_prefetch_leaves_failures_for_serial_pass(tmp_path):
+    index = HashIndex()
+    index.add(make_entry(tmp_path, "a.jpg", b"aaaa"))
+    missing = IndexEntry(tmp_path / "missing.jpg", 4)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        index.prefetch([missing], executor)
+
+    assert missing.partial is None
+    with pytest.raises(FileNotFoundError):
+        index.find_duplicate(missing)
+
+
+def test_claim_defers_full_hash_until_settled(tmp_path, mocker):
+    index = HashIndex({"sample_size": 2})
+    target = index.add(make_entry(tmp_path, "t.jpg", b"aa12aa"))
+    duplicate = make_entry(tmp_path, "a.jpg", b"aa12aa")
+    different = make_entry(tmp_path, "b.jpg", b"aa34aa")
+
+    mock_calculate_hash = mocker.patch("photomerge.match_files.calculate_hash")
+    assert index.claim(duplicate, defer_full_hash=True) is None
+    assert index.claim(different, defer_full_hash=True) is None
+    mock_calculate_hash.assert_not_called()
+    assert len(index) == 1
+    mocker.stopall()
+
+    # digests as computed while copying
+    duplicate.digest = hashlib.md5(b"aa12aa").hexdigest()
+    different.digest = hashlib.md5(b"aa34aa").hexdigest()
+    assert index.settle(duplicate) is target
+    assert index.settle(different) is None
+    assert len(index) == 2
+
+    # settling an entry that wasn't deferred is a no-op
+    assert index.settle(target) is None
+
+
+def test_claim_only_defers_on_partial_collision(tmp_path):
+    index = HashIndex({"sample_size": 2})
+    index.add(make_entry(tmp_path, "t.jpg", b"aa12aa"))
+    entry = make_entry(tmp_path, "a.jpg", b"bb12bb")
+
+    assert index.claim(entry, defer_full_hash=True) is None
+    assert len(index) == 2
+    assert index.settle(entry) is None
+    assert len(index) == 2
+
+
+def test_release_forgets_deferred_entry(tmp_path):
+    index = HashIndex({"sample_size": 2})
+    index.add(make_entry(tmp_path, "t.jpg", b"aa12aa"))
+    entry = make_entry(tmp_path, "a.jpg", b"aa12aa")
+
+    index.claim(entry, defer_full_hash=True)
+    index.release(entry)
+
+    entry.digest = "anything"
+    assert index.settle(entry) is None
+    assert len(index) == 1
+
+
+def make_compact_index(tmp_path, files):
+    target = tmp_path / "target"
+    target.mkdir()
+    for name, contents in files.items():
+        (target / name).write_bytes(contents)
+    index = HashIndex({"sample_size": 2, "compact": True}, store=TargetIndex(target))
+    for entry in index.store.scan({".jpg"}):
+        index.add(entry)
+    return index
+
+
+def test_compact_index_matches_stored_entries_without_keeping_them(tmp_path):
+    index = make_compact_index(tmp_path, {"t.jpg": b"aa12aa", "u.jpg": b"unhashed"})
+
+    assert len(index) == 2
+    assert list(index) == []
+
+    duplicate = index.find_duplicate(make_entry(tmp_path, "a.jpg", b"aa12aa"))
+    assert duplicate is not None
+    assert duplicate.path == tmp_path / "target" / "t.jpg"
+    assert index.claim(make_entry(tmp_path, "b.jpg", b"aa12aa")) is not None
+    assert index.claim(make_entry(tmp_path, "c.jpg", b"aa34aa")) is None
+    assert len(index) == 3
+    index.close()
+
+
+def test_compact_index_saves_hashes_of_stored_entries(tmp_path, mocker):
+    index = make_compact_index(tmp_path, {"t.jpg": b"aa12aa"})
+    index.find_duplicate(make_entry(tmp_path, "a.jpg", b"aa12aa"))
+
+    spy = mocker.spy(match_files, "calculate_hash")
+    assert index.claim(make_entry(tmp_path, "b.jpg", b"aa12aa")) is not None
+    assert spy.call_count == 1
+    index.close()
+
+
+def test_compact_index_without_a_store_keeps_entries(tmp_path):
+    index = HashIndex({"compact": True})
+    entry = index.add(make_entry(tmp_path, "t.jpg", b"contents"))
+
+    assert list(index) == [entry]
+
+
+def test_compact_index_defers_full_hash(tmp_path, mocker):
+    index = make_compact_index(tmp_path, {"t.jpg": b"aa12aa"})
+
+    entry = make_entry(tmp_path, "a.jpg", b"aa12aa")
+    mock_calculate_hash = mocker.patch("photomerge.match_files.calculate_hash")
+    assert index.claim(entry, defer_full_hash=True) is None
+    mock_calculate_hash.assert_not_called()
+    mocker.stopall()
+
+    entry.digest = hashlib.md5(b"aa12aa").hexdigest()
+    assert index.settle(entry) is not None
+    assert len(index) == 1
+    index.close()
@@ -0,0 +1,74 @@
+# pyright: basic
+
+
+import json
+import threading
+
+from photomerge.metrics import Metrics, TextfileExporter
+
+
+def test_counters_and_labels():
+    metrics = Metrics()
+    metrics.count("files_seen", 3)
+    metrics.count("files_seen")
+    metrics.count("errors", stage="copy")
+
+    assert metrics.get("files_seen") == 4
+    assert metrics.get("errors", stage="copy") == 1
+    assert metrics.snapshot()["counters"] == {
+        "errors": {"stage=copy": 1},
+        "files_seen": 4,
+    }
+
+
+def test_counters_are_thread_safe():
+    metrics = Metrics()
+
+    def work():
+        for _ in range(1000):
+            metrics.count("bytes_hashed", 2)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert metrics.get("bytes_hashed") == 16000
+
+
+def test_timer_fills_histogram():
+    metrics = Metrics()
+    metrics.observe("hash", 0.003)
+    metrics.observe("hash", 2.0)
+    with metrics.timer("hash"):
+        pass
+
+    histogram = metrics.snapshot()["histograms"]["hash"]
+    assert histogram["count"] == 3
+    assert histogram["buckets"]["0.005"] == 2
+    assert histogram["buckets"]["5.0"] == 3
+
+
+def test_prometheus_textfile(tmp_path):
+    metrics = Metrics()
+    metrics.count("errors", stage="scan")
+    metrics.observe("copy", 0.2)
+
+    exporter = TextfileExporter(metrics, tmp_path / "photomerge.prom", 60).start()
+    exporter.stop()
+
+    text = (tmp_path / "photomerge.prom").read_text()
+    assert 'photomerge_errors_total{stage="scan"} 1' in text
+    assert 'photomerge_copy_seconds_bucket{le="0.5"} 1' in text
+    assert "photomerge_copy_seconds_count 1" in text
+
+
+def test_write_json(tmp_path):
+    metrics = Metrics()
+    metrics.count("duplicates")
+    metrics.write_json(tmp_path / "stats.json")
+
+    stats = json.loads((tmp_path / "stats.json").read_text())
+    assert stats["counters"] == {"duplicates": 1}
+    assert not list(tmp_path.glob(".*"))
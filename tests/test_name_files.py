@@ -0,0 +1,57 @@
+# pyright: basic
+
+
+import threading
+
+from photomerge.name_files import NameIndex
+
+
+def test_claim_free_name():
+    names = NameIndex()
+
+    assert names.claim("IMG_0001.JPG") == "IMG_0001.JPG"
+    assert "IMG_0001.JPG" in names
+
+
+def test_claim_numbers_colliding_names():
+    names = NameIndex({"IMG_0001.JPG", "IMG_0001_1.JPG", "IMG_0001_3.JPG"})
+
+    assert names.claim("IMG_0001.JPG") == "IMG_0001_2.JPG"
+    assert names.claim("IMG_0001.JPG") == "IMG_0001_4.JPG"
+    assert names.claim("IMG_0001.png") == "IMG_0001.png"
+    assert names.claim("IMG_0001.png") == "IMG_0001_1.png"
+
+
+def test_claim_does_not_rescan_taken_numbers():
+    names = NameIndex({"a.jpg"} | {f"a_{idx}.jpg" for idx in range(1, 1000)})
+
+    assert names.claim("a.jpg") == "a_1000.jpg"
+    names.add("a_1001.jpg")
+    assert names.claim("a.jpg") == "a_1002.jpg"
+    assert names._next[("a", ".jpg")] == 1003
+
+
+def test_release_frees_name():
+    names = NameIndex()
+    names.claim("a.jpg")
+    names.release("a.jpg")
+
+    assert "a.jpg" not in names
+    assert names.claim("a.jpg") == "a.jpg"
+
+
+def test_claim_is_thread_safe():
+    names = NameIndex()
+    claimed = []
+
+    def worker():
+        for _ in range(200):
+            claimed.append(names.claim("IMG_0001.JPG"))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(claimed)) == len(claimed) == 1600
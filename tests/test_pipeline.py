@@ -0,0 +1,59 @@
+# pyright: basic
+
+
+import threading
+
+from photomerge.pipeline import run_pipeline
+
+
+def test_run_pipeline_passes_items_through_stages():
+    saved = []
+    lock = threading.Lock()
+
+    def save(item, result):
+        with lock:
+            saved.append((item, result))
+
+    run_pipeline(
+        range(100),
+        decide=lambda item: item * 2 if item % 3 else None,
+        save=save,
+        hash_workers=4,
+        copy_workers=3,
+        queue_size=2,
+    )
+
+    assert sorted(saved) == [(i, i * 2) for i in range(100) if i % 3]
+
+
+def test_run_pipeline_logs_and_skips_failures(caplog):
+    saved = []
+
+    def decide(item):
+        if item == 1:
+            raise OSError("unreadable")
+        return item
+
+    def save(item, result):
+        if item == 2:
+            raise OSError("disk full")
+        saved.append(item)
+
+    run_pipeline([0, 1, 2, 3], decide=decide, save=save)
+
+    assert sorted(saved) == [0, 3]
+    assert "Error hashing 1 - unreadable" in caplog.text
+    assert "Error saving 2 - disk full" in caplog.text
+
+
+def test_run_pipeline_logs_scan_failure(caplog):
+    saved = []
+
+    def items():
+        yield 1
+        raise OSError("source went away")
+
+    run_pipeline(items(), decide=lambda item: item, save=lambda i, r: saved.append(i))
+
+    assert saved == [1]
+    assert "Error scanning source files - source went away" in caplog.text
@@ -0,0 +1,167 @@
+# pyright: basic
+
+
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import pytest
+
+from photomerge import initialize_hashes, main, plan_merge, source_entries
+from photomerge import plan_files
+from photomerge.index_files import TargetIndex
+from photomerge.layout_files import FlatLayout
+from photomerge.plan_files import PlanWriter, apply_plan, read_plan, read_plan_header
+
+
+@pytest.fixture()
+def dirs(tmp_path):
+    source = tmp_path / "source"
+    target = tmp_path / "target"
+    (source / "sub").mkdir(parents=True)
+    target.mkdir()
+    (target / "a.jpg").write_bytes(b"already merged")
+    (source / "a.jpg").write_bytes(b"a new photo")
+    (source / "sub" / "a.jpg").write_bytes(b"another photo")
+    (source / "b.jpg").write_bytes(b"already merged")
+    return source, target
+
+
+def make_plan(source, target, plan_path, executor=None):
+    hashes, filenames = initialize_hashes({".jpg"}, target)
+    with PlanWriter(plan_path, source=str(source), target=str(target)) as writer:
+        plan_merge(
+            writer,
+            source_entries(source, {".jpg"}, set(), True),
+            hashes,
+            filenames,
+            FlatLayout(),
+            executor=executor,
+            batch_size=2,
+        )
+
+
+def test_plan_lists_actions_without_copying(dirs, tmp_path):
+    source, target = dirs
+    make_plan(source, target, tmp_path / "plan.jsonl")
+
+    header, actions = read_plan(tmp_path / "plan.jsonl")
+    actions = {action["source"]: action for action in actions}
+    assert header["target"] == str(target)
+    assert actions[str(source / "b.jpg")]["action"] == "skip"
+    assert actions[str(source / "a.jpg")]["action"] == "rename"
+    assert actions[str(source / "a.jpg")]["name"] == "a_1.jpg"
+    assert actions[str(source / "sub" / "a.jpg")]["digest"] == (
+        hashlib.md5(b"another photo").hexdigest()
+    )
+    assert sorted(p.name for p in target.iterdir()) == ["a.jpg"]
+
+
+def test_parallel_plan_matches_serial(dirs, tmp_path):
+    source, target = dirs
+    make_plan(source, target, tmp_path / "serial.jsonl")
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        make_plan(source, target, tmp_path / "parallel.jsonl", executor)
+
+    assert list(read_plan(tmp_path / "serial.jsonl")[1]) == list(
+        read_plan(tmp_path / "parallel.jsonl")[1]
+    )
+
+
+def test_apply_copies_without_hashing(dirs, tmp_path, mocker):
+    source, target = dirs
+    make_plan(source, target, tmp_path / "plan.jsonl")
+    spy = mocker.spy(plan_files, "copy_file")
+    mock_calculate_hash = mocker.patch("photomerge.match_files.calculate_hash")
+
+    store = TargetIndex(target)
+    assert apply_plan(tmp_path / "plan.jsonl", workers=2, store=store) == 3
+    store.close()
+
+    contents = {p.name: p.read_bytes() for p in target.glob("*.jpg")}
+    assert contents == {
+        "a.jpg": b"already merged",
+        "a_1.jpg": b"a new photo",
+        "a_2.jpg": b"another photo",
+    }
+    assert spy.call_count == 2
+    mock_calculate_hash.assert_not_called()
+
+    index = TargetIndex(target)
+    assert len(index) == 2
+    index.close()
+
+
+def test_apply_resumes_from_offset(dirs, tmp_path):
+    source, target = dirs
+    make_plan(source, target, tmp_path / "plan.jsonl")
+
+    assert apply_plan(tmp_path / "plan.jsonl", start=2) == 3
+    assert sorted(p.name for p in target.iterdir()) == ["a.jpg", "a_2.jpg"]
+
+    # applying everything again only fills in the gap
+    assert apply_plan(tmp_path / "plan.jsonl") == 3
+    assert sorted(p.name for p in target.iterdir()) == ["a.jpg", "a_1.jpg", "a_2.jpg"]
+
+
+def test_apply_skips_sources_changed_since_plan(dirs, tmp_path, caplog):
+    source, target = dirs
+    make_plan(source, target, tmp_path / "plan.jsonl")
+    (source / "a.jpg").write_bytes(b"edited after planning")
+
+    apply_plan(tmp_path / "plan.jsonl")
+
+    assert not (target / "a_1.jpg").exists()
+    assert "changed since the plan was made" in caplog.text
+
+
+def test_read_plan_rejects_other_files(tmp_path):
+    (tmp_path / "plan.jsonl").write_text(json.dumps({"something": "else"}) + "\n")
+
+    with pytest.raises(ValueError):
+        read_plan(tmp_path / "plan.jsonl")
+    with pytest.raises(ValueError):
+        read_plan_header(tmp_path / "plan.jsonl")
+
+
+def test_read_plan_header(dirs, tmp_path):
+    source, target = dirs
+    make_plan(source, target, tmp_path / "plan.jsonl")
+
+    header = read_plan_header(tmp_path / "plan.jsonl")
+
+    assert (header["source"], header["target"]) == (str(source), str(target))
+
+
+def test_main_plan_and_apply(dirs, tmp_path):
+    source, target = dirs
+    plan_path = tmp_path / "plan.jsonl"
+
+    with patch("sys.argv", f"prog plan -s {source} -t {target} -p {plan_path}".split()):
+        main()
+    assert sorted(p.name for p in target.glob("*.jpg")) == ["a.jpg"]
+
+    with patch("sys.argv", f"prog apply -p {plan_path} -w 2".split()):
+        main()
+    assert sorted(p.name for p in target.glob("*.jpg")) == [
+        "a.jpg",
+        "a_1.jpg",
+        "a_2.jpg",
+    ]
+
+
+def test_apply_rejects_other_photo_with_same_name_and_size(dirs, tmp_path, caplog):
+    source, target = dirs
+    make_plan(source, target, tmp_path / "plan.jsonl")
+    (target / "a_1.jpg").write_bytes(b"A NEW PHOTO")
+
+    store = TargetIndex(target)
+    apply_plan(tmp_path / "plan.jsonl", store=store)
+    store.close()
+
+    assert (target / "a_1.jpg").read_bytes() == b"A NEW PHOTO"
+    assert "already exists" in caplog.text
+    index = TargetIndex(target)
+    assert len(index) == 1
+    index.close()
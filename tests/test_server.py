@@ -0,0 +1,182 @@
+# pyright: basic
+
+
+import json
+import os
+import socket
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from photomerge import main
+from photomerge.metrics import METRICS
+from photomerge.server import MergeServer, submit
+
+
+def read_json_stream(text):
+    decoder, objects, index = json.JSONDecoder(), [], 0
+    text = text.strip()
+    while index < len(text):
+        obj, index = decoder.raw_decode(text, index)
+        objects.append(obj)
+        index = len(text) - len(text[index:].lstrip())
+    return objects
+
+
+@pytest.fixture()
+def serve(tmp_path):
+    servers = []
+
+    def start(run_job):
+        server = MergeServer(tmp_path / "s.sock", run_job)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        servers.append((server, thread))
+        return server
+
+    yield start
+
+    for server, thread in servers:
+        server.shutdown()
+        thread.join()
+        server.server_close()
+
+
+def test_merge_returns_job_counters(serve):
+    METRICS.count("new_photos", 5)
+
+    def run_job(request):
+        METRICS.count("new_photos", len(request["sources"]))
+        METRICS.count("errors", stage="copy")
+
+    server = serve(run_job)
+    response = submit(server.socket_path, {"op": "merge", "sources": ["a", "b"]})
+
+    assert response["ok"] is True
+    assert response["job"] == 1
+    assert response["counters"] == {"new_photos": 2, "errors": {"stage=copy": 1}}
+
+
+def test_failed_job_reports_error(serve):
+    def run_job(request):
+        raise FileNotFoundError("Source directory does not exist: a")
+
+    server = serve(run_job)
+    response = submit(server.socket_path, {"op": "merge", "sources": ["a"]})
+
+    assert response == {
+        "ok": False,
+        "job": 1,
+        "error": "Source directory does not exist: a",
+    }
+
+
+def test_jobs_run_one_at_a_time(serve):
+    running = []
+
+    def run_job(request):
+        running.append(request["sources"][0])
+        time.sleep(0.05)
+        assert len(running) == 1
+        running.pop()
+
+    server = serve(run_job)
+    threads = [
+        threading.Thread(
+            target=submit, args=(server.socket_path, {"op": "merge", "sources": [n]})
+        )
+        for n in "abc"
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert submit(server.socket_path, {"op": "stats"})["jobs"] == 3
+
+
+def test_bad_requests(serve):
+    server = serve(lambda request: None)
+
+    assert submit(server.socket_path, {"op": "reindex"}) == {
+        "ok": False,
+        "error": "Unknown op: reindex",
+    }
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(str(server.socket_path))
+        client.sendall(b"not json\n")
+        response = json.loads(client.makefile("rb").readline())
+    assert response["ok"] is False
+
+
+def test_socket_is_private(serve):
+    umask = os.umask(0o022)
+    try:
+        server = serve(lambda request: None)
+        assert os.umask(0o022) == 0o022
+    finally:
+        os.umask(umask)
+    assert server.socket_path.stat().st_mode & 0o777 == 0o600
+
+
+def test_clients_that_leave_are_quiet(serve, capfd):
+    server = serve(lambda request: None)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(str(server.socket_path))
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(str(server.socket_path))
+        client.sendall(b"not json\n")
+
+    assert submit(server.socket_path, {"op": "stats"})["ok"] is True
+    assert "Traceback" not in capfd.readouterr().err
+
+
+def test_stale_socket_is_replaced(tmp_path, serve):
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(str(tmp_path / "s.sock"))
+    stale.close()
+
+    server = serve(lambda request: None)
+    assert submit(server.socket_path, {"op": "stats"})["ok"] is True
+
+    with pytest.raises(OSError, match="already listening"):
+        MergeServer(server.socket_path, lambda request: None)
+
+
+def test_main_serve_and_submit(tmp_path, capsys):
+    source, target = tmp_path / "source", tmp_path / "target"
+    source.mkdir()
+    target.mkdir()
+    (target / "old.jpg").write_bytes(b"already merged")
+    (source / "old.jpg").write_bytes(b"already merged")
+    (source / "new.jpg").write_bytes(b"a new photo")
+    responses = []
+
+    def client():
+        deadline = time.monotonic() + 10
+        while not (target / ".photomerge.sock").exists():
+            if time.monotonic() > deadline:
+                return
+            time.sleep(0.05)
+        for args in [f"-s {source}", f"-s {tmp_path / 'missing'}", "--shutdown"]:
+            with patch("sys.argv", f"prog submit -t {target} {args}".split()):
+                try:
+                    main()
+                except SystemExit as exit:
+                    responses.append(exit.code)
+
+    thread = threading.Thread(target=client)
+    thread.start()
+    with patch("sys.argv", f"prog serve -t {target}".split()):
+        main()
+    thread.join()
+
+    printed = read_json_stream(capsys.readouterr().out)
+    assert [response["ok"] for response in printed] == [True, False, True]
+    assert printed[0]["counters"]["new_photos"] == 1
+    assert printed[0]["counters"]["duplicates"] == 1
+    assert responses == [1]
+    assert (target / "new.jpg").exists()
+    assert not (target / ".photomerge.sock").exists()
@@ -0,0 +1,175 @@
+# pyright: basic
+
+
+import random
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from photomerge import initialize_hashes, initialize_similar, process_files
+from photomerge.index_files import INDEX_FILENAME
+from photomerge.layout_files import FlatLayout
+from photomerge.match_files import HashIndex
+from photomerge.name_files import NameIndex
+from photomerge.similar_files import BKTree, SimilarIndex, calculate_dhash
+
+
+def make_photo(path, size=(64, 48), quality=90):
+    Image = pytest.importorskip("PIL.Image")
+    image = Image.new("L", (64, 48))
+    image.putdata([(x * 4 + y * 2) % 256 for y in range(48) for x in range(64)])
+    image.resize(size).save(path, quality=quality)
+    return path
+
+
+def test_bk_tree_search_matches_linear_scan():
+    rng = random.Random(0)
+    values = [rng.getrandbits(64) for _ in range(2000)]
+    tree = BKTree()
+    for idx, value in enumerate(values):
+        tree.add(value, idx)
+
+    query = values[42] ^ 0b1011
+    expected = sorted(
+        (bin(query ^ value).count("1"), idx)
+        for idx, value in enumerate(values)
+        if bin(query ^ value).count("1") <= 10
+    )
+    assert sorted(tree.search(query, 10)) == expected
+    assert tree.search(query, 3)[0] == (3, 42)
+    assert len(tree) == 2000
+
+
+def test_dhash_survives_resizing_and_recompression(tmp_path):
+    original = calculate_dhash(make_photo(tmp_path / "a.jpg"))
+    resized = calculate_dhash(make_photo(tmp_path / "b.jpg", (128, 96), quality=40))
+
+    assert original is not None and resized is not None
+    assert (original ^ resized).bit_count() <= 6
+
+
+def test_dhash_of_non_image_is_none(tmp_path):
+    pytest.importorskip("PIL")
+    file = tmp_path / "a.jpg"
+    file.write_bytes(b"not an image")
+
+    assert calculate_dhash(file) is None
+
+
+def test_similar_index_claims_near_duplicates(tmp_path):
+    similar = SimilarIndex(threshold=6)
+    similar.add_files([make_photo(tmp_path / "a.jpg")])
+
+    assert similar.claim(make_photo(tmp_path / "b.png", (32, 24))) == tmp_path / "a.jpg"
+    assert similar.claim(tmp_path / "a.jpg") == tmp_path / "a.jpg"
+    assert len(similar) == 1
+
+
+def test_similar_index_claims_on_the_calling_thread(tmp_path):
+    executor = MagicMock()
+    executor.map.side_effect = lambda fn, paths, chunksize: map(fn, paths)
+    similar = SimilarIndex(threshold=6, executor=executor)
+    similar.add_files([make_photo(tmp_path / "a.jpg")])
+
+    assert similar.claim(make_photo(tmp_path / "b.png", (32, 24))) == tmp_path / "a.jpg"
+    executor.map.assert_called_once()
+    executor.submit.assert_not_called()
+
+
+def test_similar_index_claims_prefetched_photos(tmp_path, mocker):
+    executor = MagicMock()
+    executor.map.side_effect = lambda fn, paths, chunksize: map(fn, paths)
+    similar = SimilarIndex(threshold=6, executor=executor)
+    similar.add_files([make_photo(tmp_path / "a.jpg")])
+    similar.prefetch([make_photo(tmp_path / "b.png", (32, 24))])
+
+    spy = mocker.spy(similar, "_dhash")
+    assert similar.claim(tmp_path / "b.png") == tmp_path / "a.jpg"
+    spy.assert_not_called()
+    assert executor.map.call_count == 2
+
+
+def make_similar(target, hash_workers=1):
+    config = {"extensions": {"allowed": [".jpg"], "similarity": True}}
+    hashes, _ = initialize_hashes({".jpg"}, target, index_path=target / INDEX_FILENAME)
+    similar = initialize_similar(
+        config, target, {".jpg"}, FlatLayout(), hash_workers, hashes.store
+    )
+    return hashes, similar
+
+
+def test_initialize_similar_keeps_target_hashes_in_the_index(tmp_path, mocker):
+    make_photo(tmp_path / "a.jpg")
+    (tmp_path / "b.jpg").write_bytes(b"not an image")
+    with patch("os.cpu_count", return_value=1):
+        hashes, similar = make_similar(tmp_path)
+    assert len(similar) == 1
+    hashes.close()
+
+    add_files = mocker.spy(SimilarIndex, "add_files")
+    with patch("os.cpu_count", return_value=1):
+        hashes, similar = make_similar(tmp_path)
+    assert len(similar) == 1
+    assert list(add_files.call_args.args[1]) == []
+    hashes.close()
+
+
+def test_initialize_similar_decodes_on_a_pool_with_one_hash_worker(tmp_path):
+    with patch("os.cpu_count", return_value=4):
+        hashes, similar = make_similar(tmp_path, hash_workers=1)
+    hashes.close()
+
+    assert similar.executor is not None
+    similar.executor.shutdown()
+
+
+def test_process_files_skips_similar_photos(tmp_path, caplog):
+    caplog.set_level(10)
+    source = tmp_path / "source"
+    target = tmp_path / "target"
+    source.mkdir()
+    target.mkdir()
+    make_photo(source / "a.jpg")
+    make_photo(source / "b.jpg", (128, 96), quality=40)
+
+    process_files(
+        data_dir=source,
+        out_dir=target,
+        hashes=HashIndex(),
+        filenames=NameIndex(),
+        allowed_extensions={".jpg"},
+        ignored_files=set(),
+        is_recursive=True,
+        similar=SimilarIndex(),
+    )
+
+    assert len(list(target.iterdir())) == 1
+    assert "Similar photo found" in caplog.text
+
+
+def test_process_files_prefetches_similar_photos_without_hash_workers(tmp_path):
+    source = tmp_path / "source"
+    target = tmp_path / "target"
+    source.mkdir()
+    target.mkdir()
+    make_photo(source / "a.jpg")
+    make_photo(source / "b.jpg", (128, 96), quality=40)
+    executor = MagicMock()
+    executor.map.side_effect = lambda fn, paths, chunksize: map(fn, list(paths))
+    similar = SimilarIndex(executor=executor)
+
+    with patch.object(similar, "_dhash", wraps=similar._dhash) as dhash:
+        process_files(
+            data_dir=source,
+            out_dir=target,
+            hashes=HashIndex(),
+            filenames=NameIndex(),
+            allowed_extensions={".jpg"},
+            ignored_files=set(),
+            is_recursive=True,
+            similar=similar,
+        )
+
+    assert len(list(target.iterdir())) == 1
+    executor.map.assert_called_once()
+    assert dhash.call_count == 2
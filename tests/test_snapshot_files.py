@@ -0,0 +1,120 @@
+# pyright: basic
+
+
+import json
+import os
+from unittest.mock import patch
+
+import pytest
+
+from photomerge import main
+from photomerge import snapshot_files
+from photomerge.snapshot_files import SourceSnapshot
+
+
+@pytest.fixture()
+def source(tmp_path):
+    source = tmp_path / "source"
+    (source / "2023" / "june").mkdir(parents=True)
+    (source / "2024").mkdir()
+    (source / "a.jpg").write_bytes(b"a")
+    (source / "2023" / "june" / "b.jpg").write_bytes(b"bb")
+    (source / "2024" / "c.jpg").write_bytes(b"ccc")
+    return source
+
+
+def touch_dir(folder):
+    # directory mtimes can have a coarse resolution, make the change visible
+    mtime_ns = folder.stat().st_mtime_ns + 1_000_000_000
+    os.utime(folder, ns=(mtime_ns, mtime_ns))
+
+
+def rescan(snapshot_path, source, outcome="copied", settings=None):
+    snapshot = SourceSnapshot(snapshot_path, settings or {"extensions": [".jpg"]})
+    records = list(snapshot.scan(source, {".jpg"}))
+    for record in records:
+        snapshot.finish(record.path, outcome, "digest")
+    snapshot.save()
+    snapshot.close()
+    return sorted(record.path.relative_to(source).as_posix() for record in records)
+
+
+def test_unchanged_tree_is_not_listed(source, tmp_path):
+    snapshot_path = tmp_path / "snapshot.sqlite3"
+    assert rescan(snapshot_path, source) == ["2023/june/b.jpg", "2024/c.jpg", "a.jpg"]
+
+    with patch.object(
+        snapshot_files, "scan_directory", side_effect=AssertionError("listed")
+    ):
+        assert rescan(snapshot_path, source) == []
+
+
+def test_added_and_renamed_files_are_found(source, tmp_path):
+    snapshot_path = tmp_path / "snapshot.sqlite3"
+    rescan(snapshot_path, source)
+    (source / "2023" / "june" / "d.jpg").write_bytes(b"dddd")
+    touch_dir(source / "2023" / "june")
+    (source / "2024" / "c.jpg").rename(source / "2024" / "e.jpg")
+    touch_dir(source / "2024")
+
+    assert rescan(snapshot_path, source) == ["2023/june/d.jpg", "2024/e.jpg"]
+    assert rescan(snapshot_path, source) == []
+
+
+def test_failed_files_are_looked_at_again(source, tmp_path):
+    snapshot_path = tmp_path / "snapshot.sqlite3"
+    rescan(snapshot_path, source, outcome="failed")
+
+    assert len(rescan(snapshot_path, source)) == 3
+    assert rescan(snapshot_path, source) == []
+
+
+def test_interrupted_run_keeps_last_snapshot(source, tmp_path):
+    snapshot_path = tmp_path / "snapshot.sqlite3"
+    rescan(snapshot_path, source)
+    (source / "f.jpg").write_bytes(b"fffff")
+    touch_dir(source)
+
+    snapshot = SourceSnapshot(snapshot_path, {"extensions": [".jpg"]})
+    assert [record.name for record in snapshot.scan(source, {".jpg"})] == ["f.jpg"]
+    snapshot.close()
+
+    assert rescan(snapshot_path, source) == ["f.jpg"]
+
+
+def test_other_settings_start_over(source, tmp_path):
+    snapshot_path = tmp_path / "snapshot.sqlite3"
+    rescan(snapshot_path, source)
+
+    settings = {"extensions": [".jpg", ".png"]}
+    assert len(rescan(snapshot_path, source, settings=settings)) == 3
+
+
+def test_roots_are_kept_apart(source, tmp_path):
+    snapshot_path = tmp_path / "snapshot.sqlite3"
+    other = tmp_path / "other"
+    other.mkdir()
+    (other / "a.jpg").write_bytes(b"other a")
+
+    rescan(snapshot_path, source)
+    assert rescan(snapshot_path, other) == ["a.jpg"]
+    assert rescan(snapshot_path, source) == []
+
+
+def test_main_incremental(source, tmp_path):
+    target = tmp_path / "target"
+    target.mkdir()
+    stats = tmp_path / "stats.json"
+    args = f"prog -s {source} -t {target} --incremental --stats_json {stats}"
+
+    with patch("sys.argv", args.split()):
+        main()
+    (source / "2024" / "g.jpg").write_bytes(b"gggggg")
+    touch_dir(source / "2024")
+    with patch("sys.argv", args.split()):
+        main()
+
+    counters = json.loads(stats.read_text())["counters"]
+    assert counters["files_unchanged"] == 3
+    assert counters["new_photos"] == 1
+    assert (target / "g.jpg").exists()
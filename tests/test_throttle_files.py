@@ -0,0 +1,251 @@
+# pyright: basic
+
+
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from photomerge.metrics import METRICS
+from photomerge.pipeline import run_pipeline
+from photomerge.throttle_files import (
+    MEGABYTE,
+    READ_LIMIT,
+    WRITE_LIMIT,
+    AdaptiveLimit,
+    RateLimiter,
+    apply_throttle,
+    lower_priority,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    clock = FakeClock()
+    with (
+        patch("photomerge.throttle_files.time.monotonic", clock.monotonic),
+        patch("photomerge.throttle_files.time.sleep", clock.sleep),
+    ):
+        yield clock
+
+
+@pytest.fixture
+def reset_throttle():
+    yield
+    READ_LIMIT.bytes_per_second = WRITE_LIMIT.bytes_per_second = None
+
+
+def test_rate_limiter_unlimited_never_sleeps(clock):
+    limiter = RateLimiter()
+    for _ in range(10):
+        limiter.consume(10 * MEGABYTE)
+
+    assert clock.slept == []
+
+
+def test_rate_limiter_holds_the_rate(clock):
+    METRICS.reset()
+    limiter = RateLimiter(MEGABYTE)
+    for _ in range(4):
+        limiter.consume(MEGABYTE // 2)
+
+    # the first chunk goes at once, each one after waits for the one before
+    assert clock.slept == [0.5, 0.5, 0.5]
+    assert METRICS.get("throttled_seconds") == 1.5
+
+
+def test_rate_limiter_idle_time_isnt_saved_up(clock):
+    limiter = RateLimiter(MEGABYTE)
+    limiter.consume(MEGABYTE)
+    clock.now += 10
+    limiter.consume(MEGABYTE)
+    limiter.consume(MEGABYTE)
+
+    assert clock.slept == [1.0]
+
+
+def test_apply_throttle_sets_the_caps(reset_throttle):
+    apply_throttle({"throttle": {"max_read_mbps": 50, "max_write_mbps": 0}})
+
+    assert READ_LIMIT.bytes_per_second == 50 * MEGABYTE
+    assert WRITE_LIMIT.bytes_per_second is None
+
+
+@pytest.mark.parametrize(
+    "config",
+    [
+        {"throttle": {"max_read_mbps": -1}},
+        {"throttle": {"max_write_mbps": 10}, "workers": {"pool": "process"}},
+    ],
+)
+def test_apply_throttle_rejects_bad_config(config, reset_throttle):
+    with pytest.raises(ValueError):
+        apply_throttle(config)
+
+
+def test_apply_throttle_low_priority(reset_throttle):
+    with patch("photomerge.throttle_files.lower_priority") as lower:
+        apply_throttle({})
+        lower.assert_not_called()
+        apply_throttle({"throttle": {"low_priority": True}})
+        lower.assert_called_once()
+
+
+def test_lower_priority():
+    with (
+        patch("photomerge.throttle_files.os.setpriority") as setpriority,
+        patch("photomerge.throttle_files.platform.machine", return_value="x86_64"),
+        patch("photomerge.throttle_files.ctypes.CDLL") as cdll,
+    ):
+        cdll.return_value.syscall.return_value = 0
+        lower_priority()
+
+    setpriority.assert_called_once_with(0, 0, 19)
+    # ioprio_set(IOPRIO_WHO_PROCESS, self, idle class)
+    cdll.return_value.syscall.assert_called_once_with(251, 1, 0, 3 << 13)
+
+
+def test_lower_priority_failures_are_warnings(caplog):
+    with (
+        patch("photomerge.throttle_files.os.setpriority", side_effect=OSError("no")),
+        patch("photomerge.throttle_files.platform.machine", return_value="sparc"),
+    ):
+        lower_priority()
+
+    assert "CPU priority" in caplog.text
+    assert "I/O priority on sparc" in caplog.text
+
+
+def run_interval(limit, clock, throughput, latency=0.1):
+    # limit.limit tasks, one after the other, the last finishing as the
+    # interval ends, for throughput bytes/s over it
+    tasks = limit.limit
+    clock.now += limit.interval - tasks * latency + 0.001
+    for _ in range(tasks):
+        with limit.slot(int(throughput * limit.interval / tasks)):
+            clock.now += latency
+
+
+def test_adaptive_limit_grows_while_throughput_grows(clock):
+    limit = AdaptiveLimit("hash", 1, 8, interval=2.0)
+    for throughput in [10, 20, 30, 40]:
+        run_interval(limit, clock, throughput * MEGABYTE)
+
+    assert limit.limit == 5
+
+
+def test_adaptive_limit_backs_off_when_throughput_drops(clock):
+    limit = AdaptiveLimit("copy", 1, 8, interval=2.0)
+    for throughput in [10, 20, 30, 15]:
+        run_interval(limit, clock, throughput * MEGABYTE)
+
+    assert limit.limit == 3
+
+
+def test_adaptive_limit_shrinks_when_files_get_slower(clock):
+    limit = AdaptiveLimit("hash", 4, 8, interval=2.0)
+    run_interval(limit, clock, 40 * MEGABYTE, latency=0.1)
+    run_interval(limit, clock, 40 * MEGABYTE, latency=0.3)
+
+    assert limit.limit == 4
+
+
+def test_adaptive_limit_stays_in_bounds(clock):
+    limit = AdaptiveLimit("hash", 10, 3, interval=2.0)
+    assert limit.limit == 3
+    for throughput in [10, 20, 30]:
+        run_interval(limit, clock, throughput * MEGABYTE)
+    assert limit.limit == 3
+
+    limit = AdaptiveLimit("copy", 2, 2, minimum=2, interval=2.0)
+    for throughput in [20, 10, 5, 1]:
+        run_interval(limit, clock, throughput * MEGABYTE)
+    assert limit.limit == 2
+
+
+def test_rate_limiter_counts_bytes_per_thread():
+    limiter = RateLimiter()
+    limiter.consume(100)
+    other = threading.Thread(target=limiter.consume, args=(50,))
+    other.start()
+    other.join()
+
+    assert limiter.thread_bytes() == 100
+
+
+def test_adaptive_limit_ignores_the_duplicate_mix(clock):
+    # a disk reading 50 MB/s whatever the files are: full reads of new photos
+    # or mostly partial hashes of duplicates
+    meter = RateLimiter()
+    limit = AdaptiveLimit("hash", 1, 8, interval=2.0, meter=meter)
+    new_photos = [5 * MEGABYTE]
+    duplicates = [5 * MEGABYTE] + [128 * 1024] * 8
+
+    limits = []
+    for reads in [new_photos, duplicates, new_photos, duplicates, duplicates]:
+        start = clock.now
+        task = 0
+        while clock.now - start < limit.interval:
+            with limit.slot():
+                meter.consume(reads[task % len(reads)])
+                clock.now += reads[task % len(reads)] / (50 * MEGABYTE)
+            task += 1
+        limits.append(limit.limit)
+
+    # one probe up after the first interval, then nothing changes
+    assert limits == [2, 2, 2, 2, 2]
+
+
+def test_adaptive_limit_caps_concurrent_work():
+    limit = AdaptiveLimit("hash", 2, 2, interval=60)
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def work():
+        with limit.slot():
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            threading.Event().wait(0.01)
+            with lock:
+                active[0] -= 1
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert peak[0] <= 2
+
+
+def test_run_pipeline_with_adaptive_limits():
+    saved = []
+    lock = threading.Lock()
+
+    def save(item, result):
+        with lock:
+            saved.append(result)
+
+    run_pipeline(
+        range(50),
+        decide=lambda item: item,
+        save=save,
+        hash_limit=AdaptiveLimit("hash", 1, 4, interval=0.001),
+        copy_limit=AdaptiveLimit("copy", 1, 3, interval=0.001),
+    )
+
+    assert sorted(saved) == list(range(50))
@@ -0,0 +1,155 @@
+# pyright: basic
+
+
+import os
+import signal
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from photomerge import main
+from photomerge import watch_files
+from photomerge.watch_files import InotifyWatcher, PollingWatcher, _Watcher, watch
+
+needs_inotify = pytest.mark.skipif(
+    watch_files._libc is None, reason="inotify is not available"
+)
+
+
+def wait_for(watcher, count, timeout=5.0):
+    changed = []
+    deadline = time.monotonic() + timeout
+    while len(changed) < count and time.monotonic() < deadline:
+        changed += watcher.changes(0.1)
+    return changed
+
+
+@needs_inotify
+def test_inotify_reports_written_files(tmp_path):
+    watcher = InotifyWatcher(tmp_path, {".jpg"}, ["@eaDir"])
+    try:
+        (tmp_path / "a.jpg").write_bytes(b"a")
+        (tmp_path / "notes.txt").write_bytes(b"not a photo")
+        (tmp_path / "@eaDir").mkdir()
+        (tmp_path / "@eaDir" / "thumb.jpg").write_bytes(b"thumb")
+        (tmp_path / "upload.tmp").write_bytes(b"b")
+        (tmp_path / "upload.tmp").rename(tmp_path / "b.jpg")
+
+        assert sorted(path.name for path in wait_for(watcher, 2)) == ["a.jpg", "b.jpg"]
+    finally:
+        watcher.close()
+
+
+@needs_inotify
+def test_inotify_watches_new_directories(tmp_path):
+    watcher = InotifyWatcher(tmp_path, {".jpg"})
+    try:
+        (tmp_path / "day1").mkdir()
+        (tmp_path / "day1" / "a.jpg").write_bytes(b"a")
+        changed = wait_for(watcher, 1)
+        (tmp_path / "day1" / "b.jpg").write_bytes(b"b")
+        changed += wait_for(watcher, 1)
+
+        # a.jpg may be reported by both the directory scan and its own event
+        assert {path.name for path in changed} == {"a.jpg", "b.jpg"}
+    finally:
+        watcher.close()
+
+
+def test_polling_reports_new_and_changed_files(tmp_path):
+    (tmp_path / "old.jpg").write_bytes(b"old")
+    (tmp_path / "same.jpg").write_bytes(b"same")
+    watcher = PollingWatcher(tmp_path, {".jpg"}, interval=0.05)
+
+    (tmp_path / "new.jpg").write_bytes(b"new")
+    (tmp_path / "old.jpg").write_bytes(b"changed")
+
+    assert sorted(path.name for path in wait_for(watcher, 2)) == ["new.jpg", "old.jpg"]
+    assert watcher.changes(0.1) == []
+
+
+def test_create_watcher_falls_back_to_polling(tmp_path):
+    with patch.object(watch_files, "_libc", None):
+        watcher = watch_files.create_watcher(tmp_path, {".jpg"})
+    assert isinstance(watcher, PollingWatcher)
+
+
+class FakeWatcher:
+    def __init__(self, batches):
+        self.batches = list(batches)
+
+    def changes(self, timeout):
+        time.sleep(timeout)
+        return self.batches.pop(0) if self.batches else []
+
+
+def test_watch_waits_for_files_to_settle(tmp_path):
+    photo = tmp_path / "a.jpg"
+    photo.write_bytes(b"first part")
+    handled = []
+    stop = threading.Event()
+
+    def handle(path):
+        handled.append((path, path.read_bytes()))
+        stop.set()
+
+    def upload():
+        time.sleep(0.1)
+        photo.write_bytes(b"first part, second part")
+
+    uploader = threading.Thread(target=upload)
+    uploader.start()
+    watch([FakeWatcher([[photo]])], handle, settle_seconds=0.3, stop=stop)
+    uploader.join()
+
+    assert handled == [(photo, b"first part, second part")]
+
+
+def test_watch_drops_files_that_vanish(tmp_path):
+    photo = tmp_path / "a.jpg"
+    photo.write_bytes(b"a")
+    stop = threading.Event()
+
+    watcher = FakeWatcher([[photo]])
+    photo.unlink()
+    timer = threading.Timer(0.3, stop.set)
+    timer.start()
+    watch([watcher], lambda path: pytest.fail(f"handled {path}"), 0.05, stop)
+    timer.join()
+
+
+def test_main_watch(tmp_path):
+    source, target = tmp_path / "source", tmp_path / "target"
+    source.mkdir()
+    target.mkdir()
+    (source / "waiting.jpg").write_bytes(b"waiting")
+
+    def upload():
+        deadline = time.monotonic() + 10
+        while not (target / "waiting.jpg").exists() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        (source / "arrived.jpg").write_bytes(b"arrived")
+        (source / "copy.jpg").write_bytes(b"waiting")
+        while not (target / "arrived.jpg").exists() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        time.sleep(0.3)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    uploader = threading.Thread(target=upload)
+    uploader.start()
+    with patch("sys.argv", f"prog watch -s {source} -t {target} --settle 0.1".split()):
+        main()
+    uploader.join()
+
+    photos = sorted(path.name for path in target.glob("*.jpg"))
+    assert photos == ["arrived.jpg", "waiting.jpg"]
+
+
+def test_watcher_needs_changes(tmp_path):
+    class NoChanges(_Watcher):
+        pass
+
+    with pytest.raises(TypeError):
+        NoChanges(tmp_path, {".jpg"})